@@ -0,0 +1,35 @@
+# archivar.py — pasa a las tablas *_archivo las jornadas/insumos de meses cerrados hace tiempo
+#
+# Uso (p. ej. desde cron, una vez por noche):
+#   DATABASE_URL=postgresql://... python archivar.py
+#   DATABASE_URL=postgresql://... python archivar.py --meses 3
+#
+# Las filas siguen visibles en listados, reportes y exportes (vistas jornadas_todas/insumos_todas).
+# Reabrir un cierre con "Sobrescribir" las devuelve a las tablas vivas.
+import sys
+import argparse
+
+
+def _args(argv=None):
+    p = argparse.ArgumentParser(description="Archiva las filas de meses cerrados de finca-app.")
+    p.add_argument("--meses", type=int, default=None,
+                   help="meses cerrados que se dejan en las tablas vivas (o DB_ARCHIVO_MESES)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    a = _args(argv)
+    import database as db
+
+    db.create_archivo_tables()
+    movidas = db.archivar_meses_cerrados(a.meses)
+    if movidas is None:
+        print("SQLite: no hay archivo, nada que mover.")
+        return 0
+    for tabla, n in movidas.items():
+        print(f"{tabla:<10} {n:>8} filas archivadas")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+# bench.py — benchmark de los helpers de database.py y de los reportes pandas sobre datos sintéticos
+#
+# Uso:
+#   BENCH_DATABASE_URL=postgresql://... python bench.py --owners 3 --years 3 --out bench.json
+#   python bench.py --dsn postgresql://... --baseline bench.json --tolerance 0.25
+#
+# Nunca usa DATABASE_URL: los datos sintéticos (owners "bench_*") se borran y se vuelven a
+# sembrar en cada corrida, así que apunta siempre a una base local/desechable.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import statistics
+import subprocess
+
+OWNER_PREFIX = "bench_"
+TIPOS_INSUMO = ["Abono", "Fumigación", "Cal", "Herbicida"]
+ACTIVIDADES = ["Chapea", "Poda", "Deshija", "Cosecha", "Abonado", "Fumigación"]
+NOMBRES = ["Juan", "María", "José", "Ana", "Luis", "Carmen", "Jorge", "Rosa", "Carlos", "Elena"]
+APELLIDOS = ["Pérez", "Rojas", "Mora", "Jiménez", "Vargas", "Solís", "Castro", "Araya", "Quesada", "Chaves"]
+
+
+def _args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark de finca-app con datos sintéticos.")
+    p.add_argument("--dsn", default=os.getenv("BENCH_DATABASE_URL"),
+                   help="Postgres de pruebas (o BENCH_DATABASE_URL). Nunca se lee DATABASE_URL.")
+    p.add_argument("--owners", type=int, default=2)
+    p.add_argument("--workers", type=int, default=25, help="trabajadores por owner")
+    p.add_argument("--fincas", type=int, default=8, help="fincas/lotes por owner")
+    p.add_argument("--years", type=float, default=2.0, help="años de historia hacia atrás")
+    p.add_argument("--jornadas-por-dia", type=int, default=15, help="jornadas por owner y día laboral")
+    p.add_argument("--insumos-por-semana", type=int, default=6, help="insumos por owner y semana")
+    p.add_argument("--plans", type=int, default=200, help="planes (mitad recurrentes) por owner")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--repeat", type=int, default=5, help="repeticiones por caso")
+    p.add_argument("--skip-seed", action="store_true", help="reusar los datos bench_* ya sembrados")
+    p.add_argument("--only", default=None, help="subcadena: solo casos cuyo nombre la contenga")
+    p.add_argument("--preparadas", type=int, default=0, metavar="HILOS",
+                   help="además, lecturas calientes con y sin PREPARE desde HILOS llamadores concurrentes")
+    p.add_argument("--out", default=None, help="JSON de resultados")
+    p.add_argument("--baseline", default=None, help="JSON de una corrida anterior para comparar")
+    p.add_argument("--tolerance", type=float, default=0.20,
+                   help="regresión permitida sobre la mediana del baseline (0.20 = +20%%)")
+    return p.parse_args(argv)
+
+
+# ---------- Siembra ----------
+
+def limpiar(db):
+    conn = db.connect_db(); cur = conn.cursor()
+    try:
+        like = OWNER_PREFIX + "%"
+        for t in ("pagos_mes", "plan_labores", "jornadas", "insumos", "jornadas_archivo", "insumos_archivo",
+                  "trabajadores", "fincas", "tarifas_user"):
+            cur.execute(f"DELETE FROM {t} WHERE tenant_id IN (SELECT tenant_id FROM users WHERE username LIKE %s);",
+                        (like,))
+        cur.execute("DELETE FROM users WHERE username LIKE %s;", (like,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sembrar(db, a):
+    import bcrypt
+    from psycopg2.extras import execute_values
+
+    rnd = random.Random(a.seed)
+    hoy = datetime.date.today()
+    desde = hoy - datetime.timedelta(days=int(a.years * 365))
+    dias = [desde + datetime.timedelta(days=i) for i in range((hoy - desde).days + 1)]
+    laborales = [d for d in dias if d.weekday() < 6]
+    owners = [f"{OWNER_PREFIX}{i}" for i in range(a.owners)]
+    conteo = {"owners": len(owners), "trabajadores": 0, "fincas": 0, "jornadas": 0, "insumos": 0, "planes": 0}
+
+    clave = bcrypt.hashpw(b"bench", bcrypt.gensalt()).decode()
+    conn = db.connect_db(); cur = conn.cursor()
+    try:
+        for owner in owners:
+            cur.execute("INSERT INTO users (username, password) VALUES (%s, %s) RETURNING tenant_id;", (owner, clave))
+            tenant = cur.fetchone()[0]
+            nombres_fincas = [f"Lote {i + 1:02d}" for i in range(a.fincas)]
+            trabajadores = []
+            while len(trabajadores) < a.workers:
+                n = (rnd.choice(NOMBRES), f"{rnd.choice(APELLIDOS)} {len(trabajadores)}")
+                trabajadores.append(n)
+            fincas = [r[0] for r in execute_values(cur, "INSERT INTO fincas (tenant_id, nombre) VALUES %s RETURNING id",
+                                                   [(tenant, f) for f in nombres_fincas], fetch=True)]
+            ids = [r[0] for r in execute_values(cur, "INSERT INTO trabajadores (tenant_id, nombre, apellido) VALUES %s RETURNING id",
+                                                [(tenant, n, ap) for n, ap in trabajadores], fetch=True)]
+            cur.execute("INSERT INTO tarifas_user (tenant_id, pago_dia, pago_hora_extra) VALUES (%s, 9000, 2000);",
+                        (tenant,))
+
+            jornadas = []
+            for d in laborales:
+                for _ in range(a.jornadas_por_dia):
+                    hex_ = rnd.choice([0, 0, 0, 0.5, 1, 1.5, 2])
+                    jornadas.append((tenant, rnd.choice(ids), d, rnd.choice(fincas), rnd.choice(ACTIVIDADES),
+                                     1, 6, hex_))
+            execute_values(cur,
+                "INSERT INTO jornadas (tenant_id, trabajador_id, fecha, finca_id, actividad, dias, horas_normales, horas_extra) VALUES %s",
+                jornadas, page_size=5000)
+
+            insumos = []
+            for _ in range(int(len(dias) / 7 * a.insumos_por_semana)):
+                tipo = rnd.choice(TIPOS_INSUMO)
+                cant = round(rnd.uniform(1, 40), 1); precio = rnd.choice([4500, 8000, 15000, 22000])
+                insumos.append((tenant, rnd.choice(dias), rnd.choice(fincas), tipo, f"Etapa {rnd.randint(1, 3)}",
+                                f"Producto {rnd.randint(1, 20)}", str(rnd.randint(20, 80)), cant, precio))
+            execute_values(cur,
+                "INSERT INTO insumos (tenant_id, fecha, finca_id, tipo, etapa, producto, dosis, cantidad, precio_unitario) VALUES %s",
+                insumos, page_size=5000)
+
+            planes = []
+            for i in range(a.plans):
+                recurrente = i % 2 == 0
+                planes.append((tenant, hoy + datetime.timedelta(days=rnd.randint(-60, 120)), rnd.choice(fincas),
+                               rnd.choice(TIPOS_INSUMO + ["Jornada"]), rnd.choice(ids), rnd.choice(ACTIVIDADES),
+                               rnd.choice(["pendiente", "pendiente", "realizado"]),
+                               rnd.choice([15, 30, 45]) if recurrente else None,
+                               rnd.choice([None, 3, 6]) if recurrente else None, recurrente))
+            execute_values(cur,
+                "INSERT INTO plan_labores (tenant_id, fecha, finca_id, tipo, trabajador_id, actividad, estado, recur_every_days, recur_times, recur_autorenew) VALUES %s",
+                planes, page_size=5000)
+
+            conteo["trabajadores"] += len(trabajadores); conteo["fincas"] += len(fincas)
+            conteo["jornadas"] += len(jornadas); conteo["insumos"] += len(insumos); conteo["planes"] += len(planes)
+        conn.commit()
+        db.ensure_particiones()  # muda lo sembrado en años sin partición fuera de la DEFAULT
+        cur.execute("ANALYZE jornadas; ANALYZE insumos; ANALYZE plan_labores;")
+        conn.commit()
+        db.refrescar_costos()
+    finally:
+        conn.close()
+    return owners, conteo
+
+
+# ---------- Casos ----------
+
+def casos(db, rep, owner):
+    """Lista de (nombre, callable). Las escrituras se deshacen solas o son idempotentes."""
+    hoy = datetime.date.today()
+    mes_fin = hoy.replace(day=1) - datetime.timedelta(days=1)
+    mes_ini = mes_fin.replace(day=1)
+    sem_ini = hoy - datetime.timedelta(days=(hoy.weekday() + 1) % 7)
+    sem_fin = sem_ini + datetime.timedelta(days=6)
+    fecha = mes_fin.isoformat()
+    trabajador = db.get_trabajadores(owner)[0][0]
+    lote = db.get_all_fincas(owner)[0]
+    jornadas = db.get_all_jornadas(owner)
+    df_j = rep.df_jornadas(jornadas)
+    abonos = db.get_insumos_by_tipo("Abono", owner)
+    plan_ids = [p[0] for p in db.list_plans(owner, hoy - datetime.timedelta(days=60), hoy + datetime.timedelta(days=120))]
+    cierre = db.crear_cierre_mensual(mes_ini, mes_fin, owner, owner, 9000, 2000, overwrite=True)
+    estado = {"jornada": None, "insumo": None}
+
+    def add_jornada():
+        db.add_jornada(trabajador, fecha, lote, "Bench", 1, 6, 0, owner)
+        estado["jornada"] = db.get_last_jornada_by_date(fecha, owner)
+
+    def update_jornada():
+        j = estado["jornada"]
+        if j:
+            db.update_jornada(j[0], trabajador, fecha, lote, "Bench", 1, 6, 1, owner)
+
+    def add_insumo():
+        db.add_insumo(fecha, lote, "Abono", "Etapa 1", "Bench", "50", 2, 15000, owner)
+        estado["insumo"] = db.get_last_abono_by_date(fecha, owner)
+
+    def update_insumo():
+        i = estado["insumo"]
+        if i:
+            db.update_insumo(i[0], "Abono", fecha, lote, "Etapa 1", "Bench", "50", 3, 15000, owner)
+
+    def add_y_marcar_plan():
+        pid = db.add_plan(owner, hoy, lote, "Fumigación", producto="Bench", cantidad=1.0, precio_unitario=100.0,
+                          recur_every_days=30, recur_times=2, recur_autorenew=True)
+        db.postpone_plan(owner, pid, 1)
+        db.mark_plan_done_and_autorenew(owner, pid, owner)
+
+    casos = [
+        # lecturas
+        ("read.get_all_fincas", lambda: db.get_all_fincas(owner)),
+        ("read.get_all_trabajadores", lambda: db.get_all_trabajadores(owner)),
+        ("read.get_trabajadores", lambda: db.get_trabajadores(owner)),
+        ("read.get_tarifas", lambda: db.get_tarifas(owner)),
+        ("read.get_all_jornadas", lambda: db.get_all_jornadas(owner)),
+        ("read.get_last_jornada_by_date", lambda: db.get_last_jornada_by_date(fecha, owner)),
+        ("read.get_jornadas_between", lambda: db.get_jornadas_between(mes_ini, mes_fin, owner)),
+        ("read.get_insumos_between", lambda: db.get_insumos_between(mes_ini, mes_fin, owner)),
+        ("read.get_last_abono_by_date", lambda: db.get_last_abono_by_date(fecha, owner)),
+        ("read.get_last_fumigacion_by_date", lambda: db.get_last_fumigacion_by_date(fecha, owner)),
+        ("read.get_last_cal_by_date", lambda: db.get_last_cal_by_date(fecha, owner)),
+        ("read.get_last_herbicida_by_date", lambda: db.get_last_herbicida_by_date(fecha, owner)),
+        ("read.listar_cierres", lambda: db.listar_cierres(owner)),
+        ("read.leer_cierre_detalle", lambda: db.leer_cierre_detalle(cierre, owner)),
+        ("read.list_plans", lambda: db.list_plans(owner, hoy - datetime.timedelta(days=30), hoy + datetime.timedelta(days=90))),
+        ("read.get_plan", lambda: db.get_plan(owner, plan_ids[0]) if plan_ids else None),
+        ("read.cargar_en_paralelo.ver_registros", lambda: db.cargar_en_paralelo(
+            tarifas=(db.get_tarifas, owner), jornadas=(db.get_all_jornadas, owner),
+            **{f"insumos_{t}": (db.get_insumos_by_tipo, t, owner) for t in TIPOS_INSUMO})),
+    ]
+    casos += [(f"read.get_insumos_by_tipo.{t}", (lambda t=t: db.get_insumos_by_tipo(t, owner))) for t in TIPOS_INSUMO]
+    casos += [
+        # lectura columnar a DataFrame tipado vs. tuplas + reportes.df_jornadas / df_insumos_tipo
+        ("read.get_all_jornadas+df_jornadas", lambda: rep.df_jornadas(db.get_all_jornadas(owner))),
+        ("read.get_jornadas_df", lambda: db.get_jornadas_df(owner)),
+        ("read.get_jornadas_df.mes", lambda: db.get_jornadas_df(owner, mes_ini, mes_fin)),
+        ("read.get_insumos_by_tipo+df_insumos_tipo.abono",
+         lambda: rep.df_insumos_tipo(db.get_insumos_by_tipo("Abono", owner), "Abono")),
+        ("read.get_insumos_df+df_insumos_tipo.abono",
+         lambda: rep.df_insumos_tipo(db.get_insumos_df(owner, tipo="Abono"), "Abono")),
+        ("read.get_insumos_df.mes", lambda: db.get_insumos_df(owner, mes_ini, mes_fin)),
+        # costos por lote: filas pre-agregadas de la vista materializada vs. agregar la historia cruda
+        ("read.get_costos_lote_df.anio", lambda: rep.costos_por_lote(
+            db.get_costos_lote_df(owner, hoy - datetime.timedelta(days=365), hoy), 9000, 2000)),
+        ("read.get_costos_refresco", lambda: db.get_costos_refresco()),
+        ("read.get_jornadas_df+get_insumos_df.anio", lambda: (
+            db.get_jornadas_df(owner, hoy - datetime.timedelta(days=365), hoy),
+            db.get_insumos_df(owner, hoy - datetime.timedelta(days=365), hoy))),
+        ("ddl.refrescar_costos", lambda: db.refrescar_costos()),
+        # resúmenes diarios (jornadas_dia / insumos_dia) vs. sumar cada registro del rango
+        ("read.get_resumen_jornadas_df+resumen_nomina_mes.mes", lambda: rep.resumen_nomina_mes(
+            db.get_resumen_jornadas_df(owner, mes_ini, mes_fin), 9000, 2000)),
+        ("read.get_jornadas_df+resumen_nomina_mes.mes", lambda: rep.resumen_nomina_mes(
+            db.get_jornadas_df(owner, mes_ini, mes_fin), 9000, 2000)),
+        ("read.get_resumen_jornadas_df+resumen_por_trabajador", lambda: rep.resumen_por_trabajador(
+            db.get_resumen_jornadas_df(owner), 9000, 2000, "Total Ganado")),
+        ("read.get_resumen_insumos_df.mes", lambda: db.get_resumen_insumos_df(owner, mes_ini, mes_fin)),
+    ]
+    casos += [
+        # escrituras
+        ("write.set_tarifas", lambda: db.set_tarifas(owner, 9000, 2000)),
+        ("write.add_finca.existente", lambda: db.add_finca(lote, owner)),
+        ("write.add_jornada", add_jornada),
+        ("write.update_jornada", update_jornada),
+        ("write.add_insumo", add_insumo),
+        ("write.update_insumo", update_insumo),
+        ("write.plan_add_postpone_mark", add_y_marcar_plan),
+        ("write.crear_cierre_mensual", lambda: db.crear_cierre_mensual(mes_ini, mes_fin, owner, owner, 9000, 2000, overwrite=True)),
+        # transformaciones pandas / PDF
+        ("report.df_jornadas", lambda: rep.df_jornadas(jornadas)),
+        ("report.resumen_nomina_mes", lambda: rep.resumen_nomina_mes(df_j, 9000, 2000)),
+        ("report.resumen_por_trabajador", lambda: rep.resumen_por_trabajador(df_j, 9000, 2000, "Total Ganado")),
+        ("report.semana", lambda: rep.detalle_semana(rep.filtrar_semana(df_j, sem_ini, sem_fin))),
+        ("report.df_insumos_tipo.abono", lambda: rep.df_insumos_tipo(abonos, "Abono")),
+        ("report.pdf_resumen", lambda: rep.pdf_resumen(
+            rep.resumen_por_trabajador(df_j, 9000, 2000, "Total a Pagar"), sem_ini, sem_fin)),
+    ]
+    return casos
+
+
+def _medir(fn, repeat: int):
+    fn()  # calentamiento (pool, PREPARE, imports perezosos)
+    tiempos = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t) * 1000)
+    tiempos.sort()
+    p95 = tiempos[min(len(tiempos) - 1, int(round(0.95 * (len(tiempos) - 1))))]
+    return {"mediana_ms": round(statistics.median(tiempos), 3), "p95_ms": round(p95, 3),
+            "min_ms": round(tiempos[0], 3), "n": repeat}
+
+
+def _cpu_servidor(db):
+    """Segundos de CPU de los backends de esta base (solo si Postgres corre en esta máquina), o None."""
+    conn = db.connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("SELECT pid FROM pg_stat_activity WHERE datname = current_database();")
+        pids = [pid for (pid,) in cur.fetchall()]
+    finally:
+        conn.close()
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as fh:
+                campos = fh.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        total += int(campos[11]) + int(campos[12])  # utime + stime
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def _ronda(fns, hilos: int, vueltas: int) -> list:
+    """Cada hilo recorre `fns` `vueltas` veces; devuelve la latencia (ms) de cada llamada."""
+    tiempos, lock = [], threading.Lock()
+
+    def llamador():
+        propios = []
+        for _ in range(vueltas):
+            for fn in fns:
+                t = time.perf_counter()
+                fn()
+                propios.append((time.perf_counter() - t) * 1000)
+        with lock:
+            tiempos.extend(propios)
+
+    hs = [threading.Thread(target=llamador) for _ in range(hilos)]
+    for h in hs:
+        h.start()
+    for h in hs:
+        h.join()
+    return tiempos
+
+
+def medir_preparadas(db, owner, hilos: int, vueltas: int = 30):
+    """
+    Las lecturas calientes (las que usan prepare=) sin PREPARE y con PREPARE, con `hilos` llamadores a la
+    vez sobre el mismo pool, como varias sesiones de Streamlit. Devuelve por modo llamadas/s, p50/p95,
+    aciertos de la caché de preparadas y CPU de los backends.
+    """
+    hoy = datetime.date.today()
+    mes_ini, fecha = hoy.replace(day=1), hoy
+    calientes = [
+        lambda: db.get_all_trabajadores(owner),
+        lambda: db.get_all_fincas(owner),
+        lambda: db.get_tarifas(owner),
+        lambda: db.get_jornadas_between(mes_ini, hoy, owner),
+        lambda: db.get_last_jornada_by_date(fecha, owner),
+        lambda: db.get_last_abono_by_date(fecha, owner),
+        lambda: db.list_plans(owner, hoy - datetime.timedelta(days=30), hoy + datetime.timedelta(days=90)),
+    ]
+    previo = db.DB_PREPARE
+    resultados = {}
+    try:
+        for modo, preparar in (("sin_prepare", False), ("prepare", True)):
+            db.DB_PREPARE = preparar
+            _ronda(calientes, hilos, 1)  # calentamiento: conexiones del pool abiertas (y sentencias preparadas)
+            antes = db.get_db_metrics()["cache"]
+            cpu0 = _cpu_servidor(db)
+            t0 = time.perf_counter()
+            tiempos = _ronda(calientes, hilos, vueltas)
+            seg = time.perf_counter() - t0
+            cpu1 = _cpu_servidor(db)
+            despues = db.get_db_metrics()["cache"]
+            tiempos.sort()
+            aciertos = despues["prepared_hit"] - antes["prepared_hit"]
+            fallos = despues["prepared_miss"] - antes["prepared_miss"]
+            resultados[modo] = {
+                "hilos": hilos, "llamadas": len(tiempos), "llamadas_s": round(len(tiempos) / seg, 1),
+                "p50_ms": round(statistics.median(tiempos), 3),
+                "p95_ms": round(tiempos[int(round(0.95 * (len(tiempos) - 1)))], 3),
+                "aciertos": round(aciertos / (aciertos + fallos), 3) if aciertos + fallos else None,
+                "cpu_servidor_ms_por_llamada": (round((cpu1 - cpu0) * 1000 / len(tiempos), 3)
+                                                if cpu0 is not None and cpu1 is not None else None),
+            }
+    finally:
+        db.DB_PREPARE = previo
+    return resultados
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _comparar(resultados, baseline, tolerancia):
+    """Devuelve la lista de casos cuya mediana empeoró más que `tolerancia` respecto al baseline."""
+    previos = baseline.get("resultados", {})
+    regresiones = []
+    print(f"\n{'caso':<42} {'base ms':>10} {'ahora ms':>10} {'cambio':>8}")
+    for nombre, r in resultados.items():
+        b = previos.get(nombre)
+        if not b:
+            print(f"{nombre:<42} {'—':>10} {r['mediana_ms']:>10.2f} {'nuevo':>8}")
+            continue
+        cambio = (r["mediana_ms"] - b["mediana_ms"]) / b["mediana_ms"] if b["mediana_ms"] else 0.0
+        marca = "  ✗" if cambio > tolerancia else ""
+        print(f"{nombre:<42} {b['mediana_ms']:>10.2f} {r['mediana_ms']:>10.2f} {cambio:>+7.0%}{marca}")
+        if cambio > tolerancia:
+            regresiones.append(nombre)
+    return regresiones
+
+
+def main(argv=None):
+    a = _args(argv)
+    if not a.dsn:
+        sys.exit("Falta --dsn o BENCH_DATABASE_URL (no se usa DATABASE_URL a propósito).")
+    os.environ["DATABASE_URL"] = a.dsn  # database.py lee la URL al conectar
+    import database as db
+    import reportes as rep
+
+    for crear in (db.ensure_tenant_ids, db.create_users_table, db.create_trabajadores_table, db.create_fincas_table, db.create_jornadas_table,
+                  db.create_insumos_table, db.create_tarifas_table, db.create_cierres_tables,
+                  db.ensure_cierres_schema, db.create_plan_table,
+                  db.ensure_trabajador_fk, db.ensure_finca_fk, db.ensure_particiones,
+                  db.ensure_integridad_numerica, db.create_archivo_tables, db.create_resumenes_diarios,
+                  db.create_costos_views):
+        crear()
+
+    conteo = None
+    if not a.skip_seed:
+        t = time.perf_counter()
+        limpiar(db)
+        owners, conteo = sembrar(db, a)
+        print(f"Sembrado en {time.perf_counter() - t:.1f}s: {conteo}")
+    owner = f"{OWNER_PREFIX}0"
+
+    resultados = {}
+    for nombre, fn in casos(db, rep, owner):
+        if a.only and a.only not in nombre:
+            continue
+        resultados[nombre] = r = _medir(fn, a.repeat)
+        print(f"{nombre:<42} mediana {r['mediana_ms']:>9.2f} ms   p95 {r['p95_ms']:>9.2f} ms")
+
+    preparadas = None
+    if a.preparadas:
+        preparadas = medir_preparadas(db, owner, a.preparadas)
+        print(f"\nLecturas calientes, {a.preparadas} hilos:")
+        for modo, r in preparadas.items():
+            cpu = "—" if r["cpu_servidor_ms_por_llamada"] is None else f"{r['cpu_servidor_ms_por_llamada']:.3f}"
+            print(f"{modo:<12} {r['llamadas_s']:>9.1f} llamadas/s   p50 {r['p50_ms']:>7.2f} ms   "
+                  f"p95 {r['p95_ms']:>7.2f} ms   aciertos {r['aciertos']}   CPU servidor {cpu} ms/llamada")
+
+    salida = {
+        "meta": {"git": _git_rev(), "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "python": sys.version.split()[0],
+                 "params": {k: v for k, v in vars(a).items() if k not in ("dsn", "out", "baseline")},
+                 "filas": conteo},
+        "resultados": resultados,
+        "preparadas": preparadas,
+    }
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as fh:
+            json.dump(salida, fh, indent=2, ensure_ascii=False)
+        print(f"\nResultados en {a.out}")
+
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as fh:
+            regresiones = _comparar(resultados, json.load(fh), a.tolerance)
+        if regresiones:
+            print(f"\nRegresiones (> {a.tolerance:.0%}): {', '.join(regresiones)}")
+            return 1
+        print("\nSin regresiones.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+# costos.py — recalcula la vista materializada costos_lote_mes (página "Costos por Lote")
+#
+# Uso (p. ej. desde cron cada 15 minutos, con el rol dueño de la vista):
+#   DATABASE_URL=postgresql://... python costos.py
+#
+# El REFRESH es CONCURRENTLY: la página sigue leyendo la versión anterior mientras tanto. La página no
+# recalcula nunca; sólo avisa si el último cálculo tiene más de DB_COSTOS_MAX_SEG segundos.
+import sys
+import argparse
+
+
+def _args(argv=None):
+    p = argparse.ArgumentParser(description="Recalcula los costos por lote y mes de finca-app.")
+    p.add_argument("--si-vieja", type=int, default=None, metavar="SEG",
+                   help="sólo si el último cálculo tiene más de SEG segundos")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    a = _args(argv)
+    import database as db
+
+    db.create_costos_views()
+    refrescada = db.refrescar_costos(a.si_vieja)
+    if refrescada is None:
+        print("SQLite: los costos se calculan al leer, nada que recalcular.")
+        return 0
+    print(f"costos_lote_mes calculada el {refrescada:%Y-%m-%d %H:%M:%S}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
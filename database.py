@@ -1,51 +1,973 @@
-# database.py — Postgres (psycopg2) multi-usuario por "owner" (RLS listo)
+# database.py — Postgres (psycopg2) multi-usuario por tenant_id (RLS listo)
 import os
+import re
+import datetime
+import json
 import time
-import datetime  # necesario para mark_plan_done_and_autorenew
+import random
+import inspect
+import functools
+import itertools
+import contextlib
+import threading
+import queue
+from collections import deque
+from decimal import Decimal
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, Future
 import bcrypt
+import numpy as np
+import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
+import psycopg2.errors
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2 import OperationalError, IntegrityError
+import db_sqlite
+import outbox
+
+# ---------------------------------
+# Pool de conexiones (una por hilo/consulta en vuelo)
+# ---------------------------------
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))        # conexiones que se abren al crear el pool
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))       # tope de conexiones abiertas por proceso (y ociosas que se conservan)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seg. esperando una conexión libre
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))  # seg. para abrir una conexión nueva (sin red)
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))          # hilos para cargar_en_paralelo
+DB_FETCH_CHUNK = int(os.getenv("DB_FETCH_CHUNK", "5000"))  # filas por bloque en las lecturas a DataFrame
+DB_LOTE_EDICION = int(os.getenv("DB_LOTE_EDICION", "500"))  # filas por UPDATE ... FROM (VALUES ...) del editor
+DB_COSTOS_MAX_SEG = int(os.getenv("DB_COSTOS_MAX_SEG", "900"))  # antigüedad de costos_lote_mes desde la que la página avisa
+DB_COSTOS_TIMEOUT_MS = int(os.getenv("DB_COSTOS_TIMEOUT_MS", "600000"))  # tope del REFRESH de costos_lote_mes
+# Sentencias preparadas del lado del servidor. Ponlo en 0 detrás de pgbouncer en modo "transaction".
+DB_PREPARE = os.getenv("DB_PREPARE", "1") == "1"
+
+# Política por llamada (ver db_policy)
+DB_RETRIES = int(os.getenv("DB_RETRIES", "3"))                    # reintentos extra en lecturas
+DB_BACKOFF_BASE = float(os.getenv("DB_BACKOFF_BASE", "0.2"))      # seg., se duplica en cada intento
+DB_BACKOFF_MAX = float(os.getenv("DB_BACKOFF_MAX", "3"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "5"))  # fallos seguidos para abrir
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "30"))  # seg. fallando rápido
+
+# Instrumentación (ver get_db_metrics)
+DB_METRICS_BUFFER = int(os.getenv("DB_METRICS_BUFFER", "5000"))   # últimas llamadas en memoria
+DB_METRICS_FILE = os.getenv("DB_METRICS_FILE")                    # JSONL opcional, una línea por llamada
+# Consultas lentas (ver get_slow_queries)
+DB_SLOW_MS = float(os.getenv("DB_SLOW_MS", "500"))                # umbral; 0 lo apaga
+DB_SLOW_BUFFER = int(os.getenv("DB_SLOW_BUFFER", "200"))          # últimas consultas lentas en memoria
+DB_SLOW_FILE = os.getenv("DB_SLOW_FILE")                          # JSONL opcional que sobrevive reinicios
+DB_SLOW_EXPLAIN = os.getenv("DB_SLOW_EXPLAIN", "1") == "1"        # EXPLAIN ANALYZE de lecturas lentas
+DB_SLOW_EXPLAIN_EVERY = float(os.getenv("DB_SLOW_EXPLAIN_EVERY", "300"))  # seg. entre planes de la misma sentencia
+DB_GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "0") == "1"        # agrupa inserts concurrentes en un commit
+DB_GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "5"))    # ventana para juntar filas
+DB_GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "500"))  # filas máximas por commit
+
+# Cola offline (outbox.py): escrituras sin red que se reenvían al volver la conexión
+OUTBOX_SYNC_EVERY = float(os.getenv("OUTBOX_SYNC_EVERY", "15"))    # seg. entre intentos de sincronizar
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))                # entradas por transacción al reenviar
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "5"))   # luego queda apartada para revisión
+
+# Particiones anuales de jornadas/insumos por fecha
+DB_PARTICIONES_ADELANTE = int(os.getenv("DB_PARTICIONES_ADELANTE", "2"))  # años futuros con partición ya creada
+DB_ARCHIVO_MESES = int(os.getenv("DB_ARCHIVO_MESES", "6"))  # meses cerrados que siguen en las tablas vivas
+
+_POOLS: dict = {}
+_POOL_SLOTS = threading.BoundedSemaphore(DB_POOL_MAX)
+_POOL_USO: dict = {}  # url -> {"en_uso": prestadas, "ociosas": id() de las devueltas abiertas}, bajo _POOL_LOCK
+_POOL_LOCK = threading.Lock()
+_EXECUTOR = None
+
+
+class DBConnectionError(RuntimeError):
+    """No se pudo abrir conexión: nada llegó al servidor, así que reintentar es seguro."""
+
+
+class DBUnavailable(RuntimeError):
+    """Circuito abierto: la BD viene fallando y se responde sin esperar."""
+
+
+# ---------------------------------
+# Tipos de fila: tuplas con nombre (sin dict por fila). Siguen siendo tuplas, así que
+# desempaquetar por posición sigue andando; el orden de los campos es el del SELECT.
+# ---------------------------------
+class Jornada(NamedTuple):
+    id: int
+    trabajador: str
+    fecha: datetime.date
+    lote: str | None
+    actividad: str | None
+    dias: int
+    horas_normales: Decimal
+    horas_extra: Decimal
+
+
+class Insumo(NamedTuple):
+    id: int
+    fecha: datetime.date | None
+    lote: str | None
+    tipo: str | None
+    etapa: str | None
+    producto: str | None
+    dosis: str | None
+    cantidad: Decimal | None
+    precio_unitario: Decimal | None
+    costo_total: Decimal | None
+
+
+class Plan(NamedTuple):
+    id: int
+    fecha: datetime.date
+    lote: str
+    tipo: str
+    trabajador: str | None
+    actividad: str | None
+    etapa: str | None
+    producto: str | None
+    dosis: str | None
+    cantidad: Decimal | None
+    precio_unitario: Decimal | None
+    dias: Decimal | None
+    horas_extra: Decimal | None
+    estado: str
+    recur_every_days: int | None
+    recur_times: int | None
+    recur_autorenew: bool
+    trabajador_id: int | None
+
+
+class Cierre(NamedTuple):
+    id: int
+    mes_ini: datetime.date
+    mes_fin: datetime.date
+    creado_por: str | None
+    created_at: datetime.datetime
+    total_nomina: Decimal
+    total_insumos: Decimal
+    total_general: Decimal
+
+
+class _FincaCursor(psycopg2.extensions.cursor):
+    """
+    Cursor que cuenta filas y bytes (aprox. texto del protocolo, según la primera fila de cada bloque).
+    Con `fila` (un tipo de fila; lo fija _run) los fetch* devuelven ese tipo en vez de tuplas.
+    """
+
+    fila = None
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _count_fetched((row,))
+            if self.fila is not None:
+                row = self.fila._make(row)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        _count_fetched(rows)
+        return rows if self.fila is None else list(map(self.fila._make, rows))
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _count_fetched(rows)
+        return rows if self.fila is None else list(map(self.fila._make, rows))
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+
+class _FincaConnection(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias ya PREPAREó (mueren con ella al reciclarse)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = _FincaCursor
+
+
+class _PooledConnection:
+    """Conexión prestada por el pool: close() la devuelve en vez de cerrarla."""
+
+    __slots__ = ("_pool", "_conn", "_url")
+
+    def __init__(self, pool, conn, url):
+        self._pool = pool
+        self._conn = conn
+        self._url = url
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            # putconn hace rollback si quedó una transacción abierta (SET LOCAL incluido)
+            self._pool.putconn(conn)
+            _uso_pool(self._url, conn, -1)
+        finally:
+            _POOL_SLOTS.release()
+
+
+class _TxConnection:
+    """
+    Conexión compartida por varias llamadas (reenvío del outbox): commit/close los hace quien la abrió.
+    rollback() vuelve al SAVEPOINT de la entrada en curso: no deshace las anteriores del lote.
+    """
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._conn.cursor().execute("ROLLBACK TO SAVEPOINT outbox_entrada;")
+        _CALL.tx_revertida = True
+
+    def close(self):
+        pass
+
+
+def _get_pool(url: str):
+    pool = _POOLS.get(url)
+    if pool is None:
+        with _POOL_LOCK:
+            pool = _POOLS.get(url)
+            if pool is None:
+                extra = {} if "connect_timeout=" in url else {"connect_timeout": DB_CONNECT_TIMEOUT}
+                pool = ThreadedConnectionPool(0, DB_POOL_MAX, url, connection_factory=_FincaConnection, **extra)
+                # putconn cierra toda conexión devuelta por encima de minconn: con DB_POOL_MIN, cada
+                # cargar_en_paralelo de más lecturas reconectaba (TCP+TLS+auth) y perdía sus PREPARE.
+                # Se abren DB_POOL_MIN al arrancar y las que se abran después se conservan hasta DB_POOL_MAX.
+                pool.minconn = DB_POOL_MAX
+                abiertas = []
+                try:
+                    for _ in range(min(DB_POOL_MIN, DB_POOL_MAX)):
+                        abiertas.append(pool.getconn())
+                except Exception:
+                    pool.closeall()
+                    raise
+                for conn in abiertas:
+                    pool.putconn(conn)
+                _POOL_USO[url] = {"en_uso": 0, "ociosas": {id(c) for c in abiertas}}
+                _POOLS[url] = pool
+    return pool
+
+
+def _uso_pool(url: str, conn, delta: int):
+    """Lleva la cuenta de get_db_metrics: prestada (+1), devuelta (-1) o descartada por cerrada (0)."""
+    with _POOL_LOCK:
+        uso = _POOL_USO.setdefault(url, {"en_uso": 0, "ociosas": set()})
+        uso["en_uso"] += delta
+        if delta < 0 and not conn.closed:
+            uso["ociosas"].add(id(conn))
+        else:
+            uso["ociosas"].discard(id(conn))
+
 
 # ---------------------------------
 # Conexión (compatible con Supabase/Railway)
 # ---------------------------------
-def connect_db():
+def _database_url():
     url = os.getenv("DATABASE_URL")
     if not url:
         try:
             import streamlit as st  # opcional si corres en Streamlit
             url = st.secrets["DATABASE_URL"]
         except Exception:
-            raise RuntimeError(
-                "DATABASE_URL no está configurada en variables de entorno ni en st.secrets."
-            )
-    url = url.strip()
+            return None
+    return url.strip()
+
+
+def connect_db():
+    """
+    Postgres (pool) o SQLite embebido según el esquema del DSN:
+    postgresql://... | sqlite:///finca.db (relativa) | sqlite:////ruta/absoluta/finca.db
+    """
+    tx = getattr(_CALL, "tx", None)
+    if tx is not None:
+        return _TxConnection(tx)
+    url = _database_url()
+    if not url:
+        raise RuntimeError(
+            "DATABASE_URL no está configurada en variables de entorno ni en st.secrets."
+        )
+    if db_sqlite.es_sqlite(url):
+        return db_sqlite.connect(url, _count_fetched)
     if "sslmode=" not in url:
         url = url + ("&sslmode=require" if "?" in url else "?sslmode=require")
+    if not _POOL_SLOTS.acquire(timeout=DB_POOL_TIMEOUT):
+        raise RuntimeError(f"Pool de conexiones agotado ({DB_POOL_MAX}) tras {DB_POOL_TIMEOUT:.0f}s de espera.")
     try:
-        return psycopg2.connect(url)
+        pool = _get_pool(url)
+        conn = pool.getconn()
+        if conn.closed:  # el servidor la cerró mientras estaba ociosa
+            pool.putconn(conn, close=True)
+            _uso_pool(url, conn, 0)
+            conn = pool.getconn()
+        _uso_pool(url, conn, +1)
+        return _PooledConnection(pool, conn, url)
     except Exception as e:
+        _POOL_SLOTS.release()
         # Oculta credenciales en el error
         try:
             _, after_at = url.split("@", 1)
             safe_url = "postgresql://postgres:***@" + after_at
         except Exception:
             safe_url = "postgresql://postgres:***@<host>:<port>/<db>"
-        raise RuntimeError(f"No pude conectar a Postgres con DSN={safe_url}. Detalle: {e}")
+        raise DBConnectionError(f"No pude conectar a Postgres con DSN={safe_url}. Detalle: {e}")
+
+# -----------------------------
+# Métricas por llamada (ring buffer + histograma)
+# -----------------------------
+_CALL = threading.local()  # estado de la llamada en curso: timeout, filas, bytes
+_METRICS = deque(maxlen=DB_METRICS_BUFFER)
+_HIST_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_HIST: dict = {}  # función -> conteos por cubeta (la última es > 10 s)
+_COUNTERS = {"prepared_hit": 0, "prepared_miss": 0}
+_SLOW_IDS = itertools.count(1)
+_METRICS_LOCK = threading.Lock()
+
+
+def _bump(counter: str):
+    with _METRICS_LOCK:
+        _COUNTERS[counter] += 1
+
+
+def _count_fetched(rows):
+    if getattr(_CALL, "rows", None) is None:
+        return  # fuera de un helper instrumentado
+    if not rows:
+        return
+    _CALL.rows += len(rows)
+    # bytes estimados con la primera fila del bloque: medir cada valor costaba más que leerlo
+    _CALL.bytes += len(rows) * sum(len(str(v)) for v in rows[0] if v is not None)
+
+
+def _record_call(fn_name: str, ms: float, rows: int, nbytes: int, retries: int, error: str | None):
+    rec = {"ts": time.time(), "fn": fn_name, "ms": round(ms, 3), "rows": rows,
+           "bytes": nbytes, "retries": retries, "error": error}
+    bucket = next((i for i, b in enumerate(_HIST_BOUNDS_MS) if ms <= b), len(_HIST_BOUNDS_MS))
+    with _METRICS_LOCK:
+        _METRICS.append(rec)
+        _HIST.setdefault(fn_name, [0] * (len(_HIST_BOUNDS_MS) + 1))[bucket] += 1
+        if DB_METRICS_FILE:
+            try:
+                with open(DB_METRICS_FILE, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(rec) + "\n")
+            except OSError:
+                pass  # las métricas nunca deben tumbar una página
+
+
+# -----------------------------
+# Consultas lentas: SQL, parámetros redactados, tenant, duración y plan
+# -----------------------------
+_SLOW = deque(maxlen=DB_SLOW_BUFFER)
+_SLOW_LOCK = threading.Lock()
+_SLOW_EXPLAINED: dict = {}  # sql -> último time.monotonic() con plan
+_SLOW_EXECUTOR = None
+_READ_ONLY_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.I)
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.I)
+
+
+def _redact(v):
+    # Textos (nombres, hashes...) no se guardan; fechas y números sí, para poder reproducir el plan
+    if isinstance(v, str):
+        return f"<texto {len(v)}>"
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return f"<bytes {len(v)}>"
+    return v if v is None or isinstance(v, (int, float, bool)) else str(v)
+
+
+def _record_slow(fn_name, tenant, sql, params, ms: float, error: str | None, explicar: bool = True):
+    rec = {"id": next(_SLOW_IDS), "ts": time.time(), "fn": fn_name, "tenant": tenant, "ms": round(ms, 3),
+           "sql": " ".join(sql.split()), "params": [_redact(p) for p in params], "error": error, "plan": None}
+    with _SLOW_LOCK:
+        _SLOW.append(rec)
+        ultimo = _SLOW_EXPLAINED.get(rec["sql"])
+        explicar = (explicar and DB_SLOW_EXPLAIN and error is None and _READ_ONLY_RE.match(sql) and not _WRITE_RE.search(sql)
+                    and ";" not in sql.strip().rstrip(";")
+                    and (ultimo is None or time.monotonic() - ultimo >= DB_SLOW_EXPLAIN_EVERY))
+        if explicar:
+            _SLOW_EXPLAINED[rec["sql"]] = time.monotonic()
+    if explicar:
+        global _SLOW_EXECUTOR
+        if _SLOW_EXECUTOR is None:
+            with _POOL_LOCK:
+                if _SLOW_EXECUTOR is None:
+                    _SLOW_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-slow")
+        # fuera del hilo de la página: el usuario no espera una segunda ejecución
+        _SLOW_EXECUTOR.submit(_explain_slow, rec, tenant, sql, tuple(params), ms)
+    elif DB_SLOW_FILE:
+        _write_slow(rec)
+
+
+def _explain_slow(rec, tenant, sql, params, ms: float):
+    """Repite la lectura con EXPLAIN (ANALYZE, BUFFERS) en una transacción READ ONLY."""
+    try:
+        conn = connect_db(); cur = conn.cursor()
+        try:
+            cur.execute("SET TRANSACTION READ ONLY;")
+            cur.execute(f"SET LOCAL statement_timeout = {int(max(1000, ms * 3))};")
+            if tenant:
+                cur.execute(_SET_TENANT_SQL, (tenant,))
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params or None)
+            plan = "\n".join(r[0] for r in cur.fetchall())
+        finally:
+            conn.rollback()
+            conn.close()
+    except Exception as e:
+        plan = f"(no se pudo obtener el plan: {type(e).__name__}: {e})"
+    with _SLOW_LOCK:
+        rec["plan"] = plan
+    if DB_SLOW_FILE:
+        _write_slow(rec)
+
+
+def _write_slow(rec):
+    with _SLOW_LOCK:
+        try:
+            with open(DB_SLOW_FILE, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(rec, default=str) + "\n")
+        except OSError:
+            pass
+
+
+def get_slow_queries(limit: int = 100):
+    """Consultas lentas más recientes primero. Si hay DB_SLOW_FILE, incluye las de corridas anteriores."""
+    with _SLOW_LOCK:
+        recs = [dict(r) for r in _SLOW]
+    if DB_SLOW_FILE and len(recs) < limit:
+        vistos = {(r["ts"], r["id"]) for r in recs}
+        try:
+            with open(DB_SLOW_FILE, encoding="utf-8") as fh:
+                previos = deque(fh, maxlen=DB_SLOW_BUFFER)
+            for linea in previos:
+                try:
+                    r = json.loads(linea)
+                except ValueError:
+                    continue
+                if (r.get("ts"), r.get("id")) not in vistos:
+                    recs.append(r)
+        except OSError:
+            pass
+    recs.sort(key=lambda r: r["ts"], reverse=True)
+    return recs[:limit]
+
+
+def _percentile(sorted_vals, q: float):
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(round(q * (len(sorted_vals) - 1))))]
+
+
+def get_db_metrics():
+    """
+    Resumen para la página de diagnóstico:
+    - funciones: p50/p95/p99 (ms) de las últimas llamadas, filas/bytes, reintentos, errores e histograma.
+    - pool: conexiones en uso / ociosas por DSN y cupos libres.
+    - cache: aciertos de sentencias preparadas.
+    """
+    with _METRICS_LOCK:
+        recs = list(_METRICS)
+        hist = {k: list(v) for k, v in _HIST.items()}
+        counters = dict(_COUNTERS)
+    por_fn: dict = {}
+    for r in recs:
+        por_fn.setdefault(r["fn"], []).append(r)
+    funciones = []
+    for fn_name, rs in sorted(por_fn.items()):
+        ms = sorted(r["ms"] for r in rs)
+        funciones.append({
+            "funcion": fn_name, "llamadas": len(rs),
+            "p50_ms": _percentile(ms, 0.50), "p95_ms": _percentile(ms, 0.95), "p99_ms": _percentile(ms, 0.99),
+            "filas": sum(r["rows"] for r in rs), "bytes": sum(r["bytes"] for r in rs),
+            "reintentos": sum(r["retries"] for r in rs), "errores": sum(1 for r in rs if r["error"]),
+            "histograma": hist.get(fn_name),
+        })
+    with _POOL_LOCK:
+        uso = {url: (u["en_uso"], len(u["ociosas"])) for url, u in _POOL_USO.items()}
+    pool = []
+    for url, (en_uso, ociosas) in uso.items():
+        host = url.split("@", 1)[-1].split("?", 1)[0]
+        pool.append({"destino": host, "en_uso": en_uso, "ociosas": ociosas, "max": DB_POOL_MAX})
+    total = counters["prepared_hit"] + counters["prepared_miss"]
+    return {
+        "funciones": funciones,
+        "histograma_limites_ms": list(_HIST_BOUNDS_MS),
+        "pool": pool,
+        "pool_cupos_libres": DB_POOL_MAX - sum(en_uso for en_uso, _ in uso.values()),
+        "cache": {**counters, "prepared_hit_rate": (counters["prepared_hit"] / total) if total else None},
+        "recientes": recs[-50:],
+    }
+
+
+# -----------------------------
+# Reintentos, statement_timeout y circuit breaker
+# -----------------------------
+_BREAKER = {"fallos": 0, "abierto_desde": None, "probando": False}
+_BREAKER_LOCK = threading.Lock()
+
+
+def _breaker_check() -> bool:
+    """Lanza DBUnavailable con el circuito abierto; devuelve True si esta llamada es la de prueba."""
+    with _BREAKER_LOCK:
+        desde = _BREAKER["abierto_desde"]
+        if desde is None:
+            return False
+        if time.monotonic() - desde < DB_BREAKER_COOLDOWN or _BREAKER["probando"]:
+            raise DBUnavailable("La base de datos no responde; reintenta en unos segundos.")
+        _BREAKER["probando"] = True  # medio abierto: deja pasar una sola llamada de prueba
+        return True
+
+
+def _breaker_record(ok: bool):
+    with _BREAKER_LOCK:
+        _BREAKER["probando"] = False
+        if ok:
+            _BREAKER["fallos"] = 0
+            _BREAKER["abierto_desde"] = None
+            return
+        _BREAKER["fallos"] += 1
+        if _BREAKER["fallos"] >= DB_BREAKER_THRESHOLD:
+            _BREAKER["abierto_desde"] = time.monotonic()
+
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, psycopg2.errors.QueryCanceled):
+        return False  # statement_timeout: repetirla solo apila más carga
+    return isinstance(e, (OperationalError, psycopg2.InterfaceError, DBConnectionError))
+
+
+def db_policy(kind: str, timeout_ms: int | None = None, offline: bool = False):
+    """
+    Política de llamada para los helpers de este módulo.
+    - "read":  idempotente; reintenta errores transitorios con backoff exponencial + jitter.
+    - "write": reintenta solo si falló al conectar (la sentencia nunca salió); si no, no repite.
+    - "ddl":   como "write" pero sin statement_timeout (migraciones largas).
+    Todas fijan statement_timeout por llamada y pasan por el circuit breaker.
+    Con offline=True, sin conexión (o con el circuito abierto) la llamada no falla:
+    una escritura queda en la cola local (outbox.py) y devuelve EN_COLA; una lectura devuelve
+    el último resultado que se leyó con red, si lo hay. No se reintenta la conexión: el primer
+fallo ya manda a la cola (connect_timeout = DB_CONNECT_TIMEOUT acota la espera).
+    """
+    if timeout_ms is None:
+        timeout_ms = 0 if kind == "ddl" else DB_STATEMENT_TIMEOUT_MS
+
+    def deco(fn):
+        @functools.wraps(fn)
+        def llamada(*args, **kwargs):
+            if kind == "ddl" and db_sqlite.es_sqlite(_database_url()):
+                connect_db().close()  # en SQLite el esquema completo se aplica al abrir el archivo
+                return None
+            prueba = _breaker_check()
+            prev = (getattr(_CALL, "fn", None), getattr(_CALL, "timeout_ms", None),
+                    getattr(_CALL, "rows", None), getattr(_CALL, "bytes", None))
+            _CALL.fn, _CALL.timeout_ms, _CALL.rows, _CALL.bytes = fn.__name__, timeout_ms, 0, 0
+            t0 = time.perf_counter()
+            intento, error = 0, None
+            try:
+                while True:
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        if not _is_transient(e):
+                            # ValueError, IntegrityError, timeout...: la base respondió, el circuito se cierra
+                            error = type(e).__name__
+                            _breaker_record(True)
+                            raise
+                        if offline and isinstance(e, DBConnectionError):
+                            retry = False  # sin red: va directo a la cola / al último resultado
+                        else:
+                            retry = isinstance(e, DBConnectionError) or kind == "read"
+                        if not retry or intento >= DB_RETRIES:
+                            error = type(e).__name__
+                            _breaker_record(False)
+                            raise
+                        time.sleep(random.uniform(0, min(DB_BACKOFF_MAX, DB_BACKOFF_BASE * 2 ** intento)))
+                        intento += 1
+                        continue
+                    _breaker_record(True)
+                    return result
+            finally:
+                if prueba:
+                    with _BREAKER_LOCK:
+                        _BREAKER["probando"] = False  # la prueba terminó, como sea: no deja el circuito trabado
+                _record_call(fn.__name__, (time.perf_counter() - t0) * 1000, _CALL.rows, _CALL.bytes, intento, error)
+                _CALL.fn, _CALL.timeout_ms, _CALL.rows, _CALL.bytes = prev
+        if not offline:
+            llamada.db_kind = kind
+            return llamada
+
+        firma = inspect.signature(fn)
+        if kind == "write":
+            _ENCOLABLES[fn.__name__] = fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if kind == "read":
+                return _leer_offline(llamada, fn.__name__, args, kwargs)
+            owner = firma.bind(*args, **kwargs).arguments.get("owner")
+            if outbox.contar(owner, OUTBOX_MAX_INTENTOS):
+                # Quedan escrituras previas sin enviar: esta va detrás para respetar el orden
+                outbox.encolar(fn.__name__, owner, args, kwargs)
+                sincronizar_outbox(forzar=True)
+                return EN_COLA
+            try:
+                return llamada(*args, **kwargs)
+            except (DBConnectionError, DBUnavailable):
+                outbox.encolar(fn.__name__, owner, args, kwargs)
+                return EN_COLA
+        wrapper.db_kind = kind
+        return wrapper
+    return deco
+
+
+# -----------------------------
+# Cola offline: escrituras sin red y su reenvío
+# -----------------------------
+class _EnCola:
+    """Resultado de una escritura que quedó en la cola local; es verdadero (la escritura se aceptó)."""
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return "EN_COLA"
+
+
+EN_COLA = _EnCola()
+_ENCOLABLES: dict = {}  # nombre -> función sin envolver, para reenviarla
+_OUTBOX_LOCK = threading.Lock()
+_OUTBOX_ULTIMO = [0.0]
+
+
+def _leer_offline(llamada, nombre, args, kwargs):
+    clave = f"{nombre}:{json.dumps([args, kwargs], default=str)}"
+    try:
+        valor = llamada(*args, **kwargs)
+    except (DBConnectionError, DBUnavailable):
+        encontrado, valor = outbox.leer_lectura(clave)
+        if not encontrado:
+            raise
+        return valor
+    outbox.guardar_lectura(clave, valor)
+    return valor
+
+
+def _aplicar_entrada(conn, cur, e) -> bool:
+    """
+    Aplica una entrada dentro de la transacción del lote, tras su propio SAVEPOINT. Devuelve False si el
+    helper deshizo su escritura (conn.rollback() ante un IntegrityError, p. ej.): no quedó nada aplicado.
+    """
+    cur.execute("SAVEPOINT outbox_entrada;")
+    tenant = _tenant(e["owner"]) if e["owner"] else None
+    _run(cur, tenant,
+        """
+        INSERT INTO outbox_aplicadas (clave, tenant_id, funcion)
+        VALUES (%s,%s,%s)
+        ON CONFLICT (clave) DO NOTHING;
+        """,
+        (e["clave"], tenant, e["funcion"]),
+    )
+    if cur.rowcount == 0:
+        return True  # un envío anterior ya llegó al servidor; solo faltaba sacarla de la cola
+    prev = (getattr(_CALL, "fn", None), getattr(_CALL, "timeout_ms", None))
+    _CALL.tx, _CALL.fn, _CALL.timeout_ms, _CALL.tx_revertida = conn, e["funcion"], DB_STATEMENT_TIMEOUT_MS, False
+    try:
+        _ENCOLABLES[e["funcion"]](*e["args"], **e["kwargs"])
+        return not _CALL.tx_revertida
+    finally:
+        _CALL.tx = None
+        _CALL.fn, _CALL.timeout_ms = prev
+
+
+def sincronizar_outbox(forzar: bool = False) -> int:
+    """
+    Reenvía la cola offline en orden, OUTBOX_BATCH entradas por transacción.
+    Cada entrada anota su clave en outbox_aplicadas dentro de la misma transacción que su escritura,
+    así que reenviar lo que ya llegó no duplica nada. Cada una va tras su SAVEPOINT: si falla (o el helper
+    deshace su escritura) se vuelve a él y solo ella queda en la cola con su error, el resto del lote se
+    confirma. Tras OUTBOX_MAX_INTENTOS se aparta.
+    Sin red no hace nada. Sin `forzar`, corre como mucho cada OUTBOX_SYNC_EVERY seg.
+    Devuelve cuántas entradas siguen pendientes.
+    """
+    if not outbox.contar():
+        return 0
+    ahora = time.monotonic()
+    if not forzar and ahora - _OUTBOX_ULTIMO[0] < OUTBOX_SYNC_EVERY:
+        return outbox.contar()
+    if not _OUTBOX_LOCK.acquire(blocking=False):
+        return outbox.contar()  # otro hilo ya está sincronizando
+    try:
+        _OUTBOX_ULTIMO[0] = ahora
+        try:
+            prueba = _breaker_check()
+        except DBUnavailable:
+            return outbox.contar()
+        try:
+            conn = connect_db()
+        except DBConnectionError:
+            _breaker_record(False)
+            return outbox.contar()
+        cur = conn.cursor()
+        try:
+            entradas = [e for e in outbox.pendientes() if e["intentos"] < OUTBOX_MAX_INTENTOS]
+            for i in range(0, len(entradas), OUTBOX_BATCH):
+                aplicadas, fallidas = [], []
+                for e in entradas[i:i + OUTBOX_BATCH]:
+                    try:
+                        if _aplicar_entrada(conn, cur, e):
+                            aplicadas.append(e["clave"])
+                        else:
+                            fallidas.append((e["clave"], f"{e['funcion']} deshizo su escritura"))
+                    except Exception as err:
+                        if _is_transient(err):
+                            _breaker_record(False)
+                            return outbox.contar()  # se cayó la red a mitad: el lote queda para la próxima
+                        cur.execute("ROLLBACK TO SAVEPOINT outbox_entrada;")
+                        fallidas.append((e["clave"], f"{type(err).__name__}: {err}"))
+                conn.commit()
+                outbox.borrar(aplicadas)
+                for clave, motivo in fallidas:
+                    outbox.registrar_fallo(clave, motivo)
+            _breaker_record(True)
+        finally:
+            if prueba:
+                with _BREAKER_LOCK:
+                    _BREAKER["probando"] = False
+            conn.close()
+        return outbox.contar()
+    finally:
+        _OUTBOX_LOCK.release()
+
+
+# -----------------------------
+# Carga concurrente de datos de una página
+# -----------------------------
+def cargar_en_paralelo(**tareas):
+    """
+    Ejecuta lecturas independientes en paralelo, cada una con su conexión del pool.
+    Uso: cargar_en_paralelo(tarifas=(get_tarifas, owner), jornadas=(get_jornadas_between, ini, fin, owner))
+    Devuelve {nombre: resultado}. Si alguna falla, relanza el primer error (en orden de llamada).
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _POOL_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=max(1, DB_WORKERS), thread_name_prefix="db")
+    futuros = {nombre: _EXECUTOR.submit(fn, *args) for nombre, (fn, *args) in tareas.items()}
+    return {nombre: fut.result() for nombre, fut in futuros.items()}
+
+
+# -----------------------------
+# Group commit: inserts de una fila de muchas sesiones -> un INSERT multi-fila y un commit
+# -----------------------------
+class _GroupCommit:
+    """
+    Escritor de fondo (DB_GROUP_COMMIT=1). Junta los inserts que llegan de cualquier hilo durante
+    DB_GROUP_COMMIT_MS y los escribe como un INSERT multi-fila por (tabla, tenant), todo en una
+    transacción: un commit (un fsync del servidor) por tanda en vez de uno por fila.
+    Cada llamador espera su Future y recibe su propio resultado o error: si la tanda falla por
+    una fila, las filas se repiten de a una y solo la mala devuelve el error.
+    """
+
+    def __init__(self):
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def insertar(self, tabla: str, columnas: tuple, tenant: int, fila: tuple, valores: str | None = None):
+        """`valores`: plantilla de la fila, p. ej. con subconsultas (por defecto un %s por columna)."""
+        if self._hilo is None:
+            with self._lock:
+                if self._hilo is None:
+                    self._hilo = threading.Thread(target=self._bucle, name="db-group-commit", daemon=True)
+                    self._hilo.start()
+        fut = Future()
+        valores = valores or "(" + ",".join(["%s"] * len(columnas)) + ")"
+        self._cola.put(((tabla, columnas, valores), tenant, fila, fut))
+        return fut.result()
+
+    def _bucle(self):
+        while True:
+            tanda = [self._cola.get()]
+            limite = time.monotonic() + DB_GROUP_COMMIT_MS / 1000
+            while len(tanda) < DB_GROUP_COMMIT_MAX:
+                resto = limite - time.monotonic()
+                try:
+                    tanda.append(self._cola.get(timeout=resto) if resto > 0 else self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            _CALL.fn, _CALL.timeout_ms = "group_commit", DB_STATEMENT_TIMEOUT_MS
+            try:
+                self._escribir(tanda)
+            except Exception as e:  # el hilo no puede morir: nadie más resolvería los Future
+                for *_, fut in tanda:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    @staticmethod
+    def _insert(cur, destino, tenant, filas):
+        tabla, columnas, valores = destino
+        _run(cur, tenant,
+             f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES {', '.join([valores] * len(filas))};",
+             [v for fila in filas for v in fila])
+
+    def _escribir(self, tanda):
+        conn = connect_db(); cur = conn.cursor()
+        try:
+            grupos = {}
+            for destino, tenant, fila, fut in tanda:
+                grupos.setdefault((destino, tenant), []).append(fila)
+            try:
+                for (destino, tenant), filas in grupos.items():
+                    self._insert(cur, destino, tenant, filas)
+                conn.commit()
+                for *_, fut in tanda:
+                    fut.set_result(None)
+                return
+            except Exception as e:
+                if len(tanda) == 1 or _is_transient(e):
+                    raise
+                conn.rollback()
+            for destino, tenant, fila, fut in tanda:
+                try:
+                    self._insert(cur, destino, tenant, [fila])
+                    conn.commit()
+                    fut.set_result(None)
+                except Exception as e:
+                    fut.set_exception(e)
+                    if _is_transient(e):
+                        raise
+                    conn.rollback()
+        finally:
+            conn.close()
+
+
+_GROUP_COMMIT = _GroupCommit()
+
+
+def _agrupar() -> bool:
+    # Dentro de un reenvío del outbox la escritura ya va en la transacción de su lote; en SQLite
+    # (WAL + synchronous=NORMAL) el commit no hace fsync y agrupar solo agregaría espera
+    return (DB_GROUP_COMMIT and getattr(_CALL, "tx", None) is None
+            and not db_sqlite.es_sqlite(_database_url()))
+
 
 # -----------------------------
-# Helper: fija owner para que RLS lo lea
+# Helper: fija el tenant para que RLS lo lea
 # -----------------------------
-def _set_owner(cur, owner: str | None):
-    """Fija variable de sesión app.owner. Si RLS está activo, filtra por ahí."""
-    if owner:
-        cur.execute("SET LOCAL app.owner = %s;", (owner,))
+_SET_TENANT_SQL = "SET LOCAL app.tenant_id = %s; "
+
+
+_PREPARED_SQL: dict = {}  # nombre -> texto con $1..$n listo para PREPARE
+
+
+@contextlib.contextmanager
+def capturar_sentencias():
+    """
+    Junta en una lista cada sentencia que pasa por _run en ESTE hilo: {fn, sql, params, tenant}.
+    Las sentencias se ejecutan igual; sirve para revisar planes (plancheck.py).
+    No ve lo que corre dentro de cargar_en_paralelo (otros hilos).
+    """
+    prev = getattr(_CALL, "captura", None)
+    _CALL.captura = captura = []
+    try:
+        yield captura
+    finally:
+        _CALL.captura = prev
+
+
+def _run(cur, tenant: int | None, sql: str, params=(), prepare: str | None = None, sqlite=None, fila=None):
+    """
+    Ejecuta `sql` con app.tenant_id fijado (RLS) en UN solo viaje al servidor:
+    el SET LOCAL va en el mismo envío que la sentencia (multi-statement de psycopg2).
+    fetch*/rowcount corresponden a la última sentencia, o sea a `sql`.
+    Con `prepare="nombre"` la sentencia se PREPAREa una vez por conexión y luego va por EXECUTE.
+    Dentro de un helper con @db_policy también viaja su statement_timeout.
+    Si tarda más de DB_SLOW_MS queda registrada en get_slow_queries().
+    En SQLite `sql` se traduce sola (db_sqlite.traducir); `sqlite=` la reemplaza cuando no alcanza:
+    un texto (mismos params) o una lista [(sql, params), ...] que corre en orden (fetch* = la última).
+    Con `fila=Tipo` (Jornada, Insumo, Plan, Cierre) los fetch* devuelven ese tipo de fila.
+    """
+    cur.fila = fila
+    captura = getattr(_CALL, "captura", None)
+    if captura is not None:
+        captura.append({"fn": getattr(_CALL, "fn", None), "sql": sql, "params": tuple(params), "tenant": tenant})
+    t0 = time.perf_counter()
+    error = None
+    es_sqlite = getattr(cur, "dialect", None) == "sqlite"
+    try:
+        if es_sqlite:
+            for texto, args in (sqlite if isinstance(sqlite, list) else [(sqlite or sql, params)]):
+                cur.execute(texto, args)
+        else:
+            _execute(cur, tenant, sql, params, prepare)
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        if DB_SLOW_MS and ms >= DB_SLOW_MS:
+            _record_slow(getattr(_CALL, "fn", None), tenant, sql, params, ms, error, explicar=not es_sqlite)
+
+
+def _execute(cur, tenant: int | None, sql: str, params=(), prepare: str | None = None):
+    timeout = getattr(_CALL, "timeout_ms", None)
+    head = f"SET LOCAL statement_timeout = {int(timeout)}; " if timeout else ""
+    head, head_params = (head + _SET_TENANT_SQL, (tenant,)) if tenant else (head, ())
+    prepared = getattr(cur.connection, "prepared", None)
+    if not (prepare and DB_PREPARE and prepared is not None):
+        cur.execute(head + sql, (*head_params, *params) or None)
+        return
+    execute = f"EXECUTE {prepare}({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {prepare}"
+    args = (*head_params, *params) or None
+    # Si la transacción ya trae sentencias del helper, un PREPARE/EXECUTE que falla
+    # no debe deshacerlas: se vuelve a un SAVEPOINT que va en el mismo envío. Al empezar no hay nada que perder.
+    en_tx = cur.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    punto = "SAVEPOINT _preparada; " if en_tx else ""
+
+    def volver():
+        if en_tx:
+            cur.execute("ROLLBACK TO SAVEPOINT _preparada;")
+        else:
+            cur.connection.rollback()
+
+    if prepare in prepared:
+        try:
+            cur.execute(head + punto + execute, args)
+            _bump("prepared_hit")
+            return
+        except psycopg2.errors.InvalidSqlStatementName:
+            # La sesión del servidor ya no la tiene (DISCARD ALL, pooler externo...): se vuelve a preparar
+            volver()
+    text = _PREPARED_SQL.get(prepare)
+    if text is None:
+        n = itertools.count(1)
+        text = _PREPARED_SQL[prepare] = re.sub(r"%s", lambda _: f"${next(n)}", sql.strip().rstrip(";"))
+    # PREPARE no es transaccional: sobrevive aunque falle el EXECUTE, por eso se marca antes
+    prepared.add(prepare)
+    _bump("prepared_miss")
+    try:
+        cur.execute(f"{head}{punto}PREPARE {prepare} AS {text}; {execute}", args)
+    except psycopg2.errors.DuplicatePreparedStatement:
+        volver()
+        cur.execute(head + execute, args)
 
 # -----------------
 # Tablas / Migración
 # -----------------
 
+@db_policy("ddl")
 def create_users_table():
     conn = connect_db(); cur = conn.cursor()
     try:
@@ -54,6 +976,7 @@ def create_users_table():
             CREATE TABLE IF NOT EXISTS users (
               username TEXT PRIMARY KEY,
               password TEXT NOT NULL,
+              tenant_id INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE,
               created_at TIMESTAMPTZ DEFAULT now()
             );
             """
@@ -63,6 +986,7 @@ def create_users_table():
         conn.close()
 
 
+@db_policy("ddl")
 def create_trabajadores_table():
     conn = connect_db(); cur = conn.cursor()
     try:
@@ -70,18 +994,19 @@ def create_trabajadores_table():
             """
             CREATE TABLE IF NOT EXISTS trabajadores (
               id SERIAL PRIMARY KEY,
-              owner TEXT NOT NULL,
+              tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
               nombre TEXT NOT NULL,
               apellido TEXT NOT NULL,
+              activo BOOLEAN NOT NULL DEFAULT TRUE,
               created_at TIMESTAMPTZ DEFAULT now()
             );
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_trabajadores_owner ON trabajadores(owner);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_trabajadores_tenant ON trabajadores(tenant_id);")
         cur.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajadores_owner_nombre_apellido
-            ON trabajadores(owner, nombre, apellido);
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajadores_tenant_nombre_apellido
+            ON trabajadores(tenant_id, nombre, apellido);
             """
         )
         conn.commit()
@@ -89,6 +1014,7 @@ def create_trabajadores_table():
         conn.close()
 
 
+@db_policy("ddl")
 def create_fincas_table():
     conn = connect_db(); cur = conn.cursor()
     try:
@@ -96,17 +1022,26 @@ def create_fincas_table():
             """
             CREATE TABLE IF NOT EXISTS fincas (
               id SERIAL PRIMARY KEY,
-              owner TEXT NOT NULL,
+              tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
               nombre TEXT NOT NULL,
+              activo BOOLEAN NOT NULL DEFAULT TRUE,
               created_at TIMESTAMPTZ DEFAULT now()
             );
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_fincas_owner ON fincas(owner);")
+        # área opcional, para los costos por hectárea / por planta
+        cur.execute(
+            """
+            ALTER TABLE fincas
+            ADD COLUMN IF NOT EXISTS hectareas NUMERIC(10,2) CONSTRAINT ck_fincas_hectareas CHECK (hectareas > 0),
+            ADD COLUMN IF NOT EXISTS plantas INTEGER CONSTRAINT ck_fincas_plantas CHECK (plantas > 0);
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_fincas_tenant ON fincas(tenant_id);")
         cur.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_fincas_owner_nombre
-            ON fincas(owner, nombre);
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_fincas_tenant_nombre
+            ON fincas(tenant_id, nombre);
             """
         )
         conn.commit()
@@ -114,16 +1049,35 @@ def create_fincas_table():
         conn.close()
 
 
+@db_policy("write", offline=True)
 def add_finca(nombre: str, owner: str) -> bool:
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            INSERT INTO fincas (owner, nombre)
+            INSERT INTO fincas (tenant_id, nombre)
             VALUES (%s, %s)
-            ON CONFLICT (owner, nombre) DO NOTHING;
+            ON CONFLICT (tenant_id, nombre) DO UPDATE SET activo=TRUE
+            WHERE NOT fincas.activo;
             """,
-            (owner, nombre),
+            (tenant, nombre),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+
+@db_policy("write", offline=True)
+def set_finca_area(owner: str, nombre: str, hectareas=None, plantas=None) -> bool:
+    """Área del lote (hectáreas y/o número de plantas; None lo borra) para normalizar los costos."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            "UPDATE fincas SET hectareas=%s, plantas=%s WHERE tenant_id=%s AND nombre=%s;",
+            (hectareas, plantas, tenant, nombre),
         )
         conn.commit()
         return cur.rowcount > 0
@@ -131,17 +1085,49 @@ def add_finca(nombre: str, owner: str) -> bool:
         conn.close()
 
 
+@db_policy("read", offline=True)
+def get_fincas_area(owner: str) -> list:
+    """[(nombre, hectareas, plantas), ...] de las fincas activas."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            "SELECT nombre, hectareas, plantas FROM fincas WHERE tenant_id=%s AND activo ORDER BY nombre;",
+            (tenant,),
+            prepare="get_fincas_area",
+        )
+        return [tuple(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+_FINCA_SQL = "COALESCE(%s, (SELECT id FROM fincas WHERE tenant_id=%s AND nombre=%s))"
+
+
+def _finca(tenant, lote):
+    """
+    (sql, params) del finca_id de `lote` para usar dentro de la sentencia: un id va tal cual; un nombre
+    se busca en la misma sentencia por ux_fincas_tenant_nombre (sin viaje extra). Texto fijo: sirve con PREPARE.
+    """
+    if lote is None or not isinstance(lote, str):
+        return _FINCA_SQL, (lote, None, None)
+    return _FINCA_SQL, (None, tenant, lote)
+
+
+@db_policy("read", offline=True)
 def get_all_fincas(owner: str):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
             SELECT nombre
             FROM fincas
-            WHERE owner=%s
+            WHERE tenant_id=%s AND activo
             ORDER BY nombre;
             """,
-            (owner,),
+            (tenant,),
+            prepare="get_all_fincas",
         )
         return [r[0] for r in cur.fetchall()]
     finally:
@@ -149,54 +1135,130 @@ def get_all_fincas(owner: str):
 
 
 
+_TABLAS_PARTICIONADAS = ("jornadas", "insumos")
+
+
+def _es_particionada(cur, tabla: str) -> bool:
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (tabla,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def _columnas_escribibles(cur, tabla: str) -> str:
+    """Columnas de `tabla` sin las generadas (costo_total), para copiar filas con INSERT ... SELECT."""
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name=%s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position;
+        """,
+        (tabla,),
+    )
+    return ", ".join(r[0] for r in cur.fetchall())
+
+
+def _crear_particiones(cur, tabla: str, desde: int, hasta: int):
+    """
+    Crea la partición DEFAULT y las anuales {tabla}_{año} que falten entre `desde` y `hasta`.
+    Las filas de un año nuevo que ya estaban en la DEFAULT se mudan a su partición
+    (Postgres no deja crearla mientras la DEFAULT tenga filas de ese rango).
+    """
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {tabla}_default PARTITION OF {tabla} DEFAULT;")
+    for anio in range(desde, hasta + 1):
+        nombre = f"{tabla}_{anio}"
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (nombre,))
+        if cur.fetchone()[0]:
+            continue  # ya existe (o quedó desacoplada con ese nombre: no se pisa)
+        rango = (datetime.date(anio, 1, 1), datetime.date(anio + 1, 1, 1))
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {tabla}_default WHERE fecha >= %s AND fecha < %s);", rango)
+        mover = cur.fetchone()[0]
+        if mover:
+            cur.execute(f"CREATE TEMP TABLE _mover_particion (LIKE {tabla});")
+            cur.execute(
+                f"""
+                WITH d AS (DELETE FROM {tabla}_default WHERE fecha >= %s AND fecha < %s RETURNING *)
+                INSERT INTO _mover_particion SELECT * FROM d;
+                """,
+                rango,
+            )
+        cur.execute(f"CREATE TABLE {nombre} PARTITION OF {tabla} FOR VALUES FROM (%s) TO (%s);", rango)
+        if mover:
+            columnas = _columnas_escribibles(cur, tabla)
+            # directo a la partición, como el DELETE de arriba: ninguno pasa por los triggers de los resúmenes
+            cur.execute(f"INSERT INTO {nombre} ({columnas}) SELECT {columnas} FROM _mover_particion;")
+            cur.execute("DROP TABLE _mover_particion;")
+
+
+def _particiones_base(cur, tabla: str):
+    # en bases anteriores la tabla sigue siendo común hasta que corra ensure_particiones()
+    if _es_particionada(cur, tabla):
+        hoy = datetime.date.today()
+        _crear_particiones(cur, tabla, hoy.year, hoy.year + DB_PARTICIONES_ADELANTE)
+
+
+@db_policy("ddl")
 def create_jornadas_table():
     conn = connect_db(); cur = conn.cursor()
     try:
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS jornadas (
-              id SERIAL PRIMARY KEY,
-              owner TEXT NOT NULL,
-              trabajador TEXT NOT NULL,
+              id SERIAL,
+              tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+              trabajador_id INTEGER NOT NULL REFERENCES trabajadores(id),
               fecha DATE NOT NULL,
-              lote TEXT,
+              finca_id INTEGER REFERENCES fincas(id),
               actividad TEXT,
-              dias INTEGER NOT NULL DEFAULT 0,
-              horas_normales NUMERIC NOT NULL DEFAULT 0,
-              horas_extra NUMERIC NOT NULL DEFAULT 0
-            );
+              dias INTEGER NOT NULL DEFAULT 0 CONSTRAINT ck_jornadas_dias CHECK (dias >= 0),
+              horas_normales NUMERIC(6,2) NOT NULL DEFAULT 0 CONSTRAINT ck_jornadas_horas_normales CHECK (horas_normales >= 0),
+              horas_extra NUMERIC(6,2) NOT NULL DEFAULT 0 CONSTRAINT ck_jornadas_horas_extra CHECK (horas_extra >= 0),
+              PRIMARY KEY (id, fecha)
+            ) PARTITION BY RANGE (fecha);
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_jornadas_owner ON jornadas(owner);")
+        _particiones_base(cur, "jornadas")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jornadas_tenant ON jornadas(tenant_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_jornadas_fecha ON jornadas(fecha);")
+        # Todas las lecturas filtran por tenant y casi todas por rango/orden de fecha
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jornadas_tenant_fecha ON jornadas(tenant_id, fecha);")
         conn.commit()
     finally:
         conn.close()
 
 
+# costo_total lo calcula Postgres al escribir (columna generada STORED): nadie lo manda desde Python
+_COSTO_TOTAL_SQL = "COALESCE(cantidad, 0) * COALESCE(precio_unitario, 0)"
+
+
+@db_policy("ddl")
 def create_insumos_table():
     conn = connect_db(); cur = conn.cursor()
     try:
         cur.execute(
-            """
+            f"""
             CREATE TABLE IF NOT EXISTS insumos (
-              id SERIAL PRIMARY KEY,
-              owner TEXT NOT NULL,
+              id SERIAL,
+              tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
               fecha DATE,
-              lote TEXT,
-              tipo TEXT,
+              finca_id INTEGER REFERENCES fincas(id),
+              tipo TEXT CONSTRAINT ck_insumos_tipo CHECK (tipo <> 'Mano de obra'),
               etapa TEXT,
               producto TEXT,
               dosis TEXT,
-              cantidad NUMERIC,
-              precio_unitario NUMERIC,
-              costo_total NUMERIC
-            );
+              cantidad NUMERIC(14,3) CONSTRAINT ck_insumos_cantidad CHECK (cantidad >= 0),
+              precio_unitario NUMERIC(14,2) CONSTRAINT ck_insumos_precio_unitario CHECK (precio_unitario >= 0),
+              costo_total NUMERIC(18,2) GENERATED ALWAYS AS ({_COSTO_TOTAL_SQL}) STORED
+            ) PARTITION BY RANGE (fecha);
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_owner ON insumos(owner);")
+        _particiones_base(cur, "insumos")
+        # fecha admite NULL, así que no hay PK (id, fecha): las búsquedas por id van por este índice
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_id ON insumos(id);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_tenant ON insumos(tenant_id);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_tipo ON insumos(tipo);")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_fecha ON insumos(fecha);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_tenant_fecha ON insumos(tenant_id, fecha);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_insumos_tenant_tipo_fecha ON insumos(tenant_id, tipo, fecha);")
         conn.commit()
     finally:
         conn.close()
@@ -204,13 +1266,14 @@ def create_insumos_table():
 
 # ---------- Tarifas por usuario ----------
 
+@db_policy("ddl")
 def create_tarifas_table():
     conn = connect_db(); cur = conn.cursor()
     try:
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS tarifas_user (
-              owner TEXT PRIMARY KEY,
+              tenant_id INTEGER PRIMARY KEY REFERENCES users(tenant_id),
               pago_dia NUMERIC NOT NULL,
               pago_hora_extra NUMERIC NOT NULL,
               updated_at TIMESTAMPTZ DEFAULT now()
@@ -239,33 +1302,36 @@ def create_tarifas_table():
         conn.close()
 
 
+@db_policy("read", offline=True)
 def get_tarifas(owner: str):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute("SELECT pago_dia, pago_hora_extra FROM tarifas_user WHERE owner=%s;", (owner,))
+        _run(cur, tenant, "SELECT pago_dia, pago_hora_extra FROM tarifas_user WHERE tenant_id=%s;", (tenant,),
+             prepare="get_tarifas")
         row = cur.fetchone()
         if row:
             return float(row[0]), float(row[1])
-        cur.execute("SELECT pago_dia, pago_hora_extra FROM tarifas WHERE id=1;")
+        _run(cur, tenant, "SELECT pago_dia, pago_hora_extra FROM tarifas WHERE id=1;")
         legacy = cur.fetchone()
         if legacy:
-            cur.execute(
+            _run(cur, tenant,
                 """
-                INSERT INTO tarifas_user (owner, pago_dia, pago_hora_extra, updated_at)
+                INSERT INTO tarifas_user (tenant_id, pago_dia, pago_hora_extra, updated_at)
                 VALUES (%s,%s,%s, now())
-                ON CONFLICT (owner) DO NOTHING;
+                ON CONFLICT (tenant_id) DO NOTHING;
                 """,
-                (owner, legacy[0], legacy[1]),
+                (tenant, legacy[0], legacy[1]),
             )
             conn.commit()
             return float(legacy[0]), float(legacy[1])
-        cur.execute(
+        _run(cur, tenant,
             """
-            INSERT INTO tarifas_user (owner, pago_dia, pago_hora_extra)
+            INSERT INTO tarifas_user (tenant_id, pago_dia, pago_hora_extra)
             VALUES (%s,%s,%s)
-            ON CONFLICT (owner) DO NOTHING;
+            ON CONFLICT (tenant_id) DO NOTHING;
             """,
-            (owner, 9000, 2000),
+            (tenant, 9000, 2000),
         )
         conn.commit()
         return 9000.0, 2000.0
@@ -273,19 +1339,21 @@ def get_tarifas(owner: str):
         conn.close()
 
 
+@db_policy("write", offline=True)
 def set_tarifas(owner: str, pago_dia: float, pago_hora_extra: float):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            INSERT INTO tarifas_user (owner, pago_dia, pago_hora_extra, updated_at)
+            INSERT INTO tarifas_user (tenant_id, pago_dia, pago_hora_extra, updated_at)
             VALUES (%s,%s,%s, now())
-            ON CONFLICT (owner) DO UPDATE
+            ON CONFLICT (tenant_id) DO UPDATE
             SET pago_dia=EXCLUDED.pago_dia,
                 pago_hora_extra=EXCLUDED.pago_hora_extra,
                 updated_at=now();
             """,
-            (owner, pago_dia, pago_hora_extra),
+            (tenant, pago_dia, pago_hora_extra),
         )
         conn.commit()
     finally:
@@ -294,6 +1362,7 @@ def set_tarifas(owner: str, pago_dia: float, pago_hora_extra: float):
 
 # ---------- Cierres mensuales ----------
 
+@db_policy("ddl")
 def create_cierres_tables():
     conn = connect_db(); cur = conn.cursor()
     try:
@@ -301,7 +1370,7 @@ def create_cierres_tables():
             """
             CREATE TABLE IF NOT EXISTS pagos_mes (
               id SERIAL PRIMARY KEY,
-              owner TEXT NOT NULL,
+              tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
               mes_ini DATE NOT NULL,
               mes_fin DATE NOT NULL,
               creado_por TEXT,
@@ -316,11 +1385,11 @@ def create_cierres_tables():
         )
         cur.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_pagos_mes_owner_rango
-            ON pagos_mes(owner, mes_ini, mes_fin);
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_pagos_mes_tenant_rango
+            ON pagos_mes(tenant_id, mes_ini, mes_fin);
             """
         )
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_mes_owner ON pagos_mes(owner);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_mes_tenant ON pagos_mes(tenant_id);")
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS pagos_mes_nomina (
@@ -341,7 +1410,7 @@ def create_cierres_tables():
               id SERIAL PRIMARY KEY,
               pago_id INTEGER NOT NULL REFERENCES pagos_mes(id) ON DELETE CASCADE,
               fecha DATE,
-              lote TEXT,
+              finca_id INTEGER REFERENCES fincas(id),
               tipo TEXT,
               producto TEXT,
               etapa TEXT,
@@ -352,21 +1421,25 @@ def create_cierres_tables():
             );
             """
         )
+        # Las FK no crean índice: sin estos, leer_cierre_detalle recorre todo el detalle
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_mes_nomina_pago ON pagos_mes_nomina(pago_id);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_mes_insumos_pago ON pagos_mes_insumos(pago_id);")
         conn.commit()
     finally:
         conn.close()
 
 
+@db_policy("ddl")
 def ensure_cierres_schema():
     conn = connect_db(); cur = conn.cursor()
     try:
         for t in ("trabajadores", "jornadas", "insumos"):
-            cur.execute(f"ALTER TABLE {t} ADD COLUMN IF NOT EXISTS owner TEXT;")
-            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_owner ON {t}(owner);")
+            cur.execute(f"ALTER TABLE {t} ADD COLUMN IF NOT EXISTS tenant_id INTEGER REFERENCES users(tenant_id);")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_tenant ON {t}(tenant_id);")
         cur.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajadores_owner_nombre_apellido
-            ON trabajadores(owner, nombre, apellido);
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajadores_tenant_nombre_apellido
+            ON trabajadores(tenant_id, nombre, apellido);
             """
         )
         cur.execute(
@@ -382,10 +1455,89 @@ def ensure_cierres_schema():
         )
         cur.execute(
             """
-            CREATE UNIQUE INDEX IF NOT EXISTS uq_pagos_mes_owner_rango
-            ON pagos_mes(owner, mes_ini, mes_fin);
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_pagos_mes_tenant_rango
+            ON pagos_mes(tenant_id, mes_ini, mes_fin);
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Tablas que separan los datos por usuario (antes con `owner TEXT`, ahora con tenant_id)
+_TABLAS_TENANT = ("trabajadores", "fincas", "jornadas", "insumos", "tarifas_user", "pagos_mes", "plan_labores",
+                 "outbox_aplicadas")
+
+
+@db_policy("ddl")
+def ensure_tenant_ids():
+    """
+    Pasa la columna `owner` (el username repetido en cada fila y en cada hoja de índice) a tenant_id,
+    el entero que users asigna a cada cuenta. Va ANTES que las create_*: en una base nueva no hace
+    nada y en una vieja deja las columnas listas para que aquellas creen sus índices sobre tenant_id.
+    Antes de tocar nada se niega (RuntimeError) si algo impide el cambio: políticas RLS o vistas que
+    usan `owner` (hay que rehacerlas sobre app.tenant_id) u owners sin cuenta en users (hay que crearles
+    la cuenta o borrar sus filas; no se inventan cuentas). Idempotente.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("SELECT to_regclass('users') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return
+        cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS tenant_id INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE;")
+        viejas = [t for t in _TABLAS_TENANT if _tiene_columna(cur, t, "owner")]
+        if not viejas:
+            conn.commit()
+            return
+        # por qué: el DROP COLUMN falla con lo que dependa de owner (deptype 'n'); los índices caen solos
+        cur.execute(
+            """
+            SELECT DISTINCT pg_describe_object(d.classid, d.objid, d.objsubid)
+            FROM pg_depend d
+            JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+            WHERE d.refclassid = 'pg_class'::regclass AND d.deptype = 'n'
+              AND a.attname = 'owner' AND d.refobjid = ANY (%s::regclass[])
+            ORDER BY 1;
+            """,
+            (list(viejas),),
+        )
+        dependientes = [r[0] for r in cur.fetchall()]
+        if dependientes:
+            raise RuntimeError(
+                "No se migra owner -> tenant_id: dependen de la columna owner "
+                f"{', '.join(dependientes)}. Rehazlas sobre current_setting('app.tenant_id') y vuelve a correr "
+                "las migraciones."
+            )
+        cur.execute(
+            f"""
+            SELECT DISTINCT o.owner
+            FROM ({" UNION ".join(f"SELECT owner FROM {t}" for t in viejas)}) o
+            WHERE o.owner IS NOT NULL AND NOT EXISTS (SELECT 1 FROM users u WHERE u.username = o.owner)
+            ORDER BY 1;
             """
         )
+        huerfanos = [r[0] for r in cur.fetchall()]
+        if huerfanos:
+            raise RuntimeError(
+                f"No se migra owner -> tenant_id: hay filas de usuarios sin cuenta ({', '.join(huerfanos)}). "
+                "Crea esas cuentas o borra sus filas y vuelve a correr las migraciones."
+            )
+        for t in viejas:
+            cur.execute(
+                """
+                SELECT is_nullable = 'NO' FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name=%s AND column_name='owner';
+                """,
+                (t,),
+            )
+            obligatorio = cur.fetchone()[0]
+            cur.execute(f"ALTER TABLE {t} ADD COLUMN IF NOT EXISTS tenant_id INTEGER REFERENCES users(tenant_id);")
+            cur.execute(f"UPDATE {t} x SET tenant_id = u.tenant_id FROM users u WHERE x.tenant_id IS NULL AND u.username = x.owner;")
+            cur.execute(f"ALTER TABLE {t} DROP COLUMN owner;")  # se lleva sus índices; las create_* los rehacen
+            if obligatorio:
+                cur.execute(f"ALTER TABLE {t} ALTER COLUMN tenant_id SET NOT NULL;")
+        if "tarifas_user" in viejas:
+            cur.execute("ALTER TABLE tarifas_user ADD PRIMARY KEY (tenant_id);")
         conn.commit()
     finally:
         conn.close()
@@ -395,24 +1547,62 @@ def ensure_cierres_schema():
 # Autenticación
 # -------------
 
+_TENANTS: dict = {}  # username -> tenant_id; nunca cambia, así que se resuelve una vez por proceso
+
+
+def _tenant(owner: str) -> int:
+    """
+    tenant_id del usuario `owner`. Los helpers reciben el username (sesión, cola offline) y filtran
+    por este entero: la consulta a users solo ocurre la primera vez (o ya la hizo verify_user).
+    """
+    tenant = _TENANTS.get(owner)
+    if tenant is None:
+        conn = connect_db(); cur = conn.cursor()
+        try:
+            _run(cur, None, "SELECT tenant_id FROM users WHERE username=%s;", (owner,))
+            row = cur.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise ValueError(f"Usuario desconocido: {owner}")
+        tenant = _TENANTS[owner] = row[0]
+    return tenant
+
+
+@db_policy("write")
 def add_user(username, raw_password):
+    """Crea la cuenta; users le asigna su tenant_id."""
     hashed = bcrypt.hashpw(raw_password.encode(), bcrypt.gensalt()).decode()
     conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute("INSERT INTO users (username, password) VALUES (%s, %s);", (username, hashed))
+        _run(cur, None,
+            "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING tenant_id;",
+            (username, hashed),
+            sqlite="""
+            INSERT INTO users (username, password, tenant_id)
+            VALUES (%s, %s, (SELECT COALESCE(MAX(tenant_id), 0) + 1 FROM users))
+            RETURNING tenant_id;
+            """,
+        )
+        tenant = cur.fetchone()[0]
         conn.commit()
+        _TENANTS[username] = tenant
     finally:
         conn.close()
 
 
+@db_policy("read")
 def verify_user(username, raw_password):
     conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute("SELECT password FROM users WHERE username=%s;", (username,))
+        _run(cur, None, "SELECT password, tenant_id FROM users WHERE username=%s;", (username,))
         row = cur.fetchone()
         if not row:
             return False
-        return bcrypt.checkpw(raw_password.encode(), row[0].encode())
+        if not bcrypt.checkpw(raw_password.encode(), row[0].encode()):
+            return False
+        _TENANTS[username] = row[1]  # el resto de la sesión ya no pregunta por el tenant
+        return True
     finally:
         conn.close()
 
@@ -421,15 +1611,18 @@ def verify_user(username, raw_password):
 # Trabajadores
 # -------------
 
+@db_policy("write", offline=True)
 def add_trabajador(nombre, apellido, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            INSERT INTO trabajadores (owner, nombre, apellido) VALUES (%s,%s,%s)
-            ON CONFLICT (owner, nombre, apellido) DO NOTHING;
+            INSERT INTO trabajadores (tenant_id, nombre, apellido) VALUES (%s,%s,%s)
+            ON CONFLICT (tenant_id, nombre, apellido) DO UPDATE SET activo=TRUE
+            WHERE NOT trabajadores.activo;
             """,
-            (owner, nombre, apellido),
+            (tenant, nombre, apellido),
         )
         conn.commit()
         return cur.rowcount > 0
@@ -440,81 +1633,147 @@ def add_trabajador(nombre, apellido, owner):
         conn.close()
 
 
+@db_policy("read", offline=True)
 def get_all_trabajadores(owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            "SELECT nombre || ' ' || apellido FROM trabajadores WHERE owner=%s ORDER BY nombre, apellido;",
-            (owner,),
+        _run(cur, tenant,
+            "SELECT nombre || ' ' || apellido FROM trabajadores WHERE tenant_id=%s AND activo ORDER BY nombre, apellido;",
+            (tenant,),
+            prepare="get_all_trabajadores",
         )
         return [r[0] for r in cur.fetchall()]
     finally:
         conn.close()
 
 
+@db_policy("read", offline=True)
+def get_trabajadores(owner):
+    """[(id, "Nombre Apellido"), ...] de los trabajadores activos, para elegir por id."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            "SELECT id, nombre || ' ' || apellido FROM trabajadores WHERE tenant_id=%s AND activo ORDER BY nombre, apellido;",
+            (tenant,),
+            prepare="get_trabajadores",
+        )
+        return [tuple(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def _trabajador_id(tenant, trabajador):
+    """
+    Los helpers reciben el id del trabajador; un texto "Nombre Apellido" (llamadas viejas, entradas
+    de la cola offline) se resuelve aquí por nombre.
+    """
+    if trabajador is None or not isinstance(trabajador, str):
+        return trabajador
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            """
+            SELECT id FROM trabajadores
+            WHERE tenant_id=%s AND nombre || ' ' || apellido = %s
+            ORDER BY activo DESC LIMIT 1;
+            """,
+            (tenant, trabajador),
+        )
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError(f"Trabajador desconocido: {trabajador}")
+        return row[0]
+    finally:
+        conn.close()
+
+
 # --------
 # Jornadas
 # --------
 
+@db_policy("write", offline=True)
 def add_jornada(trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    """`trabajador` es el id en trabajadores (ver _trabajador_id); `lote`, id o nombre de la finca (ver _finca)."""
+    tenant = _tenant(owner)
+    trabajador = _trabajador_id(tenant, trabajador)
+    finca_sql, finca = _finca(tenant, lote)
+    valores = f"(%s,%s,%s,{finca_sql},%s,%s,%s,%s)"
+    fila = (tenant, trabajador, fecha, *finca, actividad, dias, horas_normales, horas_extra)
+    if _agrupar():
+        return _GROUP_COMMIT.insertar(
+            "jornadas", ("tenant_id", "trabajador_id", "fecha", "finca_id", "actividad", "dias", "horas_normales", "horas_extra"),
+            tenant, fila, valores)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            INSERT INTO jornadas (owner, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s);
+        _run(cur, tenant,
+            f"""
+            INSERT INTO jornadas (tenant_id, trabajador_id, fecha, finca_id, actividad, dias, horas_normales, horas_extra)
+            VALUES {valores};
             """,
-            (owner, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra),
+            fila,
         )
         conn.commit()
     finally:
         conn.close()
 
 
+@db_policy("read")
 def get_all_jornadas(owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT id, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra
-            FROM jornadas
-            WHERE owner=%s
-            ORDER BY fecha DESC, id DESC;
+            SELECT j.id, t.nombre || ' ' || t.apellido, j.fecha, f.nombre, j.actividad, j.dias, j.horas_normales, j.horas_extra
+            FROM jornadas_todas j JOIN trabajadores t ON t.id = j.trabajador_id LEFT JOIN fincas f ON f.id = j.finca_id
+            WHERE j.tenant_id=%s
+            ORDER BY j.fecha DESC, j.id DESC;
             """,
-            (owner,),
+            (tenant,),
+            prepare="get_all_jornadas", fila=Jornada,
         )
         return cur.fetchall()
     finally:
         conn.close()
 
 
+@db_policy("read")
 def get_last_jornada_by_date(fecha, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT id, owner, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra
-            FROM jornadas
-            WHERE owner=%s AND fecha=%s
-            ORDER BY id DESC LIMIT 1;
+            SELECT j.id, t.nombre || ' ' || t.apellido, j.fecha, f.nombre, j.actividad, j.dias,
+                   j.horas_normales, j.horas_extra
+            FROM jornadas j JOIN trabajadores t ON t.id = j.trabajador_id LEFT JOIN fincas f ON f.id = j.finca_id
+            WHERE j.tenant_id=%s AND j.fecha=%s
+            ORDER BY j.id DESC LIMIT 1;
             """,
-            (owner, fecha),
+            (tenant, fecha),
+            prepare="get_last_jornada_by_date", fila=Jornada,
         )
         return cur.fetchone()
     finally:
         conn.close()
 
 
+@db_policy("write", offline=True)
 def update_jornada(id_j, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    trabajador = _trabajador_id(tenant, trabajador)
+    finca_sql, finca = _finca(tenant, lote)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            """
+        _run(cur, tenant,
+            f"""
             UPDATE jornadas
-            SET trabajador=%s, fecha=%s, lote=%s, actividad=%s, dias=%s, horas_normales=%s, horas_extra=%s
-            WHERE id=%s AND owner=%s;
+            SET trabajador_id=%s, fecha=%s, finca_id={finca_sql}, actividad=%s, dias=%s, horas_normales=%s, horas_extra=%s
+            WHERE id=%s AND tenant_id=%s;
             """,
-            (trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra, id_j, owner),
+            (trabajador, fecha, *finca, actividad, dias, horas_normales, horas_extra, id_j, tenant),
         )
         conn.commit()
     finally:
@@ -525,349 +1784,965 @@ def update_jornada(id_j, trabajador, fecha, lote, actividad, dias, horas_normale
 # Insumos (Abono/Fumi/Cal/Herbi)
 # -----------------------------
 
+@db_policy("write", offline=True)
 def add_insumo(fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, owner):
-    costo_total = (cantidad or 0) * (precio_unitario or 0)
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    finca_sql, finca = _finca(tenant, lote)
+    valores = f"(%s,%s,{finca_sql},%s,%s,%s,%s,%s,%s)"
+    fila = (tenant, fecha, *finca, tipo, etapa, producto, dosis, cantidad, precio_unitario)
+    if _agrupar():
+        return _GROUP_COMMIT.insertar(
+            "insumos", ("tenant_id", "fecha", "finca_id", "tipo", "etapa", "producto", "dosis", "cantidad",
+                        "precio_unitario"),
+            tenant, fila, valores)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            INSERT INTO insumos (owner, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s);
+        _run(cur, tenant,
+            f"""
+            INSERT INTO insumos (tenant_id, fecha, finca_id, tipo, etapa, producto, dosis, cantidad, precio_unitario)
+            VALUES {valores};
             """,
-            (owner, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total),
+            fila,
         )
         conn.commit()
     finally:
         conn.close()
 
 
-# Los get_last_* devuelven 10 columnas SIN owner
+@db_policy("read")
+def get_insumos_by_tipo(tipo, owner):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            """
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos_todas i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.tipo=%s
+            ORDER BY i.fecha DESC, i.id DESC;
+            """,
+            (tenant, tipo),
+            prepare="get_insumos_by_tipo", fila=Insumo,
+        )
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+# Los get_last_* devuelven 10 columnas SIN tenant
 
+@db_policy("read")
 def get_last_abono_by_date(fecha, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-            FROM insumos
-            WHERE owner=%s AND tipo='Abono' AND fecha=%s
-            ORDER BY id DESC LIMIT 1;
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.tipo='Abono' AND i.fecha=%s
+            ORDER BY i.id DESC LIMIT 1;
             """,
-            (owner, fecha),
+            (tenant, fecha),
+            prepare="get_last_abono_by_date", fila=Insumo,
         )
         return cur.fetchone()
     finally:
         conn.close()
 
 
-def update_abono(id_i, fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, owner):
-    costo_total = (cantidad or 0) * (precio_unitario or 0)
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("write", offline=True)
+def update_insumo(id_i, tipo, fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, owner):
+    """Edita un insumo de `tipo` (Abono/Fumigación/Cal/Herbicida); costo_total lo recalcula la base."""
+    tenant = _tenant(owner)
+    finca_sql, finca = _finca(tenant, lote)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            """
+        _run(cur, tenant,
+            f"""
             UPDATE insumos
-            SET fecha=%s, lote=%s, etapa=%s, producto=%s, dosis=%s, cantidad=%s, precio_unitario=%s, costo_total=%s
-            WHERE id=%s AND owner=%s AND tipo='Abono';
+            SET fecha=%s, finca_id={finca_sql}, etapa=%s, producto=%s, dosis=%s, cantidad=%s, precio_unitario=%s
+            WHERE id=%s AND tenant_id=%s AND tipo=%s;
             """,
-            (fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, costo_total, id_i, owner),
+            (fecha, *finca, etapa, producto, dosis, cantidad, precio_unitario, id_i, tenant, tipo),
+            prepare="update_insumo",
         )
         conn.commit()
     finally:
         conn.close()
 
 
+# Entradas de la cola offline guardadas con los update_<tipo> que update_insumo reemplazó
+for _nombre, _tipo in (("update_abono", "Abono"), ("update_fumigacion", "Fumigación"),
+                       ("update_cal", "Cal"), ("update_herbicida", "Herbicida")):
+    _ENCOLABLES[_nombre] = functools.partial(
+        lambda tipo, id_i, *resto, **kw: _ENCOLABLES["update_insumo"](id_i, tipo, *resto, **kw), _tipo)
+
+
+@db_policy("read")
 def get_last_fumigacion_by_date(fecha, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-            FROM insumos
-            WHERE owner=%s AND tipo='Fumigación' AND fecha=%s
-            ORDER BY id DESC LIMIT 1;
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.tipo='Fumigación' AND i.fecha=%s
+            ORDER BY i.id DESC LIMIT 1;
             """,
-            (owner, fecha),
+            (tenant, fecha),
+            prepare="get_last_fumigacion_by_date", fila=Insumo,
         )
         return cur.fetchone()
     finally:
         conn.close()
 
 
-def update_fumigacion(id_i, fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, owner):
-    costo_total = (cantidad or 0) * (precio_unitario or 0)
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("read")
+def get_last_cal_by_date(fecha, owner):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            UPDATE insumos
-            SET fecha=%s, lote=%s, etapa=%s, producto=%s, dosis=%s, cantidad=%s, precio_unitario=%s, costo_total=%s
-            WHERE id=%s AND owner=%s AND tipo='Fumigación';
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.tipo='Cal' AND i.fecha=%s
+            ORDER BY i.id DESC LIMIT 1;
             """,
-            (fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, costo_total, id_i, owner),
+            (tenant, fecha),
+            prepare="get_last_cal_by_date", fila=Insumo,
         )
-        conn.commit()
+        return cur.fetchone()
     finally:
         conn.close()
 
 
-def get_last_cal_by_date(fecha, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("read")
+def get_last_herbicida_by_date(fecha, owner):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-            FROM insumos
-            WHERE owner=%s AND tipo='Cal' AND fecha=%s
-            ORDER BY id DESC LIMIT 1;
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.tipo='Herbicida' AND i.fecha=%s
+            ORDER BY i.id DESC LIMIT 1;
             """,
-            (owner, fecha),
+            (tenant, fecha),
+            prepare="get_last_herbicida_by_date", fila=Insumo,
         )
         return cur.fetchone()
     finally:
         conn.close()
 
 
-def update_cal(id_i, fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, owner):
-    costo_total = (cantidad or 0) * (precio_unitario or 0)
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+# -----------------------------
+# Edición masiva (editor de registros)
+# -----------------------------
+_EDITAR_JORNADAS_SQL = """
+    WITH v (id, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra) AS (VALUES {valores})
+    UPDATE jornadas
+    SET trabajador_id = (SELECT t.id FROM trabajadores t
+                         WHERE t.tenant_id = jornadas.tenant_id AND t.nombre || ' ' || t.apellido = v.trabajador
+                         ORDER BY t.activo DESC LIMIT 1),
+        fecha = v.fecha,
+        finca_id = (SELECT f.id FROM fincas f WHERE f.tenant_id = jornadas.tenant_id AND f.nombre = v.lote),
+        actividad = v.actividad, dias = v.dias, horas_normales = v.horas_normales, horas_extra = v.horas_extra
+    FROM v
+    WHERE jornadas.id = v.id AND jornadas.tenant_id = %s{rango};
+"""
+_FILA_JORNADA = "(%s::int, %s::text, %s::date, %s::text, %s::text, %s::int, %s::numeric, %s::numeric)"
+
+_EDITAR_INSUMOS_SQL = """
+    WITH v (id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario) AS (VALUES {valores})
+    UPDATE insumos
+    SET fecha = v.fecha,
+        finca_id = (SELECT f.id FROM fincas f WHERE f.tenant_id = insumos.tenant_id AND f.nombre = v.lote),
+        tipo = v.tipo, etapa = v.etapa, producto = v.producto, dosis = v.dosis,
+        cantidad = v.cantidad, precio_unitario = v.precio_unitario
+    FROM v
+    WHERE insumos.id = v.id AND insumos.tenant_id = %s{rango};
+"""
+_FILA_INSUMO = "(%s::int, %s::date, %s::text, %s::text, %s::text, %s::text, %s::text, %s::numeric, %s::numeric)"
+
+
+def _guardar_edicion(owner, tabla, sql, fila_sql, filas, borrados, desde, hasta):
+    tenant = _tenant(owner)
+    # por qué: con el rango que cargó el editor, Postgres poda particiones y usa (tenant_id, fecha)
+    # en vez de recorrer toda la historia del tenant para cruzarla con los ids
+    rango, p_rango = (f" AND {tabla}.fecha BETWEEN %s AND %s", (desde, hasta)) if desde and hasta else ("", ())
+    actualizadas = borradas = 0
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            UPDATE insumos
-            SET fecha=%s, lote=%s, tipo='Cal', etapa=%s, producto=%s, dosis=%s, cantidad=%s, precio_unitario=%s, costo_total=%s
-            WHERE id=%s AND owner=%s AND tipo='Cal';
-            """,
-            (fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, costo_total, id_i, owner),
-        )
+        for i in range(0, len(filas), DB_LOTE_EDICION):
+            lote = filas[i:i + DB_LOTE_EDICION]
+            _run(cur, tenant, sql.format(valores=", ".join([fila_sql] * len(lote)), rango=rango),
+                 (*itertools.chain.from_iterable(lote), tenant, *p_rango))
+            actualizadas += cur.rowcount
+        borrados = [int(b) for b in borrados]
+        for i in range(0, len(borrados), DB_LOTE_EDICION):
+            ids = borrados[i:i + DB_LOTE_EDICION]
+            _run(cur, tenant, f"DELETE FROM {tabla} WHERE tenant_id=%s AND id IN ({', '.join(['%s'] * len(ids))}){rango};",
+                 (tenant, *ids, *p_rango))
+            borradas += cur.rowcount
         conn.commit()
+        return actualizadas, borradas
     finally:
         conn.close()
 
 
-def get_last_herbicida_by_date(fecha, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("write")
+def guardar_jornadas_editadas(owner, filas, borrados=(), desde=None, hasta=None):
+    """
+    Guarda lo cambiado en el editor de jornadas en una transacción: un UPDATE ... FROM (VALUES ...) por
+    cada DB_LOTE_EDICION filas y un DELETE por lote de ids. `filas` con la forma de Jornada sin
+    tenant: (id, "Nombre Apellido", fecha, lote, actividad, dias, horas_normales, horas_extra); el
+    trabajador y el lote se resuelven por nombre en la misma sentencia. `desde`/`hasta`: el rango que se
+    cargó en el editor (fecha original de las filas). Devuelve (actualizadas, borradas).
+    Las filas archivadas (archivar_meses_cerrados) no se tocan.
+    No va a la cola offline: reenviada más tarde pisaría lo que otra sesión haya editado entretanto
+    sobre datos que esta ya no ve; sin red falla y los cambios quedan en la grilla para reintentar.
+    """
+    filas = [tuple(f[:8]) for f in filas]
+    return _guardar_edicion(owner, "jornadas", _EDITAR_JORNADAS_SQL, _FILA_JORNADA, filas, borrados, desde, hasta)
+
+
+@db_policy("write")
+def guardar_insumos_editados(owner, filas, borrados=(), desde=None, hasta=None):
+    """
+    Igual que guardar_jornadas_editadas para insumos. `filas` con la forma de Insumo; el costo_total que
+    traigan se ignora (es columna generada). Tampoco se encola.
+    """
+    filas = [tuple(f[:9]) for f in filas]
+    return _guardar_edicion(owner, "insumos", _EDITAR_INSUMOS_SQL, _FILA_INSUMO, filas, borrados, desde, hasta)
+
+
+# -----------------------------
+# Correcciones en bloque (insumos)
+# -----------------------------
+def _corregir_insumos(owner, set_sql, set_params, fecha_ini, fecha_fin, filtros, dry_run, extra=()):
+    """
+    Un solo UPDATE sobre los insumos vivos de [fecha_ini, fecha_fin] que cumplen `filtros` (columna -> valor;
+    None no filtra, "lote" se resuelve a finca_id) y las condiciones `extra` [(sql, params)]. Con dry_run
+    corre un COUNT(*) con el mismo WHERE y no escribe. Devuelve cuántas filas cambia (o cambiaría).
+    """
+    tenant = _tenant(owner)
+    where, params = ["tenant_id=%s", "fecha BETWEEN %s AND %s"], [tenant, fecha_ini, fecha_fin]
+    condiciones = list(extra)
+    for col, valor in filtros.items():
+        if valor is None:
+            continue
+        if col == "lote":
+            finca_sql, finca = _finca(tenant, valor)
+            condiciones.append((f"finca_id = {finca_sql}", finca))
+        else:
+            condiciones.append((f"{col}=%s", (valor,)))
+    for sql, p in condiciones:
+        where.append(sql)
+        params += p
+    where = " AND ".join(where)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        if dry_run:
+            _run(cur, tenant, f"SELECT COUNT(*) FROM insumos WHERE {where};", params)
+            return cur.fetchone()[0]
+        _run(cur, tenant, f"UPDATE insumos SET {set_sql} WHERE {where};", (*set_params, *params))
+        n = cur.rowcount
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+
+@db_policy("write")
+def repreciar_insumos(owner, producto, precio_unitario, fecha_ini, fecha_fin, tipo=None, lote=None, dry_run=False):
+    """
+    Cambia el precio_unitario de `producto` en el rango (p. ej. al llegar la factura del proveedor);
+    costo_total, que es generada, se recalcula en la misma sentencia.
+    """
+    return _corregir_insumos(
+        owner, "precio_unitario=%s", (precio_unitario,),
+        fecha_ini, fecha_fin, {"producto": producto, "tipo": tipo, "lote": lote}, dry_run,
+    )
+
+
+@db_policy("write")
+def mover_insumos_de_lote(owner, lote_origen, lote_destino, fecha_ini, fecha_fin, tipo=None, producto=None, dry_run=False):
+    """Pasa a `lote_destino` los insumos de `lote_origen` en el rango. Si el destino no existe no mueve nada."""
+    finca_sql, finca = _finca(_tenant(owner), lote_destino)
+    return _corregir_insumos(
+        owner, f"finca_id = {finca_sql}", finca,
+        fecha_ini, fecha_fin, {"lote": lote_origen, "tipo": tipo, "producto": producto}, dry_run,
+        extra=[(f"{finca_sql} IS NOT NULL", finca)],
+    )
+
+
+@db_policy("write")
+def reasignar_etapa_insumos(owner, etapa_nueva, fecha_ini, fecha_fin, tipo=None, etapa=None, producto=None,
+                            lote=None, dry_run=False):
+    """Pone `etapa_nueva` a los insumos del rango que cumplen los filtros (tipo, etapa actual, producto, lote)."""
+    return _corregir_insumos(
+        owner, "etapa=%s", (etapa_nueva,),
+        fecha_ini, fecha_fin, {"tipo": tipo, "etapa": etapa, "producto": producto, "lote": lote}, dry_run,
+    )
+
+
+# -----------------------------
+# Consultas por rango
+# -----------------------------
+
+@db_policy("read")
+def get_jornadas_between(fecha_ini, fecha_fin, owner):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
             """
-            SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-            FROM insumos
-            WHERE owner=%s AND tipo='Herbicida' AND fecha=%s
-            ORDER BY id DESC LIMIT 1;
+            SELECT j.id, t.nombre || ' ' || t.apellido, j.fecha, f.nombre, j.actividad, j.dias, j.horas_normales, j.horas_extra
+            FROM jornadas_todas j JOIN trabajadores t ON t.id = j.trabajador_id LEFT JOIN fincas f ON f.id = j.finca_id
+            WHERE j.tenant_id=%s AND j.fecha BETWEEN %s AND %s
+            ORDER BY j.fecha DESC, j.id DESC;
             """,
-            (owner, fecha),
+            (tenant, fecha_ini, fecha_fin),
+            prepare="get_jornadas_between", fila=Jornada,
         )
-        return cur.fetchone()
+        return cur.fetchall()
     finally:
         conn.close()
 
 
-def update_herbicida(id_i, fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, owner):
-    costo_total = (cantidad or 0) * (precio_unitario or 0)
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("read")
+def get_insumos_between(fecha_ini, fecha_fin, owner):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
-            UPDATE insumos
-            SET fecha=%s, lote=%s, tipo='Herbicida', etapa=%s, producto=%s, dosis=%s, cantidad=%s, precio_unitario=%s, costo_total=%s
-            WHERE id=%s AND owner=%s AND tipo='Herbicida';
+            SELECT i.id, i.fecha, f.nombre, i.tipo, i.etapa, i.producto, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos_todas i LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.tenant_id=%s AND i.fecha BETWEEN %s AND %s
+            ORDER BY i.fecha DESC, i.id DESC;
             """,
-            (fecha, lote, etapa, producto, dosis, cantidad, precio_unitario, costo_total, id_i, owner),
+            (tenant, fecha_ini, fecha_fin),
+            prepare="get_insumos_between", fila=Insumo,
         )
-        conn.commit()
+        return cur.fetchall()
     finally:
         conn.close()
 
 
-# -----------------------------
-# Consultas por rango (con retry)
-# -----------------------------
-
-def get_jornadas_between(fecha_ini, fecha_fin, owner):
-    def _run():
-        conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-        try:
-            cur.execute(
-                """
-                SELECT id, trabajador, fecha, lote, actividad, dias, horas_normales, horas_extra
-                FROM jornadas
-                WHERE owner=%s AND fecha BETWEEN %s AND %s
-                ORDER BY fecha DESC, id DESC;
-                """,
-                (owner, fecha_ini, fecha_fin),
-            )
-            return cur.fetchall()
-        finally:
-            conn.close()
+# ---------------------------------------------
+# Lecturas columnares -> DataFrame tipado
+# ---------------------------------------------
+# Para reportes sobre rangos grandes: cada bloque de DB_FETCH_CHUNK filas se pasa enseguida a arreglos
+# numpy por columna, así nunca hay una lista completa de tuplas con Decimal/date. El dinero llega como
+# float8 y la fecha como días desde 1970 (convertidos en bloque a datetime64).
+_DIAS_PG = "(%s - DATE '1970-01-01')"
+_DIAS_SQLITE = "CAST(julianday(%s) - 2440587.5 AS INTEGER)"
+
+
+def _df_columnar(cur, columnas) -> pd.DataFrame:
+    """
+    `columnas`: [(nombre, tipo)] en el orden del SELECT. Tipos: "int", "float", "fecha" (días desde 1970),
+    "cat" (texto repetido -> category) y "str".
+    """
+    numericos = {"int": "int64", "float": "float64", "fecha": "float64"}  # fecha NULL -> NaN -> NaT
+    bloques = [[] for _ in columnas]
+    # el conteo de _count_fetched (str() de cada valor) costaría más que armar las columnas:
+    # filas y bytes se cuentan acá, por bloque
+    contando, _CALL.rows = getattr(_CALL, "rows", None), None
+    filas = nbytes = 0
+    try:
+        while rows := cur.fetchmany(DB_FETCH_CHUNK):
+            filas += len(rows)
+            for (_, tipo), acumulado, valores in zip(columnas, bloques, zip(*rows)):
+                arr = np.array(valores, dtype=numericos.get(tipo, object))
+                nbytes += arr.nbytes if tipo in numericos else sum(map(len, filter(None, valores)))
+                acumulado.append(arr)
+    finally:
+        _CALL.rows = contando
+    if contando is not None:
+        _CALL.rows += filas
+        _CALL.bytes += nbytes
+    datos = {}
+    for (nombre, tipo), acumulado in zip(columnas, bloques):
+        arr = np.concatenate(acumulado) if acumulado else np.array([], dtype=numericos.get(tipo, object))
+        if tipo == "fecha":
+            datos[nombre] = pd.to_datetime(arr, unit="D")
+        elif tipo == "cat":
+            datos[nombre] = pd.Categorical(arr)
+        else:
+            datos[nombre] = arr
+    return pd.DataFrame(datos)
+
+
+def _filtros_df(alias, tenant, fecha_ini, fecha_fin, tipo=None):
+    where, params, nombre = [f"{alias}.tenant_id=%s"], [tenant], ""
+    if fecha_ini is not None or fecha_fin is not None:
+        where.append(f"{alias}.fecha BETWEEN %s AND %s")
+        params += [fecha_ini or datetime.date.min, fecha_fin or datetime.date.max]
+        nombre += "_rango"
+    if tipo is not None:
+        where.append(f"{alias}.tipo=%s")
+        params.append(tipo)
+        nombre += "_tipo"
+    return " AND ".join(where), tuple(params), nombre
+
+
+@db_policy("read")
+def get_jornadas_df(owner, fecha_ini=None, fecha_fin=None) -> pd.DataFrame:
+    """
+    Jornadas (vivas + archivo) como DataFrame tipado, con las columnas de reportes.COLS_JORNADAS:
+    Fecha datetime64, Trabajador/Lote/Actividad category, Días int64, horas float64.
+    """
+    tenant = _tenant(owner)
+    where, params, variante = _filtros_df("j", tenant, fecha_ini, fecha_fin)
+    sql = f"""
+        SELECT j.id, t.nombre || ' ' || t.apellido, {_DIAS_PG % "j.fecha"}, f.nombre, j.actividad,
+               j.dias, j.horas_normales::float8, j.horas_extra::float8
+        FROM jornadas_todas j JOIN trabajadores t ON t.id = j.trabajador_id LEFT JOIN fincas f ON f.id = j.finca_id
+        WHERE {where}
+        ORDER BY j.fecha DESC, j.id DESC;
+    """
+    conn = connect_db(); cur = conn.cursor()
     try:
-        return _run()
-    except OperationalError:
-        time.sleep(0.8)
-        return _run()
+        _run(cur, tenant, sql, params, prepare="get_jornadas_df" + variante,
+             sqlite=sql.replace(_DIAS_PG % "j.fecha", _DIAS_SQLITE % "j.fecha"))
+        return _df_columnar(cur, [
+            ("ID", "int"), ("Trabajador", "cat"), ("Fecha", "fecha"), ("Lote", "cat"), ("Actividad", "cat"),
+            ("Días", "int"), ("Horas Normales", "float"), ("Horas Extra", "float"),
+        ])
+    finally:
+        conn.close()
 
 
-def get_insumos_between(fecha_ini, fecha_fin, owner):
-    def _run():
-        conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-        try:
-            cur.execute(
-                """
-                SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-                FROM insumos
-                WHERE owner=%s AND fecha BETWEEN %s AND %s
-                ORDER BY fecha DESC, id DESC;
-                """,
-                (owner, fecha_ini, fecha_fin),
-            )
-            return cur.fetchall()
-        finally:
-            conn.close()
+@db_policy("read")
+def get_insumos_df(owner, fecha_ini=None, fecha_fin=None, tipo=None) -> pd.DataFrame:
+    """
+    Insumos (vivos + archivo) como DataFrame tipado, con las columnas de reportes.COLS_INSUMOS.
+    Sin rango incluye los de fecha vacía (Fecha NaT), igual que get_insumos_by_tipo.
+    """
+    tenant = _tenant(owner)
+    where, params, variante = _filtros_df("i", tenant, fecha_ini, fecha_fin, tipo)
+    sql = f"""
+        SELECT i.id, {_DIAS_PG % "i.fecha"}, f.nombre, i.tipo, i.etapa, i.producto, i.dosis,
+               i.cantidad::float8, i.precio_unitario::float8, i.costo_total::float8
+        FROM insumos_todas i LEFT JOIN fincas f ON f.id = i.finca_id
+        WHERE {where}
+        ORDER BY i.fecha DESC, i.id DESC;
+    """
+    conn = connect_db(); cur = conn.cursor()
     try:
-        return _run()
-    except OperationalError:
-        time.sleep(0.8)
-        return _run()
+        _run(cur, tenant, sql, params, prepare="get_insumos_df" + variante,
+             sqlite=sql.replace(_DIAS_PG % "i.fecha", _DIAS_SQLITE % "i.fecha"))
+        return _df_columnar(cur, [
+            ("ID", "int"), ("Fecha", "fecha"), ("Lote", "cat"), ("Tipo", "cat"), ("Etapa", "cat"),
+            ("Producto", "cat"), ("Dosis", "str"), ("Cantidad", "float"), ("Precio Unitario", "float"),
+            ("Costo Total", "float"),
+        ])
+    finally:
+        conn.close()
 
 
 # ---------------------------------------------
-# Cierres (crear / listar / leer detalle)
+# Resúmenes diarios (mantenidos por triggers)
 # ---------------------------------------------
+# jornadas_dia: una fila por tenant/día/trabajador/lote; insumos_dia: por tenant/día/lote/tipo. Cubren vivas +
+# archivo: archivar es DELETE + INSERT y el resumen queda igual. Los triggers son de sentencia con tablas de
+# transición: suman NEW TABLE y restan OLD TABLE, así un guardado del editor o una corrección en bloque es un
+# solo upsert ordenado por clave (sin deadlocks entre sesiones). Sin lote, finca_id = 0 como en costos_lote_mes.
+_RESUMENES = {
+    # tabla: (resumen, columnas clave, expresiones clave, columnas sumadas)
+    "jornadas": ("jornadas_dia", "trabajador_id, finca_id", "trabajador_id, COALESCE(finca_id, 0)",
+                 ("dias", "horas_extra")),
+    "insumos": ("insumos_dia", "finca_id, tipo", "COALESCE(finca_id, 0), COALESCE(tipo, 'Otro')",
+                ("costo_total",)),
+}
+
+
+def _sumar_resumen(tabla: str, origen: str) -> str:
+    """Upsert de `origen` (filas de `tabla` con una columna signo: 1 entra, -1 sale) en su resumen."""
+    resumen, claves, expresiones, sumas = _RESUMENES[tabla]
+    return f"""
+        INSERT INTO {resumen} AS r (tenant_id, fecha, {claves}, {", ".join(sumas)}, registros)
+        SELECT tenant_id, fecha, {expresiones}, {", ".join(f"SUM(signo * {c})" for c in sumas)}, SUM(signo)
+        FROM ({origen}) x
+        WHERE fecha IS NOT NULL
+        GROUP BY tenant_id, fecha, {expresiones}
+        ORDER BY tenant_id, fecha, {expresiones}
+        ON CONFLICT (tenant_id, fecha, {claves}) DO UPDATE SET
+            {", ".join(f"{c} = r.{c} + EXCLUDED.{c}" for c in (*sumas, "registros"))}
+    """
+
+
+def _filas_resumen(tabla: str, fuente: str, signo: int) -> str:
+    _, claves, _, sumas = _RESUMENES[tabla]
+    return f"SELECT tenant_id, fecha, {claves}, {', '.join(sumas)}, {signo} AS signo FROM {fuente}"
+
+
+def _reconstruir_resumen(cur, tabla: str, desde=None, hasta=None):
+    """Recalcula el resumen de `tabla` en el rango (todo, sin rango) desde las filas vivas y de archivo."""
+    resumen = _RESUMENES[tabla][0]
+    rango = (desde or datetime.date.min, hasta or datetime.date.max)
+    # SHARE: nadie escribe en la tabla mientras se recalcula, las lecturas siguen
+    cur.execute(f"LOCK TABLE {tabla}, {tabla}_archivo IN SHARE MODE;")
+    cur.execute(f"DELETE FROM {resumen} WHERE fecha BETWEEN %s AND %s;", rango)
+    filtro = " WHERE fecha BETWEEN %s AND %s"
+    cur.execute(
+        _sumar_resumen(tabla, _filas_resumen(tabla, tabla + filtro, 1) + " UNION ALL "
+                       + _filas_resumen(tabla, f"{tabla}_archivo" + filtro, 1)) + ";",
+        rango * 2,
+    )
 
-def crear_cierre_mensual(mes_ini, mes_fin, creado_por, owner, tarifa_dia, tarifa_hora_extra, overwrite=False):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+
+@db_policy("ddl")
+def create_resumenes_diarios():
+    """
+    Tablas jornadas_dia / insumos_dia y sus triggers en las tablas vivas y de archivo (después de
+    create_archivo_tables). Si a una tabla le falta algún trigger (base anterior, o ensure_particiones la
+    rehízo) se crean y su resumen se recalcula entero. La función de los triggers es SECURITY DEFINER: el
+    rol de la app sólo necesita SELECT sobre los resúmenes, y las lecturas filtran por tenant_id.
+    """
+    conn = connect_db(); cur = conn.cursor()
     try:
         cur.execute(
-            "SELECT id FROM pagos_mes WHERE owner=%s AND mes_ini=%s AND mes_fin=%s;",
-            (owner, mes_ini, mes_fin),
+            """
+            CREATE TABLE IF NOT EXISTS jornadas_dia (
+              tenant_id INTEGER NOT NULL,
+              fecha DATE NOT NULL,
+              trabajador_id INTEGER NOT NULL,
+              finca_id INTEGER NOT NULL,
+              dias INTEGER NOT NULL,
+              horas_extra NUMERIC(10,2) NOT NULL,
+              registros INTEGER NOT NULL,
+              PRIMARY KEY (tenant_id, fecha, trabajador_id, finca_id)
+            );
+            """
         )
-        row = cur.fetchone()
-        if row and not overwrite:
-            raise ValueError("Ya existe un cierre para ese mes. Activa 'Sobrescribir' si quieres recrearlo.")
-        if row and overwrite:
-            cur.execute(
-                "DELETE FROM pagos_mes WHERE owner=%s AND mes_ini=%s AND mes_fin=%s;",
-                (owner, mes_ini, mes_fin),
-            )
-            conn.commit()
-
         cur.execute(
             """
-            SELECT trabajador, COALESCE(SUM(dias),0) AS dias, COALESCE(SUM(horas_extra),0) AS horas_extra
-            FROM jornadas
-            WHERE owner=%s AND fecha BETWEEN %s AND %s
-            GROUP BY trabajador
-            ORDER BY trabajador;
-            """,
-            (owner, mes_ini, mes_fin),
+            CREATE TABLE IF NOT EXISTS insumos_dia (
+              tenant_id INTEGER NOT NULL,
+              fecha DATE NOT NULL,
+              finca_id INTEGER NOT NULL,
+              tipo TEXT NOT NULL,
+              costo_total NUMERIC(20,2) NOT NULL,
+              registros INTEGER NOT NULL,
+              PRIMARY KEY (tenant_id, fecha, finca_id, tipo)
+            );
+            """
         )
-        nomina_rows = cur.fetchall()
-
-        total_nomina = 0.0
-        detalle_nomina = []
-        for trab, dias, hextra in nomina_rows:
-            monto_dias = (dias or 0) * float(tarifa_dia)
-            monto_hex  = (hextra or 0) * float(tarifa_hora_extra)
-            total      = (monto_dias or 0) + (monto_hex or 0)
-            total_nomina += float(total)
-            detalle_nomina.append(
-                (trab, int(dias or 0), float(hextra or 0), float(monto_dias or 0), float(monto_hex or 0), float(total or 0))
+        for t, (resumen, claves, _, _) in _RESUMENES.items():
+            # las filas que quedan en cero se borran, así el resumen no crece con días vaciados
+            limpiar = f"""
+                DELETE FROM {resumen} r USING (SELECT DISTINCT tenant_id, fecha FROM viejas) v
+                WHERE r.tenant_id = v.tenant_id AND r.fecha = v.fecha AND r.registros = 0;
+            """
+            cur.execute(
+                f"""
+                CREATE OR REPLACE FUNCTION {resumen}_trg() RETURNS trigger
+                LANGUAGE plpgsql SECURITY DEFINER SET search_path FROM CURRENT AS $f$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        {_sumar_resumen(t, _filas_resumen(t, "nuevas", 1))};
+                    ELSIF TG_OP = 'UPDATE' THEN
+                        {_sumar_resumen(t, _filas_resumen(t, "nuevas", 1) + " UNION ALL " + _filas_resumen(t, "viejas", -1))};
+                        {limpiar}
+                    ELSE
+                        {_sumar_resumen(t, _filas_resumen(t, "viejas", -1))};
+                        {limpiar}
+                    END IF;
+                    RETURN NULL;
+                END
+                $f$;
+                """
             )
-
+            faltaba = False
+            for base in (t, f"{t}_archivo"):
+                for evento, sufijo, transicion in (("INSERT", "ins", "NEW TABLE AS nuevas"),
+                                                   ("UPDATE", "upd", "OLD TABLE AS viejas NEW TABLE AS nuevas"),
+                                                   ("DELETE", "del", "OLD TABLE AS viejas")):
+                    cur.execute("SELECT 1 FROM pg_trigger WHERE tgrelid = %s::regclass AND tgname = %s;",
+                                (base, f"{base}_dia_{sufijo}"))
+                    if cur.fetchone() is None:
+                        faltaba = True
+                        cur.execute(
+                            f"CREATE TRIGGER {base}_dia_{sufijo} AFTER {evento} ON {base} REFERENCING {transicion} "
+                            f"FOR EACH STATEMENT EXECUTE FUNCTION {resumen}_trg();"
+                        )
+            if faltaba:
+                _reconstruir_resumen(cur, t)
+        # el rol de la app (si no es el dueño) lee los resúmenes igual que jornadas
         cur.execute(
             """
-            SELECT fecha, lote, tipo, producto, etapa, dosis, cantidad, precio_unitario, costo_total
-            FROM insumos
-            WHERE owner=%s AND fecha BETWEEN %s AND %s
-            ORDER BY fecha, id;
-            """,
-            (owner, mes_ini, mes_fin),
+            SELECT grantee FROM information_schema.role_table_grants
+            WHERE table_schema = current_schema() AND table_name='jornadas' AND grantee <> current_user
+              AND privilege_type = 'SELECT';
+            """
         )
-        insumos_rows = cur.fetchall()
+        for (rol,) in cur.fetchall():
+            rol = psycopg2.extensions.quote_ident(rol, cur)
+            cur.execute(f"GRANT SELECT ON jornadas_dia, insumos_dia TO {rol};")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@db_policy("read")
+def get_resumen_jornadas_df(owner, fecha_ini=None, fecha_fin=None) -> pd.DataFrame:
+    """
+    Días y horas extra por trabajador, sumados de jornadas_dia (unas filas por día, no cada jornada).
+    Columnas Trabajador, Días, Horas Extra: entra tal cual en reportes.resumen_nomina_mes / resumen_por_trabajador.
+    """
+    tenant = _tenant(owner)
+    where, params, variante = _filtros_df("r", tenant, fecha_ini, fecha_fin)
+    sql = f"""
+        SELECT t.nombre || ' ' || t.apellido, SUM(r.dias), SUM(r.horas_extra)::float8
+        FROM jornadas_dia r JOIN trabajadores t ON t.id = r.trabajador_id
+        WHERE {where}
+        GROUP BY t.id, t.nombre, t.apellido
+        ORDER BY 1;
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant, sql, params, prepare="get_resumen_jornadas_df" + variante)
+        return _df_columnar(cur, [("Trabajador", "cat"), ("Días", "int"), ("Horas Extra", "float")])
+    finally:
+        conn.close()
 
-        total_insumos = sum(float(r[-1] or 0) for r in insumos_rows)
-        total_general = float(total_nomina) + float(total_insumos)
 
+@db_policy("read")
+def get_resumen_insumos_df(owner, fecha_ini=None, fecha_fin=None) -> pd.DataFrame:
+    """Registros y costo por tipo de insumo, sumados de insumos_dia. Columnas Tipo, Registros, Costo Total."""
+    tenant = _tenant(owner)
+    where, params, variante = _filtros_df("r", tenant, fecha_ini, fecha_fin)
+    sql = f"""
+        SELECT r.tipo, SUM(r.registros), SUM(r.costo_total)::float8
+        FROM insumos_dia r
+        WHERE {where}
+        GROUP BY r.tipo
+        ORDER BY 1;
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant, sql, params, prepare="get_resumen_insumos_df" + variante)
+        return _df_columnar(cur, [("Tipo", "str"), ("Registros", "int"), ("Costo Total", "float")])
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------
+# Costos por lote y mes (vista materializada)
+# ---------------------------------------------
+# costos_lote_mes: una fila por tenant/lote/mes/tipo ("Mano de obra" o el tipo de insumo), vivas + archivo.
+# La mano de obra queda en días y horas extra: el costo se calcula al leer, con las tarifas del cierre
+# (pagos_mes) en los meses cerrados y con las vigentes en los abiertos (get_costos_lote_df).
+# Lee las tablas y no las vistas *_todas para que create_archivo_tables pueda seguir rehaciéndolas.
+_COSTOS_LOTE_MES_SQL = """
+    SELECT tenant_id, COALESCE(finca_id, 0) AS finca_id, date_trunc('month', fecha)::date AS mes,
+           'Mano de obra'::text AS tipo, SUM(dias)::numeric AS dias, SUM(horas_extra) AS horas_extra,
+           0::numeric AS costo_insumos, COUNT(*) AS registros
+    FROM (SELECT tenant_id, finca_id, fecha, dias, horas_extra FROM jornadas
+          UNION ALL
+          SELECT tenant_id, finca_id, fecha, dias, horas_extra FROM jornadas_archivo) j
+    GROUP BY 1, 2, 3
+    UNION ALL
+    SELECT tenant_id, COALESCE(finca_id, 0), date_trunc('month', fecha)::date, COALESCE(tipo, 'Otro'),
+           0, 0, SUM(costo_total), COUNT(*)
+    FROM (SELECT tenant_id, finca_id, fecha, tipo, costo_total FROM insumos
+          UNION ALL
+          SELECT tenant_id, finca_id, fecha, tipo, costo_total FROM insumos_archivo) i
+    WHERE fecha IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+@db_policy("ddl")
+def create_costos_views():
+    """
+    Vista materializada costos_lote_mes (después de create_archivo_tables: lee las tablas _archivo) y la
+    tabla vistas_refresco con la hora de su último REFRESH. El índice único es el que exige
+    REFRESH ... CONCURRENTLY. Las vistas materializadas no tienen RLS: las lecturas filtran por tenant_id.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
         cur.execute(
             """
-            INSERT INTO pagos_mes
-                (owner, mes_ini, mes_fin, creado_por, tarifa_dia, tarifa_hora_extra, total_nomina, total_insumos, total_general)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            RETURNING id;
-            """,
-            (owner, mes_ini, mes_fin, creado_por, tarifa_dia, tarifa_hora_extra, total_nomina, total_insumos, total_general),
+            CREATE TABLE IF NOT EXISTS vistas_refresco (
+              vista TEXT PRIMARY KEY,
+              refrescada_at TIMESTAMPTZ NOT NULL
+            );
+            """
         )
-        pago_id = cur.fetchone()[0]
-
-        if detalle_nomina:
-            execute_values(
-                cur,
-                """
-                INSERT INTO pagos_mes_nomina
-                  (pago_id, trabajador, dias, horas_extra, monto_dias, monto_hex, total)
-                VALUES %s;
-                """,
-                [(pago_id, *row) for row in detalle_nomina],
+        cur.execute("SELECT to_regclass('costos_lote_mes') IS NULL;")
+        if cur.fetchone()[0]:
+            cur.execute(f"CREATE MATERIALIZED VIEW costos_lote_mes AS {_COSTOS_LOTE_MES_SQL};")
+            cur.execute(
+                "INSERT INTO vistas_refresco VALUES ('costos_lote_mes', now()) "
+                "ON CONFLICT (vista) DO UPDATE SET refrescada_at = EXCLUDED.refrescada_at;"
             )
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_costos_lote_mes ON costos_lote_mes(tenant_id, mes, finca_id, tipo);")
+        # el rol de la app (si no es el dueño) lee la vista igual que jornadas
+        cur.execute(
+            """
+            SELECT grantee FROM information_schema.role_table_grants
+            WHERE table_schema = current_schema() AND table_name='jornadas' AND grantee <> current_user
+              AND privilege_type = 'SELECT';
+            """
+        )
+        for (rol,) in cur.fetchall():
+            rol = psycopg2.extensions.quote_ident(rol, cur)
+            cur.execute(f"GRANT SELECT ON costos_lote_mes, vistas_refresco TO {rol};")
+        conn.commit()
+    finally:
+        conn.close()
 
-        if insumos_rows:
-            execute_values(
-                cur,
-                """
-                INSERT INTO pagos_mes_insumos
-                  (pago_id, fecha, lote, tipo, producto, etapa, dosis, cantidad, precio_unitario, costo_total)
-                VALUES %s;
-                """,
-                [(pago_id, *r) for r in insumos_rows],
+
+@db_policy("ddl")
+def refrescar_costos(max_seg: int | None = None):
+    """
+    REFRESH MATERIALIZED VIEW CONCURRENTLY costos_lote_mes: las lecturas siguen viendo la versión anterior
+    mientras se recalcula. Con `max_seg`, sólo si el último refresco pasó hace más de eso; si otro proceso
+    ya está refrescando, no espera. Recorre todos los tenants: la corre costos.py desde cron (con el rol
+    dueño de la vista), nunca una página. Corta a los DB_COSTOS_TIMEOUT_MS. Devuelve la hora del último refresco.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("SELECT refrescada_at, now() - refrescada_at > make_interval(secs => %s) FROM vistas_refresco "
+                    "WHERE vista = 'costos_lote_mes';", (max_seg or 0,))
+        ultima, vieja = cur.fetchone() or (None, True)
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('costos_lote_mes'));")
+        if (max_seg is None or vieja) and cur.fetchone()[0]:
+            cur.execute("SET LOCAL statement_timeout = %s;", (DB_COSTOS_TIMEOUT_MS,))
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY costos_lote_mes;")
+            cur.execute(
+                "INSERT INTO vistas_refresco VALUES ('costos_lote_mes', now()) "
+                "ON CONFLICT (vista) DO UPDATE SET refrescada_at = EXCLUDED.refrescada_at RETURNING refrescada_at;"
             )
+            ultima = cur.fetchone()[0]
+        conn.commit()
+        return ultima
+    finally:
+        conn.close()
 
+
+@db_policy("read")
+def get_costos_refresco():
+    """
+    Hora del último REFRESH de costos_lote_mes, o None en SQLite (ahí la vista se calcula al leer).
+    La página de costos sólo la muestra; recalcular es cosa de costos.py.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, None, "SELECT refrescada_at FROM vistas_refresco WHERE vista = 'costos_lote_mes';",
+             prepare="get_costos_refresco", sqlite="SELECT NULL;")
+        fila = cur.fetchone()
+        return fila[0] if fila else None
+    finally:
+        conn.close()
+
+
+@db_policy("read")
+def get_costos_lote_df(owner, mes_ini, mes_fin) -> pd.DataFrame:
+    """
+    Filas pre-agregadas de costos_lote_mes entre dos meses, con el área del lote para normalizar
+    (reportes.costos_por_lote). Columnas: Mes, Lote, Tipo, Días, Horas Extra, Costo Insumos, Hectáreas, Plantas,
+    Tarifa Día, Tarifa Hora Extra. Las tarifas son las del cierre (pagos_mes) que cubre el mes, así la mano de
+    obra de un mes cerrado vale lo que se pagó; en un mes abierto van vacías (se usan las vigentes).
+    """
+    tenant = _tenant(owner)
+    tarifa = """(SELECT p.{col}::float8 FROM pagos_mes p
+                 WHERE p.tenant_id = c.tenant_id AND p.mes_fin >= c.mes AND {ini} <= c.mes
+                 ORDER BY p.mes_fin DESC LIMIT 1)"""
+    sql = f"""
+        SELECT {_DIAS_PG % "c.mes"}, COALESCE(f.nombre, '(sin lote)'), c.tipo, c.dias::float8, c.horas_extra::float8,
+               c.costo_insumos::float8, f.hectareas::float8, f.plantas::float8,
+               {tarifa.format(col="tarifa_dia", ini="date_trunc('month', p.mes_ini)::date")},
+               {tarifa.format(col="tarifa_hora_extra", ini="date_trunc('month', p.mes_ini)::date")}
+        FROM costos_lote_mes c LEFT JOIN fincas f ON f.id = c.finca_id
+        WHERE c.tenant_id=%s AND c.mes BETWEEN %s AND %s
+        ORDER BY c.mes, 2, c.tipo;
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant, sql, (tenant, mes_ini, mes_fin), prepare="get_costos_lote_df",
+             sqlite=sql.replace(_DIAS_PG % "c.mes", _DIAS_SQLITE % "c.mes")
+                       .replace("date_trunc('month', p.mes_ini)::date", "date(p.mes_ini, 'start of month')"))
+        return _df_columnar(cur, [
+            ("Mes", "fecha"), ("Lote", "cat"), ("Tipo", "cat"), ("Días", "float"), ("Horas Extra", "float"),
+            ("Costo Insumos", "float"), ("Hectáreas", "float"), ("Plantas", "float"),
+            ("Tarifa Día", "float"), ("Tarifa Hora Extra", "float"),
+        ])
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------
+# Cierres (crear / listar / leer detalle)
+# ---------------------------------------------
+
+@db_policy("write", timeout_ms=60000)
+def crear_cierre_mensual(mes_ini, mes_fin, creado_por, owner, tarifa_dia, tarifa_hora_extra, overwrite=False):
+    """
+    Crea el cierre del mes en UN viaje al servidor: el borrado opcional, los totales,
+    la cabecera y los dos detalles se calculan e insertan del lado de Postgres.
+    Si ya existe y overwrite=False, el índice único uq_pagos_mes_tenant_rango lo rechaza.
+    """
+    tenant = _tenant(owner)
+    sql = """
+        WITH prm AS (
+            SELECT %s::int AS tenant_id, %s::date AS ini, %s::date AS fin,
+                   %s::numeric AS td, %s::numeric AS th, %s::text AS creado_por
+        ),
+        nom AS (
+            SELECT t.nombre || ' ' || t.apellido AS trabajador,
+                   COALESCE(SUM(j.dias),0) AS dias, COALESCE(SUM(j.horas_extra),0) AS horas_extra
+            FROM jornadas j JOIN trabajadores t ON t.id = j.trabajador_id, prm
+            WHERE j.tenant_id=prm.tenant_id AND j.fecha BETWEEN prm.ini AND prm.fin
+            GROUP BY t.id, t.nombre, t.apellido
+        ),
+        ins AS (
+            SELECT i.id, i.fecha, i.finca_id, i.tipo, i.producto, i.etapa, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM insumos i, prm
+            WHERE i.tenant_id=prm.tenant_id AND i.fecha BETWEEN prm.ini AND prm.fin
+        ),
+        tot AS (
+            SELECT (SELECT COALESCE(SUM(nom.dias * prm.td + nom.horas_extra * prm.th), 0) FROM nom, prm) AS nomina,
+                   (SELECT COALESCE(SUM(ins.costo_total), 0) FROM ins) AS insumos
+        ),
+        pago AS (
+            INSERT INTO pagos_mes
+                (tenant_id, mes_ini, mes_fin, creado_por, tarifa_dia, tarifa_hora_extra, total_nomina, total_insumos, total_general)
+            SELECT prm.tenant_id, prm.ini, prm.fin, prm.creado_por, prm.td, prm.th, tot.nomina, tot.insumos, tot.nomina + tot.insumos
+            FROM prm, tot
+            RETURNING id
+        ),
+        det_nomina AS (
+            INSERT INTO pagos_mes_nomina
+              (pago_id, trabajador, dias, horas_extra, monto_dias, monto_hex, total)
+            SELECT pago.id, nom.trabajador, nom.dias, nom.horas_extra,
+                   nom.dias * prm.td, nom.horas_extra * prm.th, nom.dias * prm.td + nom.horas_extra * prm.th
+            FROM pago, nom, prm
+            ORDER BY nom.trabajador
+        ),
+        det_insumos AS (
+            INSERT INTO pagos_mes_insumos
+              (pago_id, fecha, finca_id, tipo, producto, etapa, dosis, cantidad, precio_unitario, costo_total)
+            SELECT pago.id, ins.fecha, ins.finca_id, ins.tipo, ins.producto, ins.etapa, ins.dosis,
+                   ins.cantidad, ins.precio_unitario, ins.costo_total
+            FROM pago, ins
+            ORDER BY ins.fecha, ins.id
+        )
+        SELECT id FROM pago;
+    """
+    params = (tenant, mes_ini, mes_fin, tarifa_dia, tarifa_hora_extra, creado_por)
+    rango = (tenant, mes_ini, mes_fin)
+    # SQLite no admite INSERT dentro de un WITH: los mismos pasos en sentencias de una sola transacción
+    sqlite = [
+        ("""
+         INSERT INTO pagos_mes
+             (tenant_id, mes_ini, mes_fin, creado_por, tarifa_dia, tarifa_hora_extra, total_nomina, total_insumos, total_general)
+         SELECT %s, %s, %s, %s, %s, %s, t.nomina, t.insumos, t.nomina + t.insumos
+         FROM (SELECT
+             (SELECT COALESCE(SUM(dias * %s + horas_extra * %s), 0) FROM jornadas
+              WHERE tenant_id=%s AND fecha BETWEEN %s AND %s) AS nomina,
+             (SELECT COALESCE(SUM(costo_total), 0) FROM insumos
+              WHERE tenant_id=%s AND fecha BETWEEN %s AND %s) AS insumos) t
+         """, (*rango, creado_por, tarifa_dia, tarifa_hora_extra, tarifa_dia, tarifa_hora_extra, *rango, *rango)),
+        ("""
+         INSERT INTO pagos_mes_nomina (pago_id, trabajador, dias, horas_extra, monto_dias, monto_hex, total)
+         SELECT p.id, t.nombre || ' ' || t.apellido AS trabajador, SUM(j.dias), SUM(j.horas_extra),
+                SUM(j.dias) * %s, SUM(j.horas_extra) * %s, SUM(j.dias) * %s + SUM(j.horas_extra) * %s
+         FROM jornadas j JOIN trabajadores t ON t.id = j.trabajador_id
+              JOIN pagos_mes p ON p.tenant_id=j.tenant_id AND p.mes_ini=%s AND p.mes_fin=%s
+         WHERE j.tenant_id=%s AND j.fecha BETWEEN %s AND %s
+         GROUP BY p.id, t.id, t.nombre, t.apellido
+         ORDER BY trabajador
+         """, (tarifa_dia, tarifa_hora_extra, tarifa_dia, tarifa_hora_extra, mes_ini, mes_fin, *rango)),
+        ("""
+         INSERT INTO pagos_mes_insumos
+           (pago_id, fecha, finca_id, tipo, producto, etapa, dosis, cantidad, precio_unitario, costo_total)
+         SELECT p.id, i.fecha, i.finca_id, i.tipo, i.producto, i.etapa, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+         FROM insumos i JOIN pagos_mes p ON p.tenant_id=i.tenant_id AND p.mes_ini=%s AND p.mes_fin=%s
+         WHERE i.tenant_id=%s AND i.fecha BETWEEN %s AND %s
+         ORDER BY i.fecha, i.id
+         """, (mes_ini, mes_fin, *rango)),
+        ("SELECT id FROM pagos_mes WHERE tenant_id=%s AND mes_ini=%s AND mes_fin=%s", rango),
+    ]
+    if overwrite:
+        # Mismo envío y misma transacción: si la inserción falla, el cierre anterior se conserva.
+        # Reabrir el mes trae de vuelta lo archivado, así el cierre nuevo se calcula con todas las filas.
+        sql = _DESARCHIVAR_SQL + "DELETE FROM pagos_mes WHERE tenant_id=%s AND mes_ini=%s AND mes_fin=%s; " + sql
+        params = (*rango * len(_COLUMNAS_ARCHIVO), *rango, *params)
+        sqlite.insert(0, ("DELETE FROM pagos_mes WHERE tenant_id=%s AND mes_ini=%s AND mes_fin=%s", rango))
+
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        try:
+            _run(cur, tenant, sql, params, sqlite=sqlite)
+        except IntegrityError:
+            conn.rollback()
+            raise ValueError("Ya existe un cierre para ese mes. Activa 'Sobrescribir' si quieres recrearlo.")
+        pago_id = cur.fetchone()[0]
         conn.commit()
         return pago_id
     finally:
         conn.close()
 
 
+@db_policy("read")
 def listar_cierres(owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
+        _run(cur, tenant,
             """
             SELECT id, mes_ini, mes_fin, creado_por, created_at, total_nomina, total_insumos, total_general
             FROM pagos_mes
-            WHERE owner=%s
+            WHERE tenant_id=%s
             ORDER BY mes_ini DESC;
             """,
-            (owner,),
+            (tenant,),
+            prepare="listar_cierres", fila=Cierre,
         )
         return cur.fetchall()
     finally:
         conn.close()
 
 
+@db_policy("read")
 def leer_cierre_detalle(pago_id, owner):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute("SELECT 1 FROM pagos_mes WHERE id=%s AND owner=%s;", (pago_id, owner))
-        if not cur.fetchone():
-            return [], []
-        cur.execute(
+        # El chequeo de pertenencia va dentro de cada consulta (2 viajes en vez de 4)
+        _run(cur, tenant,
             """
-            SELECT trabajador, dias, horas_extra, monto_dias, monto_hex, total
-            FROM pagos_mes_nomina
-            WHERE pago_id=%s
-            ORDER BY trabajador;
+            SELECT n.trabajador, n.dias, n.horas_extra, n.monto_dias, n.monto_hex, n.total
+            FROM pagos_mes_nomina n
+            JOIN pagos_mes p ON p.id = n.pago_id
+            WHERE n.pago_id=%s AND p.tenant_id=%s
+            ORDER BY n.trabajador;
             """,
-            (pago_id,),
+            (pago_id, tenant),
+            prepare="leer_cierre_detalle_nomina",
         )
         nomina = cur.fetchall()
 
-        cur.execute(
+        _run(cur, tenant,
             """
-            SELECT fecha, lote, tipo, producto, etapa, dosis, cantidad, precio_unitario, costo_total
-            FROM pagos_mes_insumos
-            WHERE pago_id=%s
-            ORDER BY fecha, id;
+            SELECT i.fecha, f.nombre, i.tipo, i.producto, i.etapa, i.dosis, i.cantidad, i.precio_unitario, i.costo_total
+            FROM pagos_mes_insumos i
+            JOIN pagos_mes p ON p.id = i.pago_id
+            LEFT JOIN fincas f ON f.id = i.finca_id
+            WHERE i.pago_id=%s AND p.tenant_id=%s
+            ORDER BY i.fecha, i.id;
             """,
-            (pago_id,),
+            (pago_id, tenant),
+            prepare="leer_cierre_detalle_insumos",
         )
         insumos = cur.fetchall()
         return nomina, insumos
@@ -877,22 +2752,28 @@ def leer_cierre_detalle(pago_id, owner):
 
 # --- Eliminaciones de catálogo ---
 
+@db_policy("write")
 def delete_finca(nombre: str, owner: str) -> bool:
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+    """La saca de las listas (activo=FALSE); jornadas, insumos y planes siguen mostrando su nombre."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute("DELETE FROM fincas WHERE owner=%s AND nombre=%s;", (owner, nombre))
+        _run(cur, tenant, "UPDATE fincas SET activo=FALSE WHERE tenant_id=%s AND nombre=%s AND activo;", (tenant, nombre))
         conn.commit()
         return cur.rowcount > 0
     finally:
         conn.close()
 
 
-def delete_trabajador_by_fullname(owner: str, full_name: str) -> bool:
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("write")
+def delete_trabajador(owner: str, trabajador_id: int) -> bool:
+    """Lo saca de las listas (activo=FALSE); sus jornadas y planes siguen mostrando su nombre."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
     try:
-        cur.execute(
-            "DELETE FROM trabajadores WHERE owner=%s AND (nombre || ' ' || apellido)=%s;",
-            (owner, full_name),
+        _run(cur, tenant,
+            "UPDATE trabajadores SET activo=FALSE WHERE tenant_id=%s AND id=%s AND activo;",
+            (tenant, trabajador_id),
         )
         conn.commit()
         return cur.rowcount > 0
@@ -902,165 +2783,668 @@ def delete_trabajador_by_fullname(owner: str, full_name: str) -> bool:
 
 # ===== Planificador de labores =====
 
+@db_policy("ddl")
 def create_plan_table():
     conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS plan_labores (
+            id SERIAL PRIMARY KEY,
+            tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+            fecha DATE NOT NULL,
+            finca_id INTEGER NOT NULL REFERENCES fincas(id),
+            tipo TEXT NOT NULL,
+            trabajador_id INTEGER REFERENCES trabajadores(id),
+            actividad TEXT,
+            etapa TEXT,
+            producto TEXT,
+            dosis TEXT,
+            cantidad NUMERIC,
+            precio_unitario NUMERIC,
+            dias INTEGER,
+            horas_extra NUMERIC,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            recur_every_days INTEGER,
+            recur_times INTEGER,
+            recur_autorenew BOOLEAN NOT NULL DEFAULT FALSE,
+            recur_parent INTEGER,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            done_at TIMESTAMPTZ,
+            realizado_por TEXT
+        );
+            """
+        )
+        cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_every_days INTEGER;")
+        cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_times INTEGER;")
+        cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_autorenew BOOLEAN NOT NULL DEFAULT FALSE;")
+        cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_parent INTEGER;")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_plan_labores_tenant_fecha ON plan_labores(tenant_id, fecha);")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@db_policy("ddl")
+def ensure_trabajador_fk():
+    """
+    Pasa jornadas.trabajador y plan_labores.trabajador ("Nombre Apellido") a trabajador_id (FK).
+    Los nombres que ya no tienen trabajador (borrados antes de la FK) se crean inactivos para no
+    perder historia. Idempotente: en tablas ya migradas solo asegura columnas e índices.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("ALTER TABLE trabajadores ADD COLUMN IF NOT EXISTS activo BOOLEAN NOT NULL DEFAULT TRUE;")
+        for t in ("jornadas", "plan_labores"):
+            cur.execute(f"ALTER TABLE {t} ADD COLUMN IF NOT EXISTS trabajador_id INTEGER REFERENCES trabajadores(id);")
+            cur.execute(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name=%s AND column_name='trabajador';
+                """,
+                (t,),
+            )
+            if cur.fetchone():
+                cur.execute(
+                    f"""
+                    INSERT INTO trabajadores (tenant_id, nombre, apellido, activo)
+                    SELECT DISTINCT x.tenant_id, split_part(x.trabajador, ' ', 1),
+                           substr(x.trabajador, length(split_part(x.trabajador, ' ', 1)) + 2), FALSE
+                    FROM {t} x
+                    WHERE x.trabajador IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM trabajadores w
+                                      WHERE w.tenant_id = x.tenant_id AND rtrim(w.nombre || ' ' || w.apellido) = x.trabajador)
+                    ON CONFLICT (tenant_id, nombre, apellido) DO NOTHING;
+                    """
+                )
+                cur.execute(
+                    f"""
+                    UPDATE {t} x SET trabajador_id = w.id
+                    FROM trabajadores w
+                    WHERE x.trabajador_id IS NULL AND w.tenant_id = x.tenant_id
+                      AND rtrim(w.nombre || ' ' || w.apellido) = x.trabajador;
+                    """
+                )
+                cur.execute(f"ALTER TABLE {t} DROP COLUMN trabajador;")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_tenant_trabajador ON {t}(tenant_id, trabajador_id);")
+        cur.execute("ALTER TABLE jornadas ALTER COLUMN trabajador_id SET NOT NULL;")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _tiene_columna(cur, tabla: str, columna: str) -> bool:
     cur.execute(
         """
-    CREATE TABLE IF NOT EXISTS plan_labores (
-        id SERIAL PRIMARY KEY,
-        owner TEXT NOT NULL,
-        fecha DATE NOT NULL,
-        lote TEXT NOT NULL,
-        tipo TEXT NOT NULL,
-        trabajador TEXT,
-        actividad TEXT,
-        etapa TEXT,
-        producto TEXT,
-        dosis TEXT,
-        cantidad NUMERIC,
-        precio_unitario NUMERIC,
-        dias INTEGER,
-        horas_extra NUMERIC,
-        estado TEXT NOT NULL DEFAULT 'pendiente',
-        recur_every_days INTEGER,
-        recur_times INTEGER,
-        recur_autorenew BOOLEAN NOT NULL DEFAULT FALSE,
-        recur_parent INTEGER,
-        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-        done_at TIMESTAMPTZ,
-        realizado_por TEXT
-    );
-        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name=%s AND column_name=%s;
+        """,
+        (tabla, columna),
     )
-    cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_every_days INTEGER;")
-    cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_times INTEGER;")
-    cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_autorenew BOOLEAN NOT NULL DEFAULT FALSE;")
-    cur.execute("ALTER TABLE plan_labores ADD COLUMN IF NOT EXISTS recur_parent INTEGER;")
-    conn.commit(); conn.close()
+    return cur.fetchone() is not None
 
 
-def add_plan(owner, fecha, lote, tipo, trabajador=None, actividad=None,
-             etapa=None, producto=None, dosis=None,
-             cantidad=None, precio_unitario=None, dias=None, horas_extra=None,
-             recur_every_days=None, recur_times=None, recur_autorenew=False, recur_parent=None):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
+@db_policy("ddl")
+def ensure_finca_fk():
+    """
+    Pasa la columna de texto `lote` de jornadas, insumos, plan_labores y pagos_mes_insumos a finca_id (FK).
+    Los nombres sin finca registrada se crean inactivos para no perder historia. Idempotente.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("ALTER TABLE fincas ADD COLUMN IF NOT EXISTS activo BOOLEAN NOT NULL DEFAULT TRUE;")
+        for t in ("jornadas", "insumos", "plan_labores"):
+            cur.execute(f"ALTER TABLE {t} ADD COLUMN IF NOT EXISTS finca_id INTEGER REFERENCES fincas(id);")
+            if _tiene_columna(cur, t, "lote"):
+                cur.execute(
+                    f"""
+                    INSERT INTO fincas (tenant_id, nombre, activo)
+                    SELECT DISTINCT x.tenant_id, x.lote, FALSE
+                    FROM {t} x
+                    WHERE x.lote IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM fincas f WHERE f.tenant_id = x.tenant_id AND f.nombre = x.lote)
+                    ON CONFLICT (tenant_id, nombre) DO NOTHING;
+                    """
+                )
+                cur.execute(
+                    f"""
+                    UPDATE {t} x SET finca_id = f.id
+                    FROM fincas f
+                    WHERE x.finca_id IS NULL AND f.tenant_id = x.tenant_id AND f.nombre = x.lote;
+                    """
+                )
+                cur.execute(f"ALTER TABLE {t} DROP COLUMN lote;")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_tenant_finca ON {t}(tenant_id, finca_id);")
+        cur.execute("ALTER TABLE plan_labores ALTER COLUMN finca_id SET NOT NULL;")
+        cur.execute("ALTER TABLE pagos_mes_insumos ADD COLUMN IF NOT EXISTS finca_id INTEGER REFERENCES fincas(id);")
+        if _tiene_columna(cur, "pagos_mes_insumos", "lote"):
+            # las copias del cierre: el tenant sale del pago; sus lotes ya existen por el paso de insumos
+            cur.execute(
+                """
+                INSERT INTO fincas (tenant_id, nombre, activo)
+                SELECT DISTINCT p.tenant_id, i.lote, FALSE
+                FROM pagos_mes_insumos i JOIN pagos_mes p ON p.id = i.pago_id
+                WHERE i.lote IS NOT NULL
+                ON CONFLICT (tenant_id, nombre) DO NOTHING;
+                """
+            )
+            cur.execute(
+                """
+                UPDATE pagos_mes_insumos i SET finca_id = f.id
+                FROM pagos_mes p, fincas f
+                WHERE i.finca_id IS NULL AND p.id = i.pago_id AND f.tenant_id = p.tenant_id AND f.nombre = i.lote;
+                """
+            )
+            cur.execute("ALTER TABLE pagos_mes_insumos DROP COLUMN lote;")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _convertir_en_particionada(cur, tabla: str):
+    """Rehace una tabla común como particionada por fecha: copia filas, índices, FK y permisos."""
+    cur.execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename=%s AND indexname <> %s;",
+        (tabla, f"{tabla}_pkey"),
+    )
+    indices = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f';",
+        (tabla,),
+    )
+    fks = cur.fetchall()
     cur.execute(
         """
-        INSERT INTO plan_labores(owner, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-                                 cantidad, precio_unitario, dias, horas_extra,
-                                 recur_every_days, recur_times, recur_autorenew, recur_parent)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,
-                %s,%s,%s,%s,
-                %s,%s,%s,%s)
-        RETURNING id;
+        SELECT grantee, privilege_type FROM information_schema.role_table_grants
+        WHERE table_schema = current_schema() AND table_name=%s AND grantee <> current_user;
         """,
-        (owner, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-         cantidad, precio_unitario, dias, horas_extra,
-         recur_every_days, recur_times, recur_autorenew, recur_parent),
+        (tabla,),
     )
-    pid = cur.fetchone()[0]
-    conn.commit(); conn.close()
-    return pid
+    permisos = cur.fetchall()
+    columnas = _columnas_escribibles(cur, tabla)
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id');", (tabla,))
+    secuencia = cur.fetchone()[0]
 
+    cur.execute(f"ALTER SEQUENCE {secuencia} OWNED BY NONE;")
+    cur.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}_heap;")
+    cur.execute(
+        f"""
+        CREATE TABLE {tabla} (LIKE {tabla}_heap INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)
+        PARTITION BY RANGE (fecha);
+        """
+    )
+    cur.execute(f"SELECT min(fecha), max(fecha) FROM {tabla}_heap;")
+    minimo, maximo = cur.fetchone()
+    hoy = datetime.date.today()
+    desde = min(minimo.year if minimo else hoy.year, hoy.year)
+    hasta = max(maximo.year if maximo else hoy.year, hoy.year + DB_PARTICIONES_ADELANTE)
+    _crear_particiones(cur, tabla, desde, hasta)
+    cur.execute(f"INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {tabla}_heap;")
+    cur.execute(f"DROP TABLE {tabla}_heap;")
+    cur.execute(f"ALTER SEQUENCE {secuencia} OWNED BY {tabla}.id;")
+    if tabla == "jornadas":
+        cur.execute("ALTER TABLE jornadas ADD PRIMARY KEY (id, fecha);")
+    # índices al final: se construyen una vez sobre cada partición ya cargada
+    for definicion in indices:
+        cur.execute(definicion)
+    for nombre, definicion in fks:
+        cur.execute(f"ALTER TABLE {tabla} ADD CONSTRAINT {nombre} {definicion};")
+    for rol, privilegio in permisos:
+        cur.execute(f"GRANT {privilegio} ON {tabla} TO {psycopg2.extensions.quote_ident(rol, cur)};")
+
+
+@db_policy("ddl")
+def ensure_particiones():
+    """
+    jornadas e insumos particionadas por rango de fecha, una partición por año. Convierte las tablas
+    comunes de bases anteriores y crea las particiones que falten, desde el año más viejo con datos
+    hasta DB_PARTICIONES_ADELANTE años después del actual. Lo que no cae en ninguna (fecha NULL,
+    años sin partición) va a la DEFAULT y se muda solo cuando se crea la de su año.
+    Idempotente; las migraciones de main.py la corren en cada arranque, así nunca faltan años futuros.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        hoy = datetime.date.today()
+        for t in _TABLAS_PARTICIONADAS:
+            if not _es_particionada(cur, t):
+                _convertir_en_particionada(cur, t)
+                continue
+            cur.execute(f"SELECT min(fecha), max(fecha) FROM {t};")
+            minimo, maximo = cur.fetchone()
+            desde = min(minimo.year if minimo else hoy.year, hoy.year)
+            hasta = max(maximo.year if maximo else hoy.year, hoy.year + DB_PARTICIONES_ADELANTE)
+            _crear_particiones(cur, t, desde, hasta)
+        conn.commit()
+    finally:
+        conn.close()
 
-def list_plans(owner, start_date, end_date, estado=None):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-    if estado:
+
+def _resumen_tras_particion(cur, tabla: str, anio: int):
+    # DETACH / ATTACH no disparan triggers: el año se recalcula desde lo que quedó visible
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (_RESUMENES[tabla][0],))
+    if cur.fetchone()[0]:
+        _reconstruir_resumen(cur, tabla, datetime.date(anio, 1, 1), datetime.date(anio, 12, 31))
+
+
+@db_policy("ddl")
+def desacoplar_particion(tabla: str, anio: int) -> str:
+    """
+    Saca la partición de un año de jornadas o insumos. Sus filas dejan de verse en la app pero quedan
+    en la tabla suelta {tabla}_{anio}, lista para archivar, exportar o borrar con DROP TABLE.
+    Devuelve su nombre; acoplar_particion() la vuelve a enganchar.
+    """
+    if tabla not in _TABLAS_PARTICIONADAS:
+        raise ValueError(f"Tabla no particionada: {tabla}")
+    nombre = f"{tabla}_{int(anio)}"
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute(f"ALTER TABLE {tabla} DETACH PARTITION {nombre};")
+        _resumen_tras_particion(cur, tabla, int(anio))
+        conn.commit()
+        return nombre
+    finally:
+        conn.close()
+
+
+@db_policy("ddl")
+def acoplar_particion(tabla: str, anio: int):
+    """Vuelve a enganchar una partición anual sacada con desacoplar_particion()."""
+    if tabla not in _TABLAS_PARTICIONADAS:
+        raise ValueError(f"Tabla no particionada: {tabla}")
+    anio = int(anio)
+    conn = connect_db(); cur = conn.cursor()
+    try:
         cur.execute(
-            """
-            SELECT id, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-                   cantidad, precio_unitario, dias, horas_extra, estado,
-                   recur_every_days, recur_times, recur_autorenew
-            FROM plan_labores
-            WHERE owner=%s AND fecha BETWEEN %s AND %s AND estado=%s
-            ORDER BY fecha, lote, id;
-            """,
-            (owner, start_date, end_date, estado),
+            f"ALTER TABLE {tabla} ATTACH PARTITION {tabla}_{anio} FOR VALUES FROM (%s) TO (%s);",
+            (datetime.date(anio, 1, 1), datetime.date(anio + 1, 1, 1)),
         )
-    else:
+        _resumen_tras_particion(cur, tabla, anio)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Precisión y CHECK de las columnas numéricas: los mismos que create_jornadas_table / create_insumos_table
+_TIPOS_NUMERICOS = {
+    ("jornadas", "horas_normales"): "NUMERIC(6,2)",
+    ("jornadas", "horas_extra"): "NUMERIC(6,2)",
+    ("insumos", "cantidad"): "NUMERIC(14,3)",
+    ("insumos", "precio_unitario"): "NUMERIC(14,2)",
+}
+_CHECKS_NO_NEGATIVOS = {
+    "jornadas": ("dias", "horas_normales", "horas_extra"),
+    "insumos": ("cantidad", "precio_unitario"),
+}
+# nombre -> (tabla, condición). "Mano de obra" es el tipo de las filas de jornadas en costos_lote_mes:
+# un insumo con ese tipo duplicaría su clave única y se sumaría a la mano de obra en la página.
+_CHECKS = {
+    **{f"ck_{t}_{col}": (t, f"{col} >= 0") for t, cols in _CHECKS_NO_NEGATIVOS.items() for col in cols},
+    "ck_insumos_tipo": ("insumos", "tipo <> 'Mano de obra'"),
+}
+
+
+@db_policy("ddl")
+def ensure_integridad_numerica() -> list:
+    """
+    Lleva bases anteriores al esquema numérico actual: NUMERIC con precisión, CHECK de no negativos y
+    costo_total como columna generada (cantidad × precio_unitario); además ningún insumo con tipo
+    "Mano de obra". Las vistas *_todas dependen de las columnas, así que se borran aquí y
+    create_archivo_tables (que corre después) las rehace.
+    Si hay filas viejas que no cumplen un CHECK, queda NOT VALID (rige para lo nuevo) y se devuelve en la
+    lista para corregirlas a mano; cada corrida lo vuelve a validar y lo devuelve mientras no pase. Una partición desacoplada antes de esto hay que migrarla igual antes de
+    volver a acoplarla. Idempotente.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
         cur.execute(
             """
-            SELECT id, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-                   cantidad, precio_unitario, dias, horas_extra, estado,
-                   recur_every_days, recur_times, recur_autorenew
-            FROM plan_labores
-            WHERE owner=%s AND fecha BETWEEN %s AND %s
-            ORDER BY fecha, lote, id;
-            """,
-            (owner, start_date, end_date),
+            SELECT table_name, column_name, format_type(a.atttypid, a.atttypmod), c.is_generated
+            FROM information_schema.columns c
+            JOIN pg_attribute a ON a.attrelid = c.table_name::regclass AND a.attname = c.column_name
+            WHERE c.table_schema = current_schema() AND c.table_name IN ('jornadas', 'insumos');
+            """
         )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+        actual = {(t, col): (tipo, generada) for t, col, tipo, generada in cur.fetchall()}
+        cambios = [(t, col, tipo) for (t, col), tipo in _TIPOS_NUMERICOS.items()
+                   if actual[(t, col)][0] != tipo.lower()]
+        generada = actual[("insumos", "costo_total")][1] == "ALWAYS"
+        if cambios or not generada:
+            for t in _TABLAS_PARTICIONADAS:
+                cur.execute(f"DROP VIEW IF EXISTS {t}_todas;")
+        for t, col, tipo in cambios:
+            cur.execute(f"ALTER TABLE {t} ALTER COLUMN {col} TYPE {tipo};")
+        if not generada:
+            # Postgres no convierte una columna existente en generada: se rehace (reescribe la tabla una vez)
+            cur.execute(
+                f"""
+                ALTER TABLE insumos DROP COLUMN costo_total,
+                  ADD COLUMN costo_total NUMERIC(18,2) GENERATED ALWAYS AS ({_COSTO_TOTAL_SQL}) STORED;
+                """
+            )
+        pendientes = []
+        for nombre, (t, condicion) in _CHECKS.items():
+            cur.execute("SELECT convalidated FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s;",
+                        (t, nombre))
+            existente = cur.fetchone()
+            if existente and existente[0]:
+                continue
+            if not existente:
+                cur.execute(f"ALTER TABLE {t} ADD CONSTRAINT {nombre} CHECK ({condicion}) NOT VALID;")
+            # uno que quedó NOT VALID en una corrida anterior se vuelve a validar: sigue pendiente hasta que pase
+            cur.execute("SAVEPOINT validar;")
+            try:
+                cur.execute(f"ALTER TABLE {t} VALIDATE CONSTRAINT {nombre};")
+            except psycopg2.errors.CheckViolation:
+                cur.execute("ROLLBACK TO SAVEPOINT validar;")
+                pendientes.append(nombre)
+        conn.commit()
+        return pendientes
+    finally:
+        conn.close()
 
 
-def get_plan(owner, plan_id):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-    cur.execute(
-        """
-        SELECT id, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-               cantidad, precio_unitario, dias, horas_extra, estado,
-               recur_every_days, recur_times, recur_autorenew
-        FROM plan_labores
-        WHERE owner=%s AND id=%s
-        """,
-        (owner, plan_id),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+# ---------------------------------------------
+# Archivo de meses cerrados
+# ---------------------------------------------
+# Las filas de meses cerrados hace más de DB_ARCHIVO_MESES pasan a {tabla}_archivo (sin índices
+# salvo tenant/fecha) y las lecturas de historia van por las vistas {tabla}_todas = vivas + archivo.
+_COLUMNAS_ARCHIVO = {
+    "jornadas": "id, tenant_id, trabajador_id, fecha, finca_id, actividad, dias, horas_normales, horas_extra",
+    "insumos": "id, tenant_id, fecha, finca_id, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total",
+}
+
+# en la tabla viva costo_total es generada: al devolver filas no se copia, se recalcula
+_COLUMNAS_VIVAS = {t: cols.replace(", costo_total", "") for t, cols in _COLUMNAS_ARCHIVO.items()}
+
+_DESARCHIVAR_SQL = "".join(
+    f"""
+    WITH d AS (DELETE FROM {t}_archivo WHERE tenant_id=%s AND fecha BETWEEN %s AND %s RETURNING *)
+    INSERT INTO {t} ({cols}) SELECT {cols} FROM d;
+    """
+    for t, cols in _COLUMNAS_VIVAS.items()
+)
+
+
+@db_policy("ddl")
+def create_archivo_tables():
+    """
+    Tablas {tabla}_archivo y vistas {tabla}_todas. La vista solo se rehace si sus columnas (u opciones)
+    ya no son las de _COLUMNAS_ARCHIVO: DROP/CREATE VIEW toma un lock exclusivo que frena a los lectores.
+    Con Postgres 15+ es security_invoker, así respeta las políticas RLS de quien consulta.
+    """
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute("SHOW server_version_num;")
+        opciones = " WITH (security_invoker = true)" if int(cur.fetchone()[0]) >= 150000 else ""
+        for t, cols in _COLUMNAS_ARCHIVO.items():
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {t}_archivo (LIKE {t});")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_archivo_tenant_fecha ON {t}_archivo(tenant_id, fecha);")
+            cur.execute(
+                """
+                SELECT array_agg(a.attname::text ORDER BY a.attnum), coalesce(c.reloptions, '{}')
+                FROM pg_class c JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+                WHERE c.oid = to_regclass(%s)
+                GROUP BY c.reloptions;
+                """,
+                (f"{t}_todas",),
+            )
+            actual = cur.fetchone()
+            if actual != (cols.split(", "), ["security_invoker=true"] if opciones else []):
+                cur.execute(f"DROP VIEW IF EXISTS {t}_todas;")
+                cur.execute(
+                    f"""
+                    CREATE VIEW {t}_todas{opciones} AS
+                    SELECT {cols} FROM {t}
+                    UNION ALL
+                    SELECT {cols} FROM {t}_archivo;
+                    """
+                )
+            # el rol de la app (si no es el dueño) ve el archivo y la vista igual que la tabla viva
+            cur.execute(
+                """
+                SELECT grantee, privilege_type FROM information_schema.role_table_grants
+                WHERE table_schema = current_schema() AND table_name=%s AND grantee <> current_user;
+                """,
+                (t,),
+            )
+            for rol, privilegio in cur.fetchall():
+                rol = psycopg2.extensions.quote_ident(rol, cur)
+                cur.execute(f"GRANT {privilegio} ON {t}_archivo TO {rol};")
+                if privilegio == "SELECT":
+                    cur.execute(f"GRANT SELECT ON {t}_todas TO {rol};")
+        conn.commit()
+    finally:
+        conn.close()
 
 
-def mark_plan_done_and_autorenew(owner, plan_id, realizado_por):
-    plan = get_plan(owner, plan_id)
-    if not plan:
-        return False
-    (pid, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-     cantidad, precio_u, dias, hextra, estado,
-     every, times, autorenew) = plan
+@db_policy("ddl")
+def archivar_meses_cerrados(meses: int | None = None) -> dict:
+    """
+    Mueve a {tabla}_archivo las jornadas e insumos de los meses con cierre en pagos_mes cuyo fin
+    quedó antes del mes de hace `meses` meses (DB_ARCHIVO_MESES por defecto), de todos los tenants.
+    Siguen saliendo en los listados, reportes y exportes (vistas *_todas) pero ya no pesan en las
+    tablas e índices vivos. Reabrir el cierre (crear_cierre_mensual con overwrite) o
+    desarchivar_mes() las devuelve. Idempotente; pensada para correr de noche (archivar.py).
+    Devuelve las filas movidas por tabla.
+    """
+    meses = DB_ARCHIVO_MESES if meses is None else meses
+    hoy = datetime.date.today()
+    total = hoy.year * 12 + hoy.month - 1 - meses
+    limite = datetime.date(total // 12, total % 12 + 1, 1)
+    movidas = {}
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        for t, cols in _COLUMNAS_ARCHIVO.items():
+            cur.execute(
+                f"""
+                WITH d AS (
+                    DELETE FROM {t} x USING pagos_mes p
+                    WHERE p.tenant_id = x.tenant_id AND x.fecha BETWEEN p.mes_ini AND p.mes_fin AND p.mes_fin < %s
+                    RETURNING x.*
+                )
+                INSERT INTO {t}_archivo ({cols}) SELECT {cols} FROM d;
+                """,
+                (limite,),
+            )
+            movidas[t] = cur.rowcount
+        conn.commit()
+        return movidas
+    finally:
+        conn.close()
 
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-    cur.execute(
-        """
-        UPDATE plan_labores
-        SET estado='realizado', done_at=NOW(), realizado_por=%s
-        WHERE owner=%s AND id=%s
-        """,
-        (realizado_por, owner, plan_id),
-    )
 
-    should_create_next = autorenew and every is not None and every > 0
-    if should_create_next:
-        next_date = fecha + datetime.timedelta(days=int(every))
-        new_times = None
-        if times is not None:
-            new_times = max(0, int(times) - 1)
-        if new_times is None or new_times > 0:
-            cur.execute(
+@db_policy("write")
+def desarchivar_mes(owner, mes_ini, mes_fin):
+    """Devuelve a las tablas vivas las filas archivadas del rango, p. ej. para corregir un mes cerrado."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        # en SQLite no hay archivo: nada que devolver
+        _run(cur, tenant, _DESARCHIVAR_SQL, (tenant, mes_ini, mes_fin) * len(_COLUMNAS_ARCHIVO), sqlite=[])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@db_policy("write", offline=True)
+def add_plan(owner, fecha, lote, tipo, trabajador=None, actividad=None,
+             etapa=None, producto=None, dosis=None,
+             cantidad=None, precio_unitario=None, dias=None, horas_extra=None,
+             recur_every_days=None, recur_times=None, recur_autorenew=False, recur_parent=None):
+    """`trabajador` es el id en trabajadores (o None); `lote`, id o nombre de la finca."""
+    tenant = _tenant(owner)
+    trabajador = _trabajador_id(tenant, trabajador)
+    finca_sql, finca = _finca(tenant, lote)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            f"""
+            INSERT INTO plan_labores(tenant_id, fecha, finca_id, tipo, trabajador_id, actividad, etapa, producto, dosis,
+                                     cantidad, precio_unitario, dias, horas_extra,
+                                     recur_every_days, recur_times, recur_autorenew, recur_parent)
+            VALUES (%s,%s,{finca_sql},%s,%s,%s,%s,%s,%s,
+                    %s,%s,%s,%s,
+                    %s,%s,%s,%s)
+            RETURNING id;
+            """,
+            (tenant, fecha, *finca, tipo, trabajador, actividad, etapa, producto, dosis,
+             cantidad, precio_unitario, dias, horas_extra,
+             recur_every_days, recur_times, recur_autorenew, recur_parent),
+        )
+        pid = cur.fetchone()[0]
+        conn.commit()
+        return pid
+    finally:
+        conn.close()
+
+
+@db_policy("read")
+def list_plans(owner, start_date, end_date, estado=None):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        if estado:
+            _run(cur, tenant,
                 """
-                INSERT INTO plan_labores(owner, fecha, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-                                         cantidad, precio_unitario, dias, horas_extra,
-                                         estado, recur_every_days, recur_times, recur_autorenew, recur_parent)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,
-                        %s,%s,%s,%s,
-                        'pendiente', %s, %s, %s, %s)
+                SELECT p.id, p.fecha, f.nombre, p.tipo, t.nombre || ' ' || t.apellido, p.actividad, p.etapa, p.producto,
+                       p.dosis, p.cantidad, p.precio_unitario, p.dias, p.horas_extra, p.estado,
+                       p.recur_every_days, p.recur_times, p.recur_autorenew, p.trabajador_id
+                FROM plan_labores p LEFT JOIN trabajadores t ON t.id = p.trabajador_id
+                     LEFT JOIN fincas f ON f.id = p.finca_id
+                WHERE p.tenant_id=%s AND p.fecha BETWEEN %s AND %s AND p.estado=%s
+                ORDER BY p.fecha, f.nombre, p.id;
                 """,
-                (owner, next_date, lote, tipo, trabajador, actividad, etapa, producto, dosis,
-                 cantidad, precio_u, dias, hextra,
-                 every, new_times, True, pid),
+                (tenant, start_date, end_date, estado),
+                prepare="list_plans_estado", fila=Plan,
             )
+        else:
+            _run(cur, tenant,
+                """
+                SELECT p.id, p.fecha, f.nombre, p.tipo, t.nombre || ' ' || t.apellido, p.actividad, p.etapa, p.producto,
+                       p.dosis, p.cantidad, p.precio_unitario, p.dias, p.horas_extra, p.estado,
+                       p.recur_every_days, p.recur_times, p.recur_autorenew, p.trabajador_id
+                FROM plan_labores p LEFT JOIN trabajadores t ON t.id = p.trabajador_id
+                     LEFT JOIN fincas f ON f.id = p.finca_id
+                WHERE p.tenant_id=%s AND p.fecha BETWEEN %s AND %s
+                ORDER BY p.fecha, f.nombre, p.id;
+                """,
+                (tenant, start_date, end_date),
+                prepare="list_plans", fila=Plan,
+            )
+        return cur.fetchall()
+    finally:
+        conn.close()
+
 
-    conn.commit(); conn.close()
-    return True
+@db_policy("read")
+def get_plan(owner, plan_id):
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            """
+            SELECT p.id, p.fecha, f.nombre, p.tipo, t.nombre || ' ' || t.apellido, p.actividad, p.etapa, p.producto,
+                   p.dosis, p.cantidad, p.precio_unitario, p.dias, p.horas_extra, p.estado,
+                   p.recur_every_days, p.recur_times, p.recur_autorenew, p.trabajador_id
+            FROM plan_labores p LEFT JOIN trabajadores t ON t.id = p.trabajador_id
+                 LEFT JOIN fincas f ON f.id = p.finca_id
+            WHERE p.tenant_id=%s AND p.id=%s
+            """,
+            (tenant, plan_id),
+            prepare="get_plan", fila=Plan,
+        )
+        return cur.fetchone()
+    finally:
+        conn.close()
 
 
+@db_policy("write", offline=True)
+def mark_plan_done_and_autorenew(owner, plan_id, realizado_por):
+    """Marca el plan como realizado y, si es recurrente, agenda el siguiente; todo en un viaje."""
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            """
+            WITH done AS (
+                UPDATE plan_labores
+                SET estado='realizado', done_at=NOW(), realizado_por=%s
+                WHERE tenant_id=%s AND id=%s
+                RETURNING *
+            ),
+            nxt AS (
+                INSERT INTO plan_labores(tenant_id, fecha, finca_id, tipo, trabajador_id, actividad, etapa, producto, dosis,
+                                         cantidad, precio_unitario, dias, horas_extra,
+                                         estado, recur_every_days, recur_times, recur_autorenew, recur_parent)
+                SELECT tenant_id, fecha + recur_every_days, finca_id, tipo, trabajador_id, actividad, etapa, producto, dosis,
+                       cantidad, precio_unitario, dias, horas_extra,
+                       'pendiente', recur_every_days,
+                       CASE WHEN recur_times IS NULL THEN NULL ELSE GREATEST(0, recur_times - 1) END, TRUE, id
+                FROM done
+                WHERE recur_autorenew AND recur_every_days > 0
+                  AND (recur_times IS NULL OR recur_times - 1 > 0)
+            )
+            SELECT count(*) FROM done;
+            """,
+            (realizado_por, tenant, plan_id),
+            sqlite=[
+                ("""
+                 INSERT INTO plan_labores(tenant_id, fecha, finca_id, tipo, trabajador_id, actividad, etapa, producto, dosis,
+                                          cantidad, precio_unitario, dias, horas_extra,
+                                          estado, recur_every_days, recur_times, recur_autorenew, recur_parent)
+                 SELECT tenant_id, date(fecha, '+' || recur_every_days || ' days'), finca_id, tipo, trabajador_id, actividad,
+                        etapa, producto, dosis, cantidad, precio_unitario, dias, horas_extra,
+                        'pendiente', recur_every_days,
+                        CASE WHEN recur_times IS NULL THEN NULL ELSE MAX(0, recur_times - 1) END, TRUE, id
+                 FROM plan_labores
+                 WHERE tenant_id=%s AND id=%s AND recur_autorenew AND recur_every_days > 0
+                   AND (recur_times IS NULL OR recur_times - 1 > 0)
+                 """, (tenant, plan_id)),
+                ("UPDATE plan_labores SET estado='realizado', done_at=now(), realizado_por=%s WHERE tenant_id=%s AND id=%s",
+                 (realizado_por, tenant, plan_id)),
+                ("SELECT changes()", ()),
+            ],
+        )
+        found = cur.fetchone()[0] > 0
+        conn.commit()
+        return found
+    finally:
+        conn.close()
+
+
+@db_policy("write", offline=True)
 def postpone_plan(owner, plan_id, days):
-    conn = connect_db(); cur = conn.cursor(); _set_owner(cur, owner)
-    cur.execute(
-        "UPDATE plan_labores SET fecha = fecha + (%s || ' days')::interval WHERE owner=%s AND id=%s",
-        (str(int(days)), owner, plan_id),
-    )
-    conn.commit(); conn.close()
-    return True
+    tenant = _tenant(owner)
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        _run(cur, tenant,
+            "UPDATE plan_labores SET fecha = fecha + (%s || ' days')::interval WHERE tenant_id=%s AND id=%s",
+            (str(int(days)), tenant, plan_id),
+            sqlite="UPDATE plan_labores SET fecha = date(fecha, %s || ' days') WHERE tenant_id=%s AND id=%s",
+        )
+        conn.commit()
+        return True
+    finally:
+        conn.close()
 
 
+# ---------- Cola offline (lado servidor) ----------
+
+@db_policy("ddl")
+def create_outbox_table():
+    """Claves de idempotencia ya aplicadas por sincronizar_outbox()."""
+    conn = connect_db(); cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox_aplicadas (
+              clave TEXT PRIMARY KEY,
+              tenant_id INTEGER,
+              funcion TEXT NOT NULL,
+              aplicada_en TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
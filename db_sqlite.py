@@ -0,0 +1,522 @@
+# db_sqlite.py — backend SQLite embebido para database.py (DATABASE_URL=sqlite:///finca.db)
+#
+# Pensado para instalaciones de una sola finca: la base es un archivo local en modo WAL, sin red de por
+# medio. database.py sigue siendo la API; aquí solo viven la conexión, el esquema y la traducción del
+# dialecto (%s -> ?, casts ::tipo, now(), GREATEST). Lo que no se traduce solo (CTEs con
+# INSERT/UPDATE, aritmética de intervalos) lo trae cada helper en su argumento `sqlite=` de _run.
+import os
+import re
+import sqlite3
+import datetime
+import threading
+from decimal import Decimal
+
+import psycopg2
+
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATE", lambda b: datetime.date.fromisoformat(b.decode()[:10]))
+sqlite3.register_converter("TIMESTAMPTZ", lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+# costo_total generada como en Postgres; ROUND(..., 2) hace lo que allí hace el NUMERIC(18,2)
+_INSUMOS = """CREATE TABLE IF NOT EXISTS insumos (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  fecha DATE,
+  finca_id INTEGER REFERENCES fincas(id),
+  tipo TEXT CHECK (tipo <> 'Mano de obra'),  -- es la fila de jornadas en costos_lote_mes
+  etapa TEXT,
+  producto TEXT,
+  dosis TEXT,
+  cantidad NUMERIC CHECK (cantidad >= 0),
+  precio_unitario NUMERIC CHECK (precio_unitario >= 0),
+  costo_total NUMERIC GENERATED ALWAYS AS (ROUND(COALESCE(cantidad, 0) * COALESCE(precio_unitario, 0), 2)) STORED
+);"""
+
+# Resúmenes diarios como database._RESUMENES, con triggers por fila (SQLite no tiene tablas de transición).
+# ROUND(..., 2): las horas y los montos son REAL aquí y sin redondeo las sumas y restas dejan residuos.
+_RESUMENES = {
+    # tabla: (resumen, {columna clave: expresión sobre la fila}, columnas sumadas)
+    "jornadas": ("jornadas_dia", {"trabajador_id": "{f}.trabajador_id", "finca_id": "COALESCE({f}.finca_id, 0)"},
+                 ("dias", "horas_extra")),
+    "insumos": ("insumos_dia", {"finca_id": "COALESCE({f}.finca_id, 0)", "tipo": "COALESCE({f}.tipo, 'Otro')"},
+                ("costo_total",)),
+}
+
+
+def _sumar_fila(tabla: str, fila: str, signo: int) -> str:
+    resumen, claves, sumas = _RESUMENES[tabla]
+    valores = [f"{fila}.tenant_id", f"{fila}.fecha", *(e.format(f=fila) for e in claves.values()),
+               *(f"{signo} * {fila}.{c}" for c in sumas), str(signo)]
+    sets = [f"{c} = ROUND({c} + excluded.{c}, 2)" for c in sumas] + ["registros = registros + excluded.registros"]
+    sql = (f"INSERT INTO {resumen} (tenant_id, fecha, {', '.join(claves)}, {', '.join(sumas)}, registros) "
+           f"SELECT {', '.join(valores)} WHERE {fila}.fecha IS NOT NULL "
+           f"ON CONFLICT (tenant_id, fecha, {', '.join(claves)}) DO UPDATE SET {', '.join(sets)};")
+    if signo < 0:
+        donde = " AND ".join(f"{c} = {e.format(f=fila)}" for c, e in claves.items())
+        sql += (f" DELETE FROM {resumen} WHERE registros = 0 AND tenant_id = {fila}.tenant_id"
+                f" AND fecha = {fila}.fecha AND {donde};")
+    return sql
+
+
+def _crear_resumen(db, tabla: str):
+    """Triggers de `tabla` y su resumen recalculado desde cero (base nueva, anterior o insumos rehecha)."""
+    resumen, claves, sumas = _RESUMENES[tabla]
+    for sufijo, evento, cuerpo in (("ins", "INSERT", _sumar_fila(tabla, "NEW", 1)),
+                                   ("upd", "UPDATE", _sumar_fila(tabla, "OLD", -1) + " " + _sumar_fila(tabla, "NEW", 1)),
+                                   ("del", "DELETE", _sumar_fila(tabla, "OLD", -1))):
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {tabla}_dia_{sufijo} AFTER {evento} ON {tabla} BEGIN {cuerpo} END;")
+    db.execute(f"DELETE FROM {resumen};")
+    expresiones = [e.format(f=tabla) for e in claves.values()]
+    db.execute(f"""
+        INSERT INTO {resumen} (tenant_id, fecha, {", ".join(claves)}, {", ".join(sumas)}, registros)
+        SELECT tenant_id, fecha, {", ".join(expresiones)}, {", ".join(f"ROUND(SUM({c}), 2)" for c in sumas)}, COUNT(*)
+        FROM {tabla} WHERE fecha IS NOT NULL
+        GROUP BY tenant_id, fecha, {", ".join(expresiones)};
+    """)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  username TEXT PRIMARY KEY,
+  password TEXT NOT NULL,
+  tenant_id INTEGER UNIQUE,
+  created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS trabajadores (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  nombre TEXT NOT NULL,
+  apellido TEXT NOT NULL,
+  activo BOOLEAN NOT NULL DEFAULT TRUE,
+  created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_trabajadores_tenant_nombre_apellido ON trabajadores(tenant_id, nombre, apellido);
+CREATE TABLE IF NOT EXISTS fincas (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  nombre TEXT NOT NULL,
+  activo BOOLEAN NOT NULL DEFAULT TRUE,
+  created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+  hectareas NUMERIC CHECK (hectareas > 0),
+  plantas INTEGER CHECK (plantas > 0)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_fincas_tenant_nombre ON fincas(tenant_id, nombre);
+CREATE TABLE IF NOT EXISTS jornadas (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  trabajador_id INTEGER NOT NULL REFERENCES trabajadores(id),
+  fecha DATE NOT NULL,
+  finca_id INTEGER REFERENCES fincas(id),
+  actividad TEXT,
+  dias INTEGER NOT NULL DEFAULT 0 CHECK (dias >= 0),
+  horas_normales NUMERIC NOT NULL DEFAULT 0 CHECK (horas_normales >= 0),
+  horas_extra NUMERIC NOT NULL DEFAULT 0 CHECK (horas_extra >= 0)
+);
+CREATE INDEX IF NOT EXISTS idx_jornadas_tenant_fecha ON jornadas(tenant_id, fecha);
+""" + _INSUMOS + """
+CREATE INDEX IF NOT EXISTS idx_insumos_tenant_fecha ON insumos(tenant_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_insumos_tenant_tipo_fecha ON insumos(tenant_id, tipo, fecha);
+-- en SQLite no se archiva: las vistas de historia son las mismas tablas
+CREATE VIEW IF NOT EXISTS jornadas_todas AS SELECT * FROM jornadas;
+CREATE VIEW IF NOT EXISTS insumos_todas AS SELECT * FROM insumos;
+-- costos_lote_mes de Postgres es materializada; aquí se agrega al leer (una sola finca, poca historia)
+CREATE VIEW IF NOT EXISTS costos_lote_mes AS
+SELECT tenant_id, COALESCE(finca_id, 0) AS finca_id, date(fecha, 'start of month') AS mes, 'Mano de obra' AS tipo,
+       SUM(dias) AS dias, SUM(horas_extra) AS horas_extra, 0 AS costo_insumos, COUNT(*) AS registros
+FROM jornadas GROUP BY 1, 2, 3
+UNION ALL
+SELECT tenant_id, COALESCE(finca_id, 0), date(fecha, 'start of month'), COALESCE(tipo, 'Otro'), 0, 0,
+       SUM(costo_total), COUNT(*)
+FROM insumos WHERE fecha IS NOT NULL GROUP BY 1, 2, 3, 4;
+-- resúmenes diarios: los mantienen los triggers de _RESUMENES (se crean en _migrar)
+CREATE TABLE IF NOT EXISTS jornadas_dia (
+  tenant_id INTEGER NOT NULL,
+  fecha DATE NOT NULL,
+  trabajador_id INTEGER NOT NULL,
+  finca_id INTEGER NOT NULL,
+  dias INTEGER NOT NULL,
+  horas_extra NUMERIC NOT NULL,
+  registros INTEGER NOT NULL,
+  PRIMARY KEY (tenant_id, fecha, trabajador_id, finca_id)
+);
+CREATE TABLE IF NOT EXISTS insumos_dia (
+  tenant_id INTEGER NOT NULL,
+  fecha DATE NOT NULL,
+  finca_id INTEGER NOT NULL,
+  tipo TEXT NOT NULL,
+  costo_total NUMERIC NOT NULL,
+  registros INTEGER NOT NULL,
+  PRIMARY KEY (tenant_id, fecha, finca_id, tipo)
+);
+CREATE TABLE IF NOT EXISTS tarifas_user (
+  tenant_id INTEGER PRIMARY KEY REFERENCES users(tenant_id),
+  pago_dia NUMERIC NOT NULL,
+  pago_hora_extra NUMERIC NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS tarifas (
+  id INTEGER PRIMARY KEY,
+  pago_dia NUMERIC NOT NULL,
+  pago_hora_extra NUMERIC NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO tarifas (id, pago_dia, pago_hora_extra) VALUES (1, 9000, 2000) ON CONFLICT (id) DO NOTHING;
+CREATE TABLE IF NOT EXISTS pagos_mes (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  mes_ini DATE NOT NULL,
+  mes_fin DATE NOT NULL,
+  creado_por TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  tarifa_dia NUMERIC NOT NULL,
+  tarifa_hora_extra NUMERIC NOT NULL,
+  total_nomina NUMERIC NOT NULL DEFAULT 0,
+  total_insumos NUMERIC NOT NULL DEFAULT 0,
+  total_general NUMERIC NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_pagos_mes_tenant_rango ON pagos_mes(tenant_id, mes_ini, mes_fin);
+CREATE TABLE IF NOT EXISTS pagos_mes_nomina (
+  id INTEGER PRIMARY KEY,
+  pago_id INTEGER NOT NULL REFERENCES pagos_mes(id) ON DELETE CASCADE,
+  trabajador TEXT NOT NULL,
+  dias INTEGER NOT NULL DEFAULT 0,
+  horas_extra NUMERIC NOT NULL DEFAULT 0,
+  monto_dias NUMERIC NOT NULL DEFAULT 0,
+  monto_hex NUMERIC NOT NULL DEFAULT 0,
+  total NUMERIC NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_pagos_mes_nomina_pago ON pagos_mes_nomina(pago_id);
+CREATE TABLE IF NOT EXISTS pagos_mes_insumos (
+  id INTEGER PRIMARY KEY,
+  pago_id INTEGER NOT NULL REFERENCES pagos_mes(id) ON DELETE CASCADE,
+  fecha DATE,
+  finca_id INTEGER REFERENCES fincas(id),
+  tipo TEXT,
+  producto TEXT,
+  etapa TEXT,
+  dosis TEXT,
+  cantidad NUMERIC,
+  precio_unitario NUMERIC,
+  costo_total NUMERIC
+);
+CREATE INDEX IF NOT EXISTS idx_pagos_mes_insumos_pago ON pagos_mes_insumos(pago_id);
+CREATE TABLE IF NOT EXISTS plan_labores (
+  id INTEGER PRIMARY KEY,
+  tenant_id INTEGER NOT NULL REFERENCES users(tenant_id),
+  fecha DATE NOT NULL,
+  finca_id INTEGER NOT NULL REFERENCES fincas(id),
+  tipo TEXT NOT NULL,
+  trabajador_id INTEGER REFERENCES trabajadores(id),
+  actividad TEXT,
+  etapa TEXT,
+  producto TEXT,
+  dosis TEXT,
+  cantidad NUMERIC,
+  precio_unitario NUMERIC,
+  dias INTEGER,
+  horas_extra NUMERIC,
+  estado TEXT NOT NULL DEFAULT 'pendiente',
+  recur_every_days INTEGER,
+  recur_times INTEGER,
+  recur_autorenew BOOLEAN NOT NULL DEFAULT FALSE,
+  recur_parent INTEGER,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  done_at TIMESTAMPTZ,
+  realizado_por TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_plan_labores_tenant_fecha ON plan_labores(tenant_id, fecha);
+CREATE TABLE IF NOT EXISTS outbox_aplicadas (
+  clave TEXT PRIMARY KEY,
+  tenant_id INTEGER,
+  funcion TEXT NOT NULL,
+  aplicada_en TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+_CAST_RE = re.compile(r"::\w+")
+_NOW_RE = re.compile(r"\bnow\(\)", re.I)
+_GREATEST_RE = re.compile(r"\bGREATEST\(", re.I)
+_TRADUCIDO: dict = {}
+
+_LOCAL = threading.local()          # una conexión por (hilo, archivo): sqlite3 no comparte entre hilos
+_INIT_LOCK = threading.Lock()
+_INICIADAS: set = set()
+
+
+def es_sqlite(url: str | None) -> bool:
+    return bool(url) and url.startswith("sqlite:")
+
+
+def ruta(url: str) -> str:
+    """sqlite:///finca.db -> finca.db (relativa) ; sqlite:////var/finca.db -> /var/finca.db."""
+    path = url.split(":", 1)[1].split("?", 1)[0]
+    if path.startswith("///"):
+        return path[3:]
+    return path[2:] if path.startswith("//") else path
+
+
+def traducir(sql: str) -> str:
+    """Dialecto Postgres de database.py -> SQLite (se cachea por texto)."""
+    out = _TRADUCIDO.get(sql)
+    if out is None:
+        out = _CAST_RE.sub("", sql.replace("%s", "?"))
+        out = _GREATEST_RE.sub("MAX(", _NOW_RE.sub("CURRENT_TIMESTAMP", out))
+        _TRADUCIDO[sql] = out
+    return out
+
+
+def _error(e: sqlite3.Error) -> Exception:
+    # Los helpers y db_policy entienden las excepciones de psycopg2: se traducen aquí
+    if isinstance(e, sqlite3.IntegrityError):
+        return psycopg2.IntegrityError(str(e))
+    if isinstance(e, sqlite3.OperationalError):
+        if _ocupada(e):
+            return psycopg2.OperationalError(str(e))  # "database is locked" -> transitorio, se reintenta
+        return psycopg2.ProgrammingError(str(e))  # no such table, syntax error...: reintentar no lo arregla
+    return psycopg2.DatabaseError(str(e))
+
+
+def _ocupada(e: sqlite3.OperationalError) -> bool:
+    """SQLITE_BUSY/SQLITE_LOCKED: otro proceso tiene el archivo tomado; es lo único que vale reintentar."""
+    code = getattr(e, "sqlite_errorcode", None)  # Python 3.11+; incluye códigos extendidos
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class Cursor:
+    """Cursor con la forma que usan los helpers (execute/fetch*/rowcount) sobre sqlite3."""
+
+    dialect = "sqlite"
+    fila = None  # tipo de fila (NamedTuple) que fija database._run
+
+    def __init__(self, conn, on_fetch):
+        self.connection = conn
+        self._cur = conn._db.cursor()
+        self._on_fetch = on_fetch
+        self._cambios = 0
+
+    @property
+    def rowcount(self):
+        # sqlite3 da -1 en un UPDATE/DELETE que empieza con WITH: ahí vale el conteo de cambios
+        if self._cur.rowcount == -1 and self._cur.description is None:
+            return self._cambios
+        return self._cur.rowcount
+
+    def execute(self, sql, params=None):
+        try:
+            self._cur.execute(traducir(sql), tuple(params or ()))
+            if self._cur.rowcount == -1 and self._cur.description is None:
+                # changes() no cuenta lo que escriben los triggers (resúmenes diarios); total_changes sí
+                self._cambios = self._cur.connection.execute("SELECT changes();").fetchone()[0]
+        except sqlite3.Error as e:
+            raise _error(e) from e
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            self._on_fetch((row,))
+            if self.fila is not None:
+                row = self.fila._make(row)
+        return row
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        self._on_fetch(rows)
+        return rows if self.fila is None else list(map(self.fila._make, rows))
+
+    def fetchmany(self, size=None):
+        rows = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        self._on_fetch(rows)
+        return rows if self.fila is None else list(map(self.fila._make, rows))
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+
+class Connection:
+    """Conexión del hilo: close() solo deshace lo que quedó abierto; el archivo sigue abierto."""
+
+    dialect = "sqlite"
+
+    def __init__(self, db, on_fetch):
+        self._db = db
+        self._on_fetch = on_fetch
+        self.closed = 0
+
+    def cursor(self):
+        return Cursor(self, self._on_fetch)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def close(self):
+        if self._db.in_transaction:
+            self._db.rollback()
+
+
+def _columnas(db, tabla) -> set:
+    return {r[1] for r in db.execute(f"PRAGMA table_info({tabla});")}
+
+
+_TABLAS_TENANT = ("trabajadores", "fincas", "jornadas", "insumos", "tarifas_user", "pagos_mes", "plan_labores",
+                  "outbox_aplicadas")
+
+
+def _migrar_tenant(db):
+    """
+    owner (username) -> tenant_id, como database.ensure_tenant_ids. Corre ANTES del SCHEMA, cuyos
+    índices ya son sobre tenant_id. SQLite no borra columnas indexadas ni claves primarias: primero
+    caen los índices sobre owner y tarifas_user se reconstruye.
+    """
+    if "tenant_id" not in _columnas(db, "users") and _columnas(db, "users"):
+        db.execute("ALTER TABLE users ADD COLUMN tenant_id INTEGER;")
+        db.execute("UPDATE users SET tenant_id = rowid;")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_users_tenant ON users(tenant_id);")
+    viejas = [t for t in _TABLAS_TENANT if "owner" in _columnas(db, t)]
+    if not viejas:
+        return
+    import bcrypt
+    union = " UNION ".join(f"SELECT owner FROM {t}" for t in viejas)
+    for (huerfano,) in db.execute(f"""
+            SELECT DISTINCT o.owner FROM ({union}) o
+            WHERE o.owner IS NOT NULL AND NOT EXISTS (SELECT 1 FROM users u WHERE u.username = o.owner);
+            """).fetchall():
+        # cuenta con contraseña aleatoria: conserva los datos, nadie entra con ella
+        db.execute("""
+            INSERT INTO users (username, password, tenant_id)
+            VALUES (?, ?, (SELECT COALESCE(MAX(tenant_id), 0) + 1 FROM users));
+        """, (huerfano, bcrypt.hashpw(os.urandom(24), bcrypt.gensalt()).decode()))
+    for t in viejas:
+        for (indice,) in db.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql LIKE '%owner%';",
+                                    (t,)).fetchall():
+            db.execute(f"DROP INDEX {indice};")
+        if t == "tarifas_user":
+            db.execute("ALTER TABLE tarifas_user RENAME TO tarifas_user_owner;")
+            db.execute("""
+                CREATE TABLE tarifas_user (
+                  tenant_id INTEGER PRIMARY KEY REFERENCES users(tenant_id),
+                  pago_dia NUMERIC NOT NULL,
+                  pago_hora_extra NUMERIC NOT NULL,
+                  updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            db.execute("""
+                INSERT INTO tarifas_user (tenant_id, pago_dia, pago_hora_extra, updated_at)
+                SELECT u.tenant_id, v.pago_dia, v.pago_hora_extra, v.updated_at
+                FROM tarifas_user_owner v JOIN users u ON u.username = v.owner;
+            """)
+            db.execute("DROP TABLE tarifas_user_owner;")
+            continue
+        db.execute(f"ALTER TABLE {t} ADD COLUMN tenant_id INTEGER REFERENCES users(tenant_id);")
+        db.execute(f"UPDATE {t} SET tenant_id = (SELECT u.tenant_id FROM users u WHERE u.username = {t}.owner);")
+        db.execute(f"ALTER TABLE {t} DROP COLUMN owner;")
+    db.commit()
+
+
+def _migrar(db):
+    """Lleva un archivo creado con un esquema anterior al actual (lo mismo que las ensure_* de database.py)."""
+    if "activo" not in _columnas(db, "trabajadores"):
+        db.execute("ALTER TABLE trabajadores ADD COLUMN activo BOOLEAN NOT NULL DEFAULT TRUE;")
+    for t in ("jornadas", "plan_labores"):
+        cols = _columnas(db, t)
+        if "trabajador_id" not in cols:
+            db.execute(f"ALTER TABLE {t} ADD COLUMN trabajador_id INTEGER REFERENCES trabajadores(id);")
+        if "trabajador" in cols:
+            # "Nombre Apellido" -> id; los nombres sin trabajador se crean inactivos para no perder historia
+            for tenant, nombre in db.execute(f"SELECT DISTINCT tenant_id, trabajador FROM {t} WHERE trabajador IS NOT NULL;").fetchall():
+                n, _, a = nombre.partition(" ")
+                db.execute("""
+                    INSERT INTO trabajadores (tenant_id, nombre, apellido, activo)
+                    SELECT ?, ?, ?, FALSE
+                    WHERE NOT EXISTS (SELECT 1 FROM trabajadores
+                                      WHERE tenant_id=? AND rtrim(nombre || ' ' || apellido) = ?)
+                    ON CONFLICT (tenant_id, nombre, apellido) DO NOTHING;
+                """, (tenant, n, a, tenant, nombre))
+            db.execute(f"""
+                UPDATE {t} SET trabajador_id = (
+                  SELECT w.id FROM trabajadores w
+                  WHERE w.tenant_id = {t}.tenant_id AND rtrim(w.nombre || ' ' || w.apellido) = {t}.trabajador)
+                WHERE trabajador_id IS NULL;
+            """)
+            db.execute(f"ALTER TABLE {t} DROP COLUMN trabajador;")
+        db.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_tenant_trabajador ON {t}(tenant_id, trabajador_id);")
+    if "activo" not in _columnas(db, "fincas"):
+        db.execute("ALTER TABLE fincas ADD COLUMN activo BOOLEAN NOT NULL DEFAULT TRUE;")
+    if "hectareas" not in _columnas(db, "fincas"):
+        db.execute("ALTER TABLE fincas ADD COLUMN hectareas NUMERIC CHECK (hectareas > 0);")
+        db.execute("ALTER TABLE fincas ADD COLUMN plantas INTEGER CHECK (plantas > 0);")
+    for t, tenant in (("jornadas", "x.tenant_id"), ("insumos", "x.tenant_id"), ("plan_labores", "x.tenant_id"),
+                      ("pagos_mes_insumos", "(SELECT p.tenant_id FROM pagos_mes p WHERE p.id = x.pago_id)")):
+        cols = _columnas(db, t)
+        if "finca_id" not in cols:
+            db.execute(f"ALTER TABLE {t} ADD COLUMN finca_id INTEGER REFERENCES fincas(id);")
+        if "lote" in cols:
+            # nombre -> id; los lotes sin finca se crean inactivos para no perder historia
+            db.execute(f"""
+                INSERT INTO fincas (tenant_id, nombre, activo)
+                SELECT DISTINCT {tenant}, x.lote, FALSE FROM {t} x WHERE x.lote IS NOT NULL
+                ON CONFLICT (tenant_id, nombre) DO NOTHING;
+            """)
+            db.execute(f"""
+                UPDATE {t} AS x SET finca_id = (
+                  SELECT f.id FROM fincas f WHERE f.tenant_id = {tenant} AND f.nombre = x.lote)
+                WHERE finca_id IS NULL;
+            """)
+            db.execute(f"ALTER TABLE {t} DROP COLUMN lote;")
+        if t != "pagos_mes_insumos":
+            db.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_tenant_finca ON {t}(tenant_id, finca_id);")
+    # hidden = 3: columna generada STORED
+    generada = any(c[1] == "costo_total" and c[6] == 3 for c in db.execute("PRAGMA table_xinfo(insumos);"))
+    con_tipo = "'Mano de obra'" in db.execute("SELECT sql FROM sqlite_master WHERE name = 'insumos';").fetchone()[0]
+    if not (generada and con_tipo):
+        # SQLite no agrega columnas STORED ni CHECK con ALTER: insumos se rehace y costo_total se recalcula al copiar
+        # el RENAME reescribe las vistas que leen insumos para que apunten a insumos_anterior: se rehacen después
+        db.execute("DROP VIEW IF EXISTS insumos_todas;")
+        db.execute("DROP VIEW IF EXISTS costos_lote_mes;")
+        db.execute("ALTER TABLE insumos RENAME TO insumos_anterior;")
+        db.execute(_INSUMOS)
+        cols = ", ".join(c[1] for c in db.execute("PRAGMA table_xinfo(insumos);") if c[6] == 0)
+        # filas viejas que no cumplen se conservan, como el CHECK NOT VALID de Postgres; lo nuevo sí se valida
+        db.execute("PRAGMA ignore_check_constraints=ON;")
+        db.execute(f"INSERT INTO insumos ({cols}) SELECT {cols} FROM insumos_anterior;")
+        db.execute("PRAGMA ignore_check_constraints=OFF;")
+        db.execute("DROP TABLE insumos_anterior;")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_insumos_tenant_finca ON insumos(tenant_id, finca_id);")
+        db.executescript(SCHEMA)  # índices y vista de insumos (todo IF NOT EXISTS)
+    for t in _RESUMENES:
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?;", (f"{t}_dia_del",)).fetchone():
+            _crear_resumen(db, t)
+    db.commit()
+
+
+def connect(url: str, on_fetch) -> Connection:
+    path = ruta(url)
+    conns = getattr(_LOCAL, "conns", None)
+    if conns is None:
+        conns = _LOCAL.conns = {}
+    db = conns.get(path)
+    if db is None:
+        try:
+            db = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=5.0,
+                                 check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")  # seguro con WAL; solo arriesga la última tx ante un apagón
+            db.execute("PRAGMA foreign_keys=ON;")
+            with _INIT_LOCK:
+                if path not in _INICIADAS:
+                    _migrar_tenant(db)
+                    db.executescript(SCHEMA)
+                    _migrar(db)
+                    _INICIADAS.add(path)
+        except sqlite3.Error as e:
+            raise _error(e) from e
+        conns[path] = db
+    return Connection(db, on_fetch)
@@ -0,0 +1,275 @@
+# loadtest.py — prueba de carga de main.py con sesiones concurrentes simuladas (streamlit.testing AppTest)
+#
+# Cada sesión es un AppTest propio que hace: login -> navegación -> alta de jornada -> reporte semanal,
+# repitiendo los tres últimos pasos --iterations veces. Al final reporta throughput, percentiles de
+# latencia por paso, conexiones a Postgres (pg_stat_activity) y memoria por sesión.
+#
+# AppTest guarda un Runtime global por proceso, así que dos sesiones no pueden correr en hilos del
+# mismo proceso: cada sesión va en su propio proceso, con un pool de --pool-max conexiones
+# (DB_POOL_MAX). Las conexiones se cuentan del lado de Postgres, sumando todas las sesiones.
+#
+# Uso:
+#   LOAD_DATABASE_URL=postgresql://... python loadtest.py --sessions 40 --iterations 3 --out carga.json
+#
+# Igual que bench.py, nunca usa DATABASE_URL: crea usuarios "load_*" con sus fincas y trabajadores.
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import datetime
+import threading
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+OWNER_PREFIX = "load_"
+PASSWORD = "carga123"
+PAGINA_JORNADA = "Registrar Jornada"
+PAGINA_SEMANAL = "Reporte Semanal (Dom–Sáb)"
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def _args(argv=None):
+    p = argparse.ArgumentParser(description="Prueba de carga de finca-app con AppTest.")
+    p.add_argument("--dsn", default=os.getenv("LOAD_DATABASE_URL"),
+                   help="Postgres de pruebas (o LOAD_DATABASE_URL). Nunca se lee DATABASE_URL.")
+    p.add_argument("--sessions", type=int, default=30, help="sesiones concurrentes (capataces)")
+    p.add_argument("--iterations", type=int, default=3, help="vueltas navegación/jornada/reporte por sesión")
+    p.add_argument("--ramp", type=float, default=5.0, help="segundos para arrancar todas las sesiones")
+    p.add_argument("--think-ms", type=int, default=0, help="pausa entre pasos de una sesión")
+    p.add_argument("--users", type=int, default=None, help="usuarios distintos (default: uno por sesión)")
+    p.add_argument("--timeout", type=float, default=120.0, help="timeout por rerun de AppTest (s)")
+    p.add_argument("--pool-max", type=int, default=2, help="DB_POOL_MAX de cada proceso-sesión")
+    p.add_argument("--out", default=None, help="JSON de resultados")
+    return p.parse_args(argv)
+
+
+# ---------- Preparación ----------
+
+def _preparar(db, n_users: int):
+    for crear in (db.ensure_tenant_ids, db.create_users_table, db.create_trabajadores_table, db.create_fincas_table, db.create_jornadas_table,
+                  db.create_insumos_table, db.create_tarifas_table, db.create_cierres_tables,
+                  db.ensure_cierres_schema, db.create_plan_table,
+                  db.ensure_trabajador_fk, db.ensure_finca_fk, db.ensure_particiones,
+                  db.ensure_integridad_numerica, db.create_archivo_tables, db.create_resumenes_diarios,
+                  db.create_costos_views):
+        crear()
+    users = [f"{OWNER_PREFIX}{i}" for i in range(n_users)]
+    for u in users:
+        if not db.verify_user(u, PASSWORD):
+            try:
+                db.add_user(u, PASSWORD)
+            except db.IntegrityError:
+                pass  # existe con otra contraseña; el login de esa sesión fallará y se reporta
+        db.add_finca("Lote 1", u)
+        if not db.get_all_trabajadores(u):
+            db.add_trabajador("Capataz", u, u)
+    return users
+
+
+# ---------- Muestreo de recursos ----------
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource  # fallback: pico, no actual
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Muestreo(threading.Thread):
+    """Cada `intervalo` s cuenta las conexiones a la base en pg_stat_activity."""
+
+    def __init__(self, dsn: str, intervalo: float = 0.5):
+        super().__init__(daemon=True)
+        self.dsn, self.intervalo = dsn, intervalo
+        self.conexiones = []
+        self._fin = threading.Event()
+
+    def run(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            while not self._fin.is_set():
+                cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid();")
+                self.conexiones.append(cur.fetchone()[0])
+                self._fin.wait(self.intervalo)
+        finally:
+            conn.close()
+
+    def parar(self):
+        self._fin.set()
+        self.join()
+
+
+# ---------- Sesión simulada ----------
+
+def _boton(at, etiqueta):
+    for b in at.button:
+        if b.label == etiqueta:
+            return b
+    raise LookupError(f"No encontré el botón '{etiqueta}'")
+
+
+def _errores(at):
+    return [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+
+
+def _sesion(idx: int, user: str, a, t_inicio: float):
+    """Corre en un proceso propio; devuelve (pasos, rss_base_mb, rss_pico_mb)."""
+    os.environ["DATABASE_URL"] = a.dsn
+    os.environ["DB_POOL_MAX"] = str(a.pool_max)
+    os.environ["DB_POOL_MIN"] = "1"
+    from streamlit.testing.v1 import AppTest
+    # Precarga los imports pesados de main.py para que no caigan dentro de la medición (una instancia
+    # real los paga una sola vez). Solo interesa el efecto en sys.modules: por eso import_module.
+    for modulo in ("database", "reportes", "profiling", "streamlit_option_menu"):
+        importlib.import_module(modulo)
+
+    rss_base = rss_pico = _rss_mb()
+    time.sleep(max(0.0, t_inicio + a.ramp * idx / max(1, a.sessions) - time.time()))
+    pasos = []
+
+    def paso(nombre, fn):
+        nonlocal rss_pico
+        t = time.perf_counter()
+        error = None
+        try:
+            at = fn()
+            errs = _errores(at)
+            if errs:
+                error = errs[0][:200]
+        except Exception as e:  # un fallo de una sesión no tumba la prueba
+            error = f"{type(e).__name__}: {e}"[:200]
+        pasos.append({"sesion": idx, "paso": nombre, "ms": (time.perf_counter() - t) * 1000,
+                      "fin": time.time(), "error": error})
+        rss_pico = max(rss_pico, _rss_mb())
+        if a.think_ms:
+            time.sleep(a.think_ms / 1000)
+        return error is None
+
+    at = AppTest.from_file(MAIN, default_timeout=a.timeout)
+
+    def login():
+        at.run()
+        at.text_input[0].input(user)
+        at.text_input[1].input(PASSWORD)
+        _boton(at, "Entrar").click().run()
+        if not at.session_state["logged_in"]:
+            raise RuntimeError("login rechazado")
+        return at
+
+    def ir(pagina):
+        def _nav():
+            # option_menu es un componente web; se navega como lo hace set_page()
+            at.session_state["nav_mode"] = "page"
+            at.session_state["current_page"] = pagina
+            at.session_state["menu_last"] = pagina
+            return at.run()
+        return _nav
+
+    def jornada():
+        at.number_input[0].set_value(1)
+        at.number_input[1].set_value(0.5)
+        return _boton(at, "Guardar jornada").click().run()
+
+    if paso("login", login):
+        for _ in range(a.iterations):
+            if not paso("navegacion", ir(PAGINA_JORNADA)):
+                continue
+            paso("jornada", jornada)
+            paso("reporte_semanal", ir(PAGINA_SEMANAL))
+    return pasos, rss_base, rss_pico
+
+
+# ---------- Resumen ----------
+
+def _pct(vals, q):
+    if not vals:
+        return None
+    vals = sorted(vals)
+    return round(vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))], 2)
+
+
+def _resumen(registro, wall_s, muestreo, memorias, a):
+    por_paso = {}
+    for r in registro:
+        por_paso.setdefault(r["paso"], []).append(r)
+    pasos = {}
+    for nombre, rs in por_paso.items():
+        ok = [r["ms"] for r in rs if r["error"] is None]
+        pasos[nombre] = {"n": len(rs), "errores": len(rs) - len(ok),
+                         "p50_ms": _pct(ok, 0.50), "p95_ms": _pct(ok, 0.95), "p99_ms": _pct(ok, 0.99),
+                         "max_ms": round(max(ok), 2) if ok else None,
+                         "media_ms": round(statistics.fmean(ok), 2) if ok else None}
+    ok_total = sum(1 for r in registro if r["error"] is None)
+    deltas = [pico - base for base, pico in memorias]
+    errores = sorted({r["error"] for r in registro if r["error"]})[:10]
+    return {
+        "meta": {"fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                 "params": {k: v for k, v in vars(a).items() if k not in ("dsn", "out")}},
+        "wall_s": round(wall_s, 2),
+        "throughput_reruns_s": round(ok_total / wall_s, 2) if wall_s else None,
+        "sesiones_completas": len({r["sesion"] for r in registro if r["paso"] == "reporte_semanal" and r["error"] is None}),
+        "pasos": pasos,
+        "conexiones_pg": {"max": max(muestreo.conexiones, default=0),
+                          "media": round(statistics.fmean(muestreo.conexiones), 1) if muestreo.conexiones else 0},
+        "memoria_mb": {"rss_base_proceso": round(statistics.fmean(b for b, _ in memorias), 1) if memorias else None,
+                       "por_sesion_media": round(statistics.fmean(deltas), 2) if deltas else None,
+                       "por_sesion_max": round(max(deltas), 2) if deltas else None},
+        "errores_ejemplo": errores,
+    }
+
+
+def main(argv=None):
+    a = _args(argv)
+    if not a.dsn:
+        sys.exit("Falta --dsn o LOAD_DATABASE_URL (no se usa DATABASE_URL a propósito).")
+    os.environ["DATABASE_URL"] = a.dsn  # main.py y database.py la leen de aquí
+    import database as db
+
+    users = _preparar(db, a.users or a.sessions)
+    muestreo = _Muestreo(a.dsn)
+    muestreo.start()
+    registro, memorias = [], []
+    # margen para que todos los procesos terminen de importar antes de arrancar la carga
+    t_inicio = time.time() + 5 + a.sessions * 0.1
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=a.sessions, mp_context=ctx) as ex:
+        futs = [ex.submit(_sesion, i, users[i % len(users)], a, t_inicio) for i in range(a.sessions)]
+        for f in futs:
+            pasos, base, pico = f.result()
+            registro.extend(pasos)
+            memorias.append((base, pico))
+    wall_s = max((r["fin"] for r in registro), default=t_inicio) - t_inicio
+    muestreo.parar()
+
+    res = _resumen(registro, wall_s, muestreo, memorias, a)
+    print(f"{a.sessions} sesiones en {res['wall_s']} s — {res['throughput_reruns_s']} reruns/s, "
+          f"{res['sesiones_completas']} completas")
+    print(f"{'paso':<18} {'n':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for nombre, p in res["pasos"].items():
+        print(f"{nombre:<18} {p['n']:>5} {p['errores']:>5} {p['p50_ms'] or 0:>9.1f} {p['p95_ms'] or 0:>9.1f} {p['p99_ms'] or 0:>9.1f}")
+    print(f"Conexiones Postgres: máx {res['conexiones_pg']['max']}, media {res['conexiones_pg']['media']}")
+    m = res["memoria_mb"]
+    print(f"Memoria por sesión (sobre {m['rss_base_proceso']} MB del proceso tras importar): "
+          f"media {m['por_sesion_media']} MB, máx {m['por_sesion_max']} MB")
+    for e in res["errores_ejemplo"]:
+        print("  error:", e)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as fh:
+            json.dump(res, fh, indent=2, ensure_ascii=False)
+        print(f"Resultados en {a.out}")
+    return 0 if not res["errores_ejemplo"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
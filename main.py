@@ -3,38 +3,50 @@ import datetime
 import pandas as pd
 import streamlit as st
 from streamlit_option_menu import option_menu
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 
+import profiling as prof
+import reportes as rep
 from database import (
-    connect_db,
+    connect_db, cargar_en_paralelo,
     # creación/migraciones
     create_users_table, create_trabajadores_table, create_jornadas_table, create_insumos_table,
-    create_tarifas_table, create_cierres_tables, ensure_cierres_schema,
+    create_tarifas_table, create_cierres_tables, ensure_cierres_schema, ensure_particiones,
+    ensure_integridad_numerica, create_archivo_tables,
     # fincas
-    create_fincas_table, add_finca, get_all_fincas,
+    create_fincas_table, add_finca, get_all_fincas, ensure_finca_fk, set_finca_area, get_fincas_area,
     # auth
-    add_user, verify_user,
+    add_user, verify_user, ensure_tenant_ids,
     # trabajadores
-    add_trabajador, get_all_trabajadores,
+    add_trabajador, get_all_trabajadores, get_trabajadores, ensure_trabajador_fk,
     # jornadas
-    add_jornada, get_all_jornadas, get_last_jornada_by_date, update_jornada,
+    add_jornada, get_last_jornada_by_date, update_jornada, get_jornadas_df,
     # insumos
-    add_insumo,
-    get_last_abono_by_date, update_abono,
-    get_last_fumigacion_by_date, update_fumigacion,
-    get_last_cal_by_date, update_cal,
-    get_last_herbicida_by_date, update_herbicida,
+    add_insumo, get_insumos_df,
+    # resúmenes diarios
+    create_resumenes_diarios, get_resumen_jornadas_df, get_resumen_insumos_df,
+    # costos por lote
+    create_costos_views, get_costos_refresco, get_costos_lote_df, DB_COSTOS_MAX_SEG,
+    # editor de registros
+    guardar_jornadas_editadas, guardar_insumos_editados,
+    repreciar_insumos, mover_insumos_de_lote, reasignar_etapa_insumos,
+    get_last_abono_by_date, get_last_fumigacion_by_date, get_last_cal_by_date, get_last_herbicida_by_date,
+    update_insumo,
     # tarifas por usuario
     get_tarifas, set_tarifas,
     # cierres
-    get_jornadas_between, get_insumos_between,
     crear_cierre_mensual, listar_cierres, leer_cierre_detalle,
-    delete_trabajador_by_fullname, delete_finca,
+    delete_trabajador, delete_finca,
     # planificador
     create_plan_table, add_plan, list_plans, get_plan, mark_plan_done_and_autorenew, postpone_plan,
+    # diagnóstico
+    get_db_metrics, get_slow_queries, DB_SLOW_MS,
+    # cola offline
+    create_outbox_table, sincronizar_outbox, EN_COLA, DBConnectionError, DBUnavailable,
 )
+import outbox
+
+# Perfilado opt-in (APP_PROFILE=1): desglose de tiempos de este rerun
+prof.iniciar_rerun(st.session_state, capturar=st.session_state.pop("__perfil_capturar__", False))
 
 # =============================
 # 🧩 Config DB (Supabase/Postgres)
@@ -50,6 +62,16 @@ def _safe_db_url():
     except Exception:
         return None
 
+def _admin_users() -> set:
+    # Usuarios con acceso a "Diagnóstico": APP_ADMINS="ana,luis" (env o st.secrets)
+    raw = os.getenv("APP_ADMINS")
+    if raw is None:
+        try:
+            raw = st.secrets.get("APP_ADMINS")
+        except Exception:
+            raw = None
+    return {u.strip() for u in (raw or "").split(",") if u.strip()}
+
 DB_URL = _safe_db_url()
 if not DB_URL:
     try:
@@ -124,24 +146,48 @@ RUN_MIGRATIONS = os.getenv("APP_RUN_MIGRATIONS", "0") == "1"
 try:
     _conn = connect_db(); _conn.close()
 except Exception as e:
-    st.error(f"No se pudo conectar a la base de datos: {e}")
-    st.stop()
+    if not st.session_state.get("logged_in"):
+        st.error(f"No se pudo conectar a la base de datos: {e}")
+        st.stop()
+    # Sesión ya iniciada: se sigue sin red; las escrituras quedan en la cola local
+    st.warning("📴 Sin conexión con la base de datos. Lo que registres se guarda en este equipo y se envía al volver la red.")
+
+@st.cache_resource(show_spinner="🔧 Ejecutando migraciones…")
+def _migrar() -> list:
+    """
+    Migraciones una vez por proceso y no en cada rerun: varias toman locks sobre las tablas.
+    Si fallan no quedan en caché y el próximo rerun las reintenta. Devuelve los CHECK pendientes.
+    """
+    ensure_tenant_ids()  # antes que las create_*: sus índices ya van sobre tenant_id
+    create_users_table()
+    create_trabajadores_table()
+    create_fincas_table()  # antes de jornadas/insumos/planes: la referencian
+    create_jornadas_table()
+    create_insumos_table()
+    create_tarifas_table()
+    create_cierres_tables()
+    ensure_cierres_schema()
+    create_plan_table()
+    ensure_trabajador_fk()
+    ensure_finca_fk()
+    ensure_particiones()  # también deja creadas las particiones de los próximos años
+    pendientes = ensure_integridad_numerica()  # antes de create_archivo_tables, que arma las vistas
+    create_archivo_tables()
+    create_resumenes_diarios()  # sus triggers van también en las tablas _archivo
+    create_costos_views()  # lee las tablas _archivo
+    create_outbox_table()
+    return pendientes
 
 if RUN_MIGRATIONS and _can_create_in_public():
     try:
-        create_users_table()
-        create_trabajadores_table()
-        create_jornadas_table()
-        create_insumos_table()
-        create_tarifas_table()
-        create_cierres_tables()
-        ensure_cierres_schema()
-        create_fincas_table()
-        create_plan_table()
+        pendientes = _migrar()
+        if pendientes:
+            st.warning(f"⚠️ Hay registros con valores negativos; revisa: {', '.join(pendientes)}")
         st.success("🔧 Migraciones ejecutadas (rol con permiso CREATE).")
     except Exception as e:
         st.error(f"Error creando/migrando tablas: {e}")
         st.stop()
+prof.marca("arranque")
 
 # ===== Login =====
 def login():
@@ -222,6 +268,13 @@ if not st.session_state["logged_in"]:
 
 # Ya hay usuario => sigue la app
 OWNER = st.session_state["user"]
+IS_ADMIN = OWNER in _admin_users()
+
+# ===== Cola offline: reenvía lo guardado sin red (como mucho cada OUTBOX_SYNC_EVERY seg.) =====
+sincronizar_outbox()
+_pend = outbox.contar(OWNER)
+if _pend:
+    st.info(f"📤 {_pend} registro(s) guardados sin conexión, pendientes de enviar. Se envían solos al volver la red.")
 
 # ===== Catálogo de fincas (helper) =====
 def opciones_fincas():
@@ -261,11 +314,11 @@ def _menu_opciones_y_iconos(owner: str):
 
     opciones_avanzadas = [
         "Registrar Jornada","Registrar Abono","Registrar Fumigación","Registrar Cal","Registrar Herbicida",
-        "Ver Registros","Planificador","Reporte Semanal (Dom–Sáb)","Cierre Mensual",
+        "Ver Registros","Editar Registros","Planificador","Reporte Semanal (Dom–Sáb)","Cierre Mensual","Costos por Lote",
         "Añadir Finca","Añadir Empleado","Tarifas"
     ]
     iconos_avanzados = ["calendar-check","fuel-pump","bezier","gem","droplet",
-                        "journal-text","calendar-week","bar-chart","archive",
+                        "journal-text","pencil-square","calendar-week","bar-chart","archive","pie-chart",
                         "map","person-plus","cash"]
 
     opciones_simples = ["Registrar Jornada","Ver Registros","Planificador","Añadir Finca","Añadir Empleado","Tarifas"]
@@ -273,6 +326,9 @@ def _menu_opciones_y_iconos(owner: str):
 
     opciones_base = opciones_simples if not has_basics else opciones_avanzadas
     iconos_base   = iconos_simples   if not has_basics else iconos_avanzados
+    if IS_ADMIN:
+        opciones_base = opciones_base + ["Diagnóstico"]
+        iconos_base   = iconos_base + ["speedometer2"]
 
     opciones_ui = ["🏠 Inicio"] + opciones_base
     iconos_ui   = ["house"] + iconos_base
@@ -428,11 +484,11 @@ if st.session_state.nav_mode == "menu":
 
         opciones_avanzadas = [
             "Registrar Jornada","Registrar Abono","Registrar Fumigación","Registrar Cal","Registrar Herbicida",
-            "Ver Registros","Planificador","Reporte Semanal (Dom–Sáb)","Cierre Mensual",
+            "Ver Registros","Editar Registros","Planificador","Reporte Semanal (Dom–Sáb)","Cierre Mensual","Costos por Lote",
             "Añadir Finca","Añadir Empleado","Tarifas"
         ]
         iconos_avanzados = ["calendar-check","fuel-pump","bezier","gem","droplet",
-                            "journal-text","calendar-week","bar-chart","archive",
+                            "journal-text","pencil-square","calendar-week","bar-chart","archive","pie-chart",
                             "map","person-plus","cash"]
 
         opciones_simples = ["Registrar Jornada","Ver Registros","Planificador","Añadir Finca","Añadir Empleado","Tarifas"]
@@ -440,6 +496,9 @@ if st.session_state.nav_mode == "menu":
 
         opciones_base = opciones_simples if modo_simple else opciones_avanzadas
         iconos_base   = iconos_simples   if modo_simple else iconos_avanzados
+        if IS_ADMIN:
+            opciones_base = opciones_base + ["Diagnóstico"]
+            iconos_base   = iconos_base + ["speedometer2"]
 
         opciones_ui = ["🏠 Inicio"] + opciones_base
         iconos_ui   = ["house"] + iconos_base
@@ -480,6 +539,8 @@ else:
         st.session_state.open_menu_on_home = False
 
 
+prof.marca("menú")
+
 # ===== Planificador de labores =====
 if menu == "Planificador":
     st.subheader("🗓️ Planificador de labores")
@@ -516,10 +577,11 @@ if menu == "Planificador":
             cantidad = precio_unitario = dias = horas_extra = None
 
             if tipo == "Jornada":
-                trabajadores = get_all_trabajadores(OWNER)
+                trabajadores = dict(get_trabajadores(OWNER))  # id -> "Nombre Apellido"
                 if not trabajadores:
                     st.info("No hay empleados aún. Agrega uno en 'Añadir Empleado'.")
-                trabajador = st.selectbox("Trabajador", trabajadores) if trabajadores else None
+                trabajador = (st.selectbox("Trabajador", list(trabajadores), format_func=trabajadores.get)
+                              if trabajadores else None)
                 actividad  = st.selectbox("Actividad", ACTIVIDADES)
                 dias       = st.number_input("Días", min_value=0, max_value=31, step=1, value=1)
                 horas_extra= st.number_input("Horas extra", min_value=0.0, step=0.5, value=0.0)
@@ -618,17 +680,10 @@ if menu == "Planificador":
 
     # ---------- Agenda (semana/mes) ----------
     hoy = datetime.date.today()
-    planes = list_plans(OWNER, ini, fin)  # todos los estados
+    planes = list_plans(OWNER, ini, fin)  # todos los estados (filas Plan)
     by_date = {}
     for p in planes:
-        (pid, fec, lote, tipo, trab, act, et, prod, dos, cant, precio_u, _dias, hextra, estado,
-         every, times, autorenew) = p
-        by_date.setdefault(str(fec), []).append({
-            "id": pid, "fecha": str(fec), "lote": lote, "tipo": tipo, "trabajador": trab,
-            "actividad": act, "etapa": et, "producto": prod, "dosis": dos,
-            "cantidad": cant, "precio_u": precio_u, "dias": _dias, "hextra": hextra, "estado": estado,
-            "every": every, "times": times, "autorenew": autorenew
-        })
+        by_date.setdefault(str(p.fecha), []).append(p)
 
     st.markdown("### 📅 Agenda")
     days = []
@@ -638,55 +693,55 @@ if menu == "Planificador":
         cur += datetime.timedelta(days=1)
 
     def card_item(item):
-        atrasado = (item["estado"] == "pendiente" and datetime.date.fromisoformat(item["fecha"]) < hoy)
-        estado_icon = "🟢" if item["estado"] == "realizado" else ("🔴" if atrasado else "🟡")
-        st.write(f"{estado_icon} **{item['tipo']}** — {item['lote']}")
-        if item["tipo"] == "Jornada":
-            st.caption(f"{item['trabajador'] or '—'} • {item['actividad'] or '—'} • {item['dias'] or 1} día(s), {item['hextra'] or 0} HEX")
+        atrasado = (item.estado == "pendiente" and item.fecha < hoy)
+        estado_icon = "🟢" if item.estado == "realizado" else ("🔴" if atrasado else "🟡")
+        st.write(f"{estado_icon} **{item.tipo}** — {item.lote}")
+        if item.tipo == "Jornada":
+            st.caption(f"{item.trabajador or '—'} • {item.actividad or '—'} • {item.dias or 1} día(s), {item.horas_extra or 0} HEX")
         else:
-            st.caption(f"{item['producto'] or ''} • {item['etapa'] or ''} • {item['cantidad'] or 0}")
-        if item["every"]:
-            st.caption(f"🔁 cada {item['every']} días" + ("" if item["times"] in (None,0) else f" • quedan {max(0,int(item['times'])-1)}"))
+            st.caption(f"{item.producto or ''} • {item.etapa or ''} • {item.cantidad or 0}")
+        if item.recur_every_days:
+            st.caption(f"🔁 cada {item.recur_every_days} días" + ("" if item.recur_times in (None,0) else f" • quedan {max(0,int(item.recur_times)-1)}"))
 
         cols_btn = st.columns([1,1,1])
         with cols_btn[0]:
-            if item["estado"] != "realizado" and st.button("✔ Realizada", key=f"done_{item['id']}"):
+            if item.estado != "realizado" and st.button("✔ Realizada", key=f"done_{item.id}"):
                 try:
                     # Crear registro real + re-agendar si aplica
-                    if item["tipo"] == "Jornada":
-                        if not item["trabajador"]:
+                    if item.tipo == "Jornada":
+                        if not item.trabajador_id:
                             st.warning("Este plan no tiene trabajador asignado.")
                         else:
                             add_jornada(
-                                trabajador=item["trabajador"],
-                                fecha=item["fecha"],
-                                lote=item["lote"],
-                                actividad=item["actividad"] or "Otra",
-                                dias=int(item["dias"] or 1),
-                                horas_normales=int(item["dias"] or 1) * 6,
-                                horas_extra=float(item["hextra"] or 0.0),
+                                trabajador=item.trabajador_id,
+                                fecha=str(item.fecha),
+                                lote=item.lote,
+                                actividad=item.actividad or "Otra",
+                                dias=int(item.dias or 1),
+                                horas_normales=int(item.dias or 1) * 6,
+                                horas_extra=float(item.horas_extra or 0.0),
                                 owner=OWNER,
                             )
                     else:
                         add_insumo(
-                            item["fecha"], item["lote"], item["tipo"],
-                            item["etapa"], item["producto"] or "",
-                            item["dosis"] or "",
-                            float(item["cantidad"] or 0.0),
-                            float(item["precio_u"] or 0.0),
+                            str(item.fecha), item.lote, item.tipo,
+                            item.etapa, item.producto or "",
+                            item.dosis or "",
+                            float(item.cantidad or 0.0),
+                            float(item.precio_unitario or 0.0),
                             OWNER
                         )
-                    mark_plan_done_and_autorenew(OWNER, item["id"], OWNER)
+                    mark_plan_done_and_autorenew(OWNER, item.id, OWNER)
                     st.success("✅ Registrado y plan actualizado.")
                     st.rerun()
                 except Exception as e:
                     st.error(f"No se pudo marcar como realizada: {e}")
         with cols_btn[1]:
-            if item["estado"] == "pendiente" and st.button("⏰ Posponer 7d", key=f"snooze7_{item['id']}"):
-                postpone_plan(OWNER, item["id"], 7); st.rerun()
+            if item.estado == "pendiente" and st.button("⏰ Posponer 7d", key=f"snooze7_{item.id}"):
+                postpone_plan(OWNER, item.id, 7); st.rerun()
         with cols_btn[2]:
-            if item["estado"] == "pendiente" and st.button("⏰ Posponer 15d", key=f"snooze15_{item['id']}"):
-                postpone_plan(OWNER, item["id"], 15); st.rerun()
+            if item.estado == "pendiente" and st.button("⏰ Posponer 15d", key=f"snooze15_{item.id}"):
+                postpone_plan(OWNER, item.id, 15); st.rerun()
 
     if vista == "Semana":
         cols = st.columns(7)
@@ -727,23 +782,26 @@ if menu == "Añadir Empleado":
                 st.warning("⚠️ Completa todos los campos.")
             else:
                 ok = add_trabajador(nombre.strip(), apellido.strip(), OWNER)
-                if ok:
+                if ok is EN_COLA:
+                    st.info("📤 Sin conexión: el empleado se registrará al volver la red.")
+                elif ok:
                     st.success("✅ Empleado registrado.")
                 else:
                     st.info("Ese empleado ya existe para tu cuenta.")
 
     with st.expander("🗑️ Eliminar empleado"):
-        empleados = get_all_trabajadores(OWNER)  # lista "Nombre Apellido"
+        empleados = dict(get_trabajadores(OWNER))  # id -> "Nombre Apellido"
         if not empleados:
             st.info("No hay empleados registrados.")
         else:
-            emp_sel = st.selectbox("Selecciona el empleado a eliminar", empleados, key="del_emp_sel")
+            emp_sel = st.selectbox("Selecciona el empleado a eliminar", list(empleados),
+                                   format_func=empleados.get, key="del_emp_sel")
             confirmar = st.checkbox("Estoy seguro/a de eliminar este empleado (no afecta registros históricos)")
             if st.button("Eliminar empleado"):
                 if not confirmar:
                     st.warning("Marca la casilla de confirmación antes de eliminar.")
                 else:
-                    ok = delete_trabajador_by_fullname(OWNER, emp_sel)
+                    ok = delete_trabajador(OWNER, emp_sel)
                     if ok:
                         st.success("✅ Empleado eliminado del catálogo.")
                         st.rerun()
@@ -771,7 +829,9 @@ if menu == "Añadir Finca":
                 st.warning("⚠️ Escribe un nombre.")
             else:
                 ok = add_finca(nombre_finca.strip(), OWNER)
-                if ok:
+                if ok is EN_COLA:
+                    st.info("📤 Sin conexión: la finca se registrará al volver la red.")
+                elif ok:
                     st.success("✅ Finca registrada."); st.rerun()
                 else:
                     st.info("Esa finca ya existe para tu cuenta.")
@@ -793,14 +853,30 @@ if menu == "Añadir Finca":
                         st.rerun()
                     else:
                         st.error("No se pudo eliminar (verifica el nombre).")
-    # Listado simple
+    # Listado con área (para los costos por hectárea / por planta)
     try:
-        fincas_list = get_all_fincas(OWNER)
+        fincas_area = get_fincas_area(OWNER)
     except Exception:
-        fincas_list = []
-    if fincas_list:
+        fincas_area = []
+    if fincas_area:
+        with st.expander("📐 Área del lote"):
+            areas = {n: (ha, pl) for n, ha, pl in fincas_area}
+            finca_area = st.selectbox("Finca/lote", list(areas), key="area_finca_sel")
+            ha_actual, pl_actual = areas[finca_area]
+            hectareas = st.number_input("Hectáreas (0 = sin dato)", min_value=0.0, step=0.5,
+                                        value=float(ha_actual or 0), key=f"area_ha_{finca_area}")
+            plantas = st.number_input("Número de plantas (0 = sin dato)", min_value=0, step=100,
+                                      value=int(pl_actual or 0), key=f"area_pl_{finca_area}")
+            if st.button("Guardar área"):
+                ok = set_finca_area(OWNER, finca_area, hectareas or None, plantas or None)
+                if ok is EN_COLA:
+                    st.info("📤 Sin conexión: el área se guardará al volver la red.")
+                elif ok:
+                    st.success("✅ Área guardada."); st.rerun()
+                else:
+                    st.error("No se pudo guardar (verifica el nombre).")
         st.markdown("### 🌱 Tus fincas/lotes")
-        st.dataframe(pd.DataFrame({"Finca/Lote": fincas_list}), use_container_width=True)
+        st.dataframe(pd.DataFrame(fincas_area, columns=["Finca/Lote", "Hectáreas", "Plantas"]), use_container_width=True)
     else:
         st.info("Aún no has agregado fincas.")
 
@@ -816,32 +892,41 @@ if menu == "Cierre Mensual":
     mes_ini = datetime.date(int(anio), int(mes), 1)
     mes_fin = datetime.date(int(anio), int(mes), monthrange(int(anio), int(mes))[1])
 
-    pago_dia, pago_hex = get_tarifas(OWNER)
+    # Lecturas independientes en paralelo: la página tarda lo que la consulta más lenta
+    datos = cargar_en_paralelo(
+        tarifas=(get_tarifas, OWNER),
+        jornadas=(get_resumen_jornadas_df, OWNER, mes_ini, mes_fin),
+        insumos=(get_resumen_insumos_df, OWNER, mes_ini, mes_fin),
+        cierres=(listar_cierres, OWNER),
+    )
+    pago_dia, pago_hex = datos["tarifas"]
     st.info(f"Rango: {mes_ini} → {mes_fin} | Tarifas: Día ₡{pago_dia:,.0f} • Hora extra ₡{pago_hex:,.0f}")
 
-    jornadas = get_jornadas_between(mes_ini, mes_fin, OWNER)
-    insumos  = get_insumos_between(mes_ini, mes_fin, OWNER)
+    # por qué: el preview suma los resúmenes diarios (jornadas_dia / insumos_dia), no cada registro del mes
+    jornadas = datos["jornadas"]
+    insumos  = datos["insumos"]
 
     with st.expander("👷 Nómina del mes (preview)"):
-        if jornadas:
-            dfj = pd.DataFrame(jornadas, columns=["ID","Trabajador","Fecha","Lote","Actividad","Días","Horas Normales","Horas Extra"])
-            dfj["Días"] = pd.to_numeric(dfj["Días"], errors="coerce").fillna(0).astype(int)
-            dfj["Horas Extra"] = pd.to_numeric(dfj["Horas Extra"], errors="coerce").fillna(0.0)
-            resumen = dfj.groupby("Trabajador", as_index=False)[["Días","Horas Extra"]].sum()
-            resumen["Pago por Días"]    = resumen["Días"] * pago_dia
-            resumen["Pago Horas Extra"] = resumen["Horas Extra"] * pago_hex
-            resumen["Total"]            = resumen["Pago por Días"] + resumen["Pago Horas Extra"]
-            st.dataframe(resumen.style.format({
-                "Días":"{:,.0f}","Horas Extra":"{:,.1f}",
-                "Pago por Días":"₡{:,.0f}","Pago Horas Extra":"₡{:,.0f}","Total":"₡{:,.0f}"
-            }), use_container_width=True)
+        if not jornadas.empty:
+            with prof.seccion("dataframe nómina"):
+                resumen = rep.resumen_nomina_mes(jornadas, pago_dia, pago_hex)
+            with prof.seccion("styler nómina"):
+                st.dataframe(resumen.style.format({
+                    "Días":"{:,.0f}","Horas Extra":"{:,.1f}",
+                    "Pago por Días":"₡{:,.0f}","Pago Horas Extra":"₡{:,.0f}","Total":"₡{:,.0f}"
+                }), use_container_width=True)
         else:
             st.info("No hay jornadas en ese mes.")
 
     with st.expander("🧪 Insumos del mes (preview)"):
-        if insumos:
-            dfi = pd.DataFrame(insumos, columns=["ID","Fecha","Lote","Tipo","Etapa","Producto","Dosis","Cantidad","Precio Unitario","Costo Total"])
-            st.dataframe(dfi.style.format({"Precio Unitario":"₡{:,.0f}","Costo Total":"₡{:,.0f}"}), use_container_width=True)
+        if not insumos.empty:
+            st.dataframe(insumos.style.format({"Registros":"{:,.0f}","Costo Total":"₡{:,.0f}"}),
+                         use_container_width=True, hide_index=True)
+            st.write(f"- **Total insumos (₡):** {insumos['Costo Total'].sum():,.0f}")
+            if st.checkbox("Ver cada insumo del mes", key="cierre_insumos_detalle"):
+                detalle = get_insumos_df(OWNER, mes_ini, mes_fin)
+                dfi = detalle.assign(Fecha=detalle["Fecha"].dt.strftime("%Y-%m-%d"))
+                st.dataframe(dfi.style.format({"Precio Unitario":"₡{:,.0f}","Costo Total":"₡{:,.0f}"}), use_container_width=True)
         else:
             st.info("No hay insumos en ese mes.")
 
@@ -855,7 +940,7 @@ if menu == "Cierre Mensual":
             st.error(str(e))
 
     st.markdown("### 📚 Cierres guardados")
-    cierres = listar_cierres(OWNER)
+    cierres = datos["cierres"]
     if cierres:
         dfc = pd.DataFrame(cierres, columns=["ID","Mes inicio","Mes fin","Creado por","Creado el","Total nómina","Total insumos","Total general"])
         st.dataframe(dfc.style.format({"Total nómina":"₡{:,.0f}","Total insumos":"₡{:,.0f}","Total general":"₡{:,.0f}"}), use_container_width=True)
@@ -893,14 +978,15 @@ if menu == "Registrar Jornada":
     if NO_HAY_FIN or not FINCAS:
         st.warning("⚠️ No hay fincas registradas. Ve a **Añadir Finca** para crear al menos una.")
         st.stop() 
-    trabajadores_disponibles = get_all_trabajadores(OWNER)
+    nombres_trab = dict(get_trabajadores(OWNER))  # id -> "Nombre Apellido"
+    trabajadores_disponibles = list(nombres_trab)
     if not trabajadores_disponibles:
         st.warning("⚠️ No hay trabajadores registrados. Agrega uno primero.")
         st.stop() 
     else:
         # ---- Formulario de alta ----
         with st.form("form_jornada"):
-            trabajador = st.selectbox("Selecciona un trabajador", trabajadores_disponibles)
+            trabajador = st.selectbox("Selecciona un trabajador", trabajadores_disponibles, format_func=nombres_trab.get)
             fecha = st.date_input("Fecha de trabajo", datetime.date.today())
             lote = st.selectbox("Lote o parcela", FINCAS)
             actividad = st.selectbox("Tipo de actividad", ACTIVIDADES)
@@ -928,29 +1014,21 @@ if menu == "Registrar Jornada":
             ultima_jornada = get_last_jornada_by_date(fecha=str(fecha), owner=OWNER)
 
             if ultima_jornada:
-                # Soporta 8 u 9 columnas (según si tu tabla ya tiene 'owner')
-                if len(ultima_jornada) == 9:
-                    (
-                        jornada_id, _owner, trabajador_actual, fecha_actual,
-                        lote_actual, actividad_actual, dias_actual,
-                        horas_normales_actual, horas_extra_actual
-                    ) = ultima_jornada
-                elif len(ultima_jornada) == 8:
-                    (
-                        jornada_id, trabajador_actual, fecha_actual,
-                        lote_actual, actividad_actual, dias_actual,
-                        horas_normales_actual, horas_extra_actual
-                    ) = ultima_jornada
-                else:
-                    st.error(f"Formato inesperado de jornada (campos={len(ultima_jornada)}).")
-                    st.stop()
+                jornada_id = ultima_jornada.id
+                trabajador_actual = ultima_jornada.trabajador
+                fecha_actual = ultima_jornada.fecha
+                lote_actual = ultima_jornada.lote
+                actividad_actual = ultima_jornada.actividad
+                dias_actual = ultima_jornada.dias
+                horas_extra_actual = ultima_jornada.horas_extra
 
                 # Trabajador
                 try:
-                    idx_trab = trabajadores_disponibles.index(trabajador_actual)
+                    idx_trab = list(nombres_trab.values()).index(trabajador_actual)
                 except ValueError:
                     idx_trab = 0
-                nuevo_trabajador = st.selectbox("Nuevo trabajador", trabajadores_disponibles, index=idx_trab)
+                nuevo_trabajador = st.selectbox("Nuevo trabajador", trabajadores_disponibles, index=idx_trab,
+                                                format_func=nombres_trab.get)
 
                 # Fecha segura (sin 'format' para compatibilidad)
                 try:
@@ -1059,7 +1137,7 @@ if menu == "Registrar Abono":
             nueva_cant = st.number_input("Nueva cantidad (sacos)", value=float(cant_act or 0), min_value=0.0, step=0.5)
             nuevo_precio = st.number_input("Nuevo precio por saco (₡)", value=float(precio_act or 0), min_value=0.0, step=100.0)
             if st.button("Actualizar abono"):
-                update_abono(iid, nueva_fecha.strftime("%Y-%m-%d"), nuevo_lote, nueva_etapa, nuevo_prod, nueva_dosis, nueva_cant, nuevo_precio, OWNER)
+                update_insumo(iid, "Abono", nueva_fecha.strftime("%Y-%m-%d"), nuevo_lote, nueva_etapa, nuevo_prod, nueva_dosis, nueva_cant, nuevo_precio, OWNER)
                 st.success("✅ Abono actualizado"); st.rerun()
         else:
             st.info("No hay registros de abono para editar.")
@@ -1067,31 +1145,30 @@ if menu == "Registrar Abono":
 # ===== Ver Registros =====
 if menu == "Ver Registros":
     st.subheader("📊 Registros de Jornadas e Insumos")
-    pago_dia, pago_hex = get_tarifas(OWNER)
+    tipos = {"Abono":"🌿 Ver Abonos","Fumigación":"🧪 Ver Fumigaciones","Cal":"🧱 Ver Cal","Herbicida":"🌾 Ver Herbicidas"}
+    datos = cargar_en_paralelo(
+        tarifas=(get_tarifas, OWNER),
+        jornadas=(get_jornadas_df, OWNER),
+        por_trabajador=(get_resumen_jornadas_df, OWNER),
+        **{f"insumos_{t}": (get_insumos_df, OWNER, None, None, t) for t in tipos},
+    )
+    pago_dia, pago_hex = datos["tarifas"]
     st.info(f"Tarifas actuales → Día (6h): ₡{pago_dia:,.0f} | Hora extra: ₡{pago_hex:,.0f}")
 
     with st.expander("📋 Ver Jornadas Registradas"):
-        jornadas = get_all_jornadas(OWNER)
-        if jornadas:
-            df_j = pd.DataFrame(jornadas, columns=["ID","Trabajador","Fecha","Lote","Actividad","Días","Horas Normales","Horas Extra"])
-            try: df_j["Fecha"] = pd.to_datetime(df_j["Fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
-            except Exception: pass
-            df_j["Días"] = pd.to_numeric(df_j["Días"], errors="coerce").fillna(0).astype(int)
-            df_j["Horas Extra"] = pd.to_numeric(df_j["Horas Extra"], errors="coerce").fillna(0.0)
-
-            resumen = df_j.groupby("Trabajador", as_index=False).agg({"Días":"sum","Horas Extra":"sum"})
-            resumen = resumen.rename(columns={"Días":"Días trabajados"})
-            resumen["Días a pagar"] = resumen["Días trabajados"]
-            resumen["Pago por Días"] = resumen["Días a pagar"] * pago_dia
-            resumen["Pago Horas Extra"] = resumen["Horas Extra"] * pago_hex
-            resumen["Total Ganado"] = resumen["Pago por Días"] + resumen["Pago Horas Extra"]
+        df_j = datos["jornadas"]
+        if not df_j.empty:
+            with prof.seccion("dataframe jornadas"):
+                resumen = rep.resumen_por_trabajador(datos["por_trabajador"], pago_dia, pago_hex, "Total Ganado")
+                df_j["Fecha"] = df_j["Fecha"].dt.strftime("%Y-%m-%d")
 
             st.markdown("### 👥 Resumen por Trabajador")
             cols = ["Trabajador","Días trabajados","Días a pagar","Horas Extra","Pago por Días","Pago Horas Extra","Total Ganado"]
-            st.dataframe(resumen[cols].style.format({
-                "Días trabajados":"{:,.0f}","Días a pagar":"{:,.0f}","Horas Extra":"{:,.1f}",
-                "Pago por Días":"₡{:,.0f}","Pago Horas Extra":"₡{:,.0f}","Total Ganado":"₡{:,.0f}"
-            }), use_container_width=True)
+            with prof.seccion("styler jornadas"):
+                st.dataframe(resumen[cols].style.format({
+                    "Días trabajados":"{:,.0f}","Días a pagar":"{:,.0f}","Horas Extra":"{:,.1f}",
+                    "Pago por Días":"₡{:,.0f}","Pago Horas Extra":"₡{:,.0f}","Total Ganado":"₡{:,.0f}"
+                }), use_container_width=True)
 
             st.markdown("### 🧾 Detalle de Jornadas")
             st.dataframe(df_j[["Fecha","Trabajador","Lote","Actividad","Días","Horas Extra"]], use_container_width=True)
@@ -1099,42 +1176,115 @@ if menu == "Ver Registros":
             st.info("No hay jornadas registradas aún.")
 
     # Insumos por tipo
-    tipos = {"Abono":"🌿 Ver Abonos","Fumigación":"🧪 Ver Fumigaciones","Cal":"🧱 Ver Cal","Herbicida":"🌾 Ver Herbicidas"}
     for tipo, titulo in tipos.items():
         with st.expander(titulo):
-            conn = connect_db(); cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT id, fecha, lote, tipo, etapa, producto, dosis, cantidad, precio_unitario, costo_total
-                FROM insumos
-                WHERE owner=%s AND tipo=%s
-                ORDER BY fecha DESC, id DESC;
-                """,
-                (OWNER, tipo),
-            )
-            regs = cur.fetchall(); conn.close()
-            if regs:
-                df_i = pd.DataFrame(regs, columns=["ID","Fecha","Lote","Tipo","Etapa","Producto","Dosis","Cantidad","Precio Unitario","Costo Total"])
-                try: df_i["Fecha"] = pd.to_datetime(df_i["Fecha"], errors="coerce").dt.strftime("%Y-%m-%d")
-                except Exception: pass
-                if tipo == "Fumigación":
-                    df_i = df_i.rename(columns={"Etapa":"Plaga/Control","Cantidad":"Litros","Precio Unitario":"Precio por litro (₡)"})
-                elif tipo == "Herbicida":
-                    df_i = df_i.rename(columns={"Etapa":"Tipo de herbicida","Cantidad":"Litros","Precio Unitario":"Precio por litro (₡)"})
-                elif tipo == "Cal":
-                    df_i = df_i.rename(columns={"Etapa":"Tipo de cal","Producto":"Presentación","Cantidad":"Sacos (45 kg)","Precio Unitario":"Precio por saco (₡)"})
-                elif tipo == "Abono":
-                    df_i = df_i.rename(columns={"Etapa":"Etapa de abonado","Dosis":"Dosis (g/planta)","Cantidad":"Sacos","Precio Unitario":"Precio por saco (₡)"})
-                for col in ["Litros","Sacos (45 kg)","Sacos","Cantidad","Dosis","Dosis (g/planta)","Precio por litro (₡)","Precio por saco (₡)","Precio Unitario","Costo Total"]:
-                    if col in df_i.columns: df_i[col] = pd.to_numeric(df_i[col], errors="coerce")
-                money = [c for c in ["Precio por litro (₡)","Precio por saco (₡)","Precio Unitario","Costo Total"] if c in df_i.columns]
-                qty   = [c for c in ["Litros","Sacos (45 kg)","Sacos","Cantidad"] if c in df_i.columns]
-                dose  = [c for c in ["Dosis","Dosis (g/planta)"] if c in df_i.columns]
-                fmt = {}; fmt.update({c:"₡{:,.0f}" for c in money}); fmt.update({c:"{:,.1f}" for c in qty}); fmt.update({c:"{:,.0f}" for c in dose})
-                st.dataframe(df_i.style.format(fmt), use_container_width=True)
+            regs = datos[f"insumos_{tipo}"]
+            if not regs.empty:
+                df_i, fmt = rep.df_insumos_tipo(regs, tipo)
+                with prof.seccion(f"styler {tipo.lower()}"):
+                    st.dataframe(df_i.style.format(fmt), use_container_width=True)
             else:
                 st.info(f"No hay insumos de {tipo.lower()}.")
 
+# ===== Editar Registros =====
+if menu == "Editar Registros":
+    st.subheader("✏️ Editar Registros")
+    st.caption("Edita celdas o borra filas en la grilla y guarda todo junto. Los registros nuevos se agregan desde los formularios.")
+    tabla = st.radio("Registros", ["Jornadas", "Insumos"], horizontal=True, key="editor_tabla")
+    c1, c2 = st.columns(2)
+    with c1:
+        desde = st.date_input("Desde", datetime.date.today().replace(day=1), key="editor_desde")
+    with c2:
+        hasta = st.date_input("Hasta", datetime.date.today(), key="editor_hasta")
+
+    if desde > hasta:
+        st.warning("⚠️ 'Desde' no puede ser posterior a 'Hasta'.")
+    else:
+        FINCAS, NO_HAY_FIN = opciones_fincas()
+        if tabla == "Jornadas":
+            original = get_jornadas_df(OWNER, desde, hasta)
+            opciones = {"Trabajador": [n for _, n in get_trabajadores(OWNER)], "Lote": FINCAS}
+            guardar = guardar_jornadas_editadas
+        else:
+            original = get_insumos_df(OWNER, desde, hasta)
+            opciones = {"Lote": FINCAS, "Tipo": ["Abono", "Fumigación", "Cal", "Herbicida"]}
+            guardar = guardar_insumos_editados
+        # por qué: una columna category no acepta valores fuera de sus categorías al editar
+        original = original.astype({c: object for c in original.select_dtypes("category").columns})
+
+        if original.empty:
+            st.info("No hay registros en ese rango.")
+        else:
+            config = {"Fecha": st.column_config.DateColumn("Fecha", format="YYYY-MM-DD")}
+            for col, valores in opciones.items():
+                # los valores ya guardados siguen siendo elegibles aunque el catálogo haya cambiado
+                valores = sorted(set(valores) | set(original[col].dropna()))
+                config[col] = st.column_config.SelectboxColumn(col, options=valores, required=True)
+            if tabla == "Insumos":
+                config["Costo Total"] = st.column_config.NumberColumn("Costo Total", disabled=True,
+                                                                      help="Se recalcula al guardar.")
+            editado = st.data_editor(original, key=f"editor_{tabla}_{desde}_{hasta}", num_rows="dynamic",
+                                     disabled=["ID"], hide_index=True, column_config=config,
+                                     use_container_width=True)
+
+            cambiadas, borrados = rep.cambios_editor(original, editado)
+            nuevas = int(editado["ID"].isna().sum())
+            st.caption(f"{len(cambiadas)} fila(s) modificada(s) · {len(borrados)} para borrar")
+            if nuevas:
+                # cambios_editor no las envía: guardar ahora las perdería sin aviso
+                st.warning(f"⚠️ {nuevas} fila(s) nueva(s) en la grilla: aquí no se agregan registros. "
+                           "Quítalas y regístralas desde su formulario para poder guardar.")
+            if st.button("💾 Guardar cambios", disabled=bool(nuevas) or (cambiadas.empty and not borrados)):
+                try:
+                    res = guardar(OWNER, rep.filas_para_guardar(cambiadas), borrados, desde, hasta)
+                    st.success(f"✅ {res[0]} registro(s) actualizado(s), {res[1]} borrado(s).")
+                    st.rerun()
+                except (DBConnectionError, DBUnavailable):
+                    # no se encola: reenviada después podría pisar ediciones de otra sesión
+                    st.warning("📡 Sin conexión: los cambios no se guardaron. Siguen en la grilla; vuelve a guardar cuando haya red.")
+                except Exception as e:
+                    st.error(f"No se pudieron guardar los cambios: {e}")
+
+        with st.expander("🔁 Correcciones en bloque (insumos)"):
+            st.caption("Se aplican a todos los insumos del rango de arriba que cumplan los filtros, en una sola operación.")
+            operacion = st.radio("Operación", ["Cambiar precio", "Mover de lote", "Cambiar etapa"],
+                                 horizontal=True, key="corr_op")
+            tipo_c = st.selectbox("Tipo", ["(todos)", "Abono", "Fumigación", "Cal", "Herbicida"], key="corr_tipo")
+            tipo_c = None if tipo_c == "(todos)" else tipo_c
+            if operacion == "Cambiar precio":
+                producto_c = st.text_input("Producto", key="corr_producto")
+                precio_c = st.number_input("Nuevo precio unitario", min_value=0.0, step=100.0, key="corr_precio")
+                corregir = lambda dry: repreciar_insumos(OWNER, producto_c.strip(), precio_c, desde, hasta,
+                                                         tipo=tipo_c, dry_run=dry)
+                listo = bool(producto_c.strip())
+            elif operacion == "Mover de lote":
+                origen_c = st.selectbox("Desde el lote", FINCAS, key="corr_origen")
+                destino_c = st.selectbox("Al lote", FINCAS, key="corr_destino")
+                corregir = lambda dry: mover_insumos_de_lote(OWNER, origen_c, destino_c, desde, hasta,
+                                                             tipo=tipo_c, dry_run=dry)
+                listo = bool(origen_c) and origen_c != destino_c
+            else:
+                etapa_actual = st.text_input("Etapa actual (vacío = cualquiera)", key="corr_etapa_actual")
+                etapa_nueva = st.text_input("Nueva etapa", key="corr_etapa_nueva")
+                corregir = lambda dry: reasignar_etapa_insumos(OWNER, etapa_nueva.strip(), desde, hasta, tipo=tipo_c,
+                                                               etapa=etapa_actual.strip() or None, dry_run=dry)
+                listo = bool(etapa_nueva.strip())
+
+            b1, b2 = st.columns(2)
+            with b1:
+                if st.button("👁️ Vista previa", disabled=not listo, key="corr_preview"):
+                    try:
+                        st.info(f"Se modificarían {corregir(True)} registro(s).")
+                    except Exception as e:
+                        st.error(f"No se pudo calcular la vista previa: {e}")
+            with b2:
+                confirmar_c = st.checkbox("Confirmo la corrección", key="corr_confirmar")
+                if st.button("✅ Aplicar", disabled=not (listo and confirmar_c), key="corr_aplicar"):
+                    try:
+                        st.success(f"✅ {corregir(False)} registro(s) modificado(s).")
+                    except Exception as e:
+                        st.error(f"No se pudo aplicar la corrección: {e}")
+
 # ===== Registrar Fumigación =====
 if menu == "Registrar Fumigación":
     st.subheader("🧪 Registrar Fumigación")
@@ -1174,7 +1324,7 @@ if menu == "Registrar Fumigación":
             except Exception:
                 fec_str = str(datetime.date.today())
             if st.button("Actualizar fumigación"):
-                update_fumigacion(iid, fec_str, nuevo_lote, nueva_plaga, nuevo_prod, nueva_dosis, nuevos_litros, nuevo_precio, OWNER)
+                update_insumo(iid, "Fumigación", fec_str, nuevo_lote, nueva_plaga, nuevo_prod, nueva_dosis, nuevos_litros, nuevo_precio, OWNER)
                 st.success("✅ Fumigación actualizada"); st.rerun()
         else:
             st.info("No hay registros de fumigación para editar.")
@@ -1215,7 +1365,7 @@ if menu == "Registrar Cal":
             except Exception:
                 fec_str = str(datetime.date.today())
             if st.button("Actualizar cal"):
-                update_cal(iid, fec_str, nuevo_lote, nuevo_tipo, "Saco 45 kg", "", nueva_cant, nuevo_precio, OWNER)
+                update_insumo(iid, "Cal", fec_str, nuevo_lote, nuevo_tipo, "Saco 45 kg", "", nueva_cant, nuevo_precio, OWNER)
                 st.success("✅ Cal actualizada"); st.rerun()
         else:
             st.info("No hay registros de cal para editar.")
@@ -1260,7 +1410,7 @@ if menu == "Registrar Herbicida":
             except Exception:
                 fec_str = str(datetime.date.today())
             if st.button("Actualizar herbicida"):
-                update_herbicida(iid, fec_str, nuevo_lote, nuevo_tipo, nuevo_prod, nueva_dos, nueva_cant, nuevo_pre, OWNER)
+                update_insumo(iid, "Herbicida", fec_str, nuevo_lote, nuevo_tipo, nuevo_prod, nueva_dos, nueva_cant, nuevo_pre, OWNER)
                 st.success("✅ Herbicida actualizado"); st.rerun()
         else:
             st.info("No hay registros de herbicida para editar.")
@@ -1280,119 +1430,173 @@ if menu == "Reporte Semanal (Dom–Sáb)":
     inicio_sem, fin_sem = rango_semana_dom_sab(fecha_ref)
     st.info(f"📅 Semana: **{inicio_sem}** a **{fin_sem}** (Dom–Sáb)")
 
-    pago_dia, pago_hex = get_tarifas(OWNER)
+    # el resumen y los totales salen de jornadas_dia; el detalle sí lee cada jornada de la semana
+    with prof.seccion("dataframe semana"):
+        datos = cargar_en_paralelo(
+            tarifas=(get_tarifas, OWNER),
+            resumen=(get_resumen_jornadas_df, OWNER, inicio_sem, fin_sem),
+            detalle=(get_jornadas_df, OWNER, inicio_sem, fin_sem),
+        )
+    pago_dia, pago_hex = datos["tarifas"]
     st.info(f"Tarifas → Día (6h): ₡{pago_dia:,.0f} | Hora extra: ₡{pago_hex:,.0f}")
 
-    jornadas = get_all_jornadas(OWNER)
-    if not jornadas:
-        st.info("No hay jornadas registradas aún.")
+    df_sem = datos["detalle"]
+    if df_sem.empty:
+        st.info("No hay jornadas en la semana seleccionada.")
     else:
-        df = pd.DataFrame(jornadas, columns=["ID","Trabajador","Fecha","Lote","Actividad","Días","Horas Normales","Horas Extra"])
-        df["Fecha"] = pd.to_datetime(df["Fecha"], errors="coerce")
-        df["Horas Extra"] = pd.to_numeric(df["Horas Extra"], errors="coerce").fillna(0.0)
-        df["Días"] = pd.to_numeric(df["Días"], errors="coerce").fillna(0).astype(int)
-
-        mask = (df["Fecha"].dt.date >= inicio_sem) & (df["Fecha"].dt.date <= fin_sem)
-        df_sem = df.loc[mask].copy()
-        if df_sem.empty:
-            st.info("No hay jornadas en la semana seleccionada.")
-        else:
-            resumen = df_sem.groupby("Trabajador", as_index=False).agg({"Días":"sum","Horas Extra":"sum"})
-            resumen = resumen.rename(columns={"Días":"Días trabajados"})
-            resumen["Días a pagar"] = resumen["Días trabajados"]
-            resumen["Pago por Días"] = resumen["Días a pagar"] * pago_dia
-            resumen["Pago Horas Extra"] = resumen["Horas Extra"] * pago_hex
-            resumen["Total a Pagar"] = resumen["Pago por Días"] + resumen["Pago Horas Extra"]
-
-            st.markdown("### 📋 Jornadas de la semana (detalle)")
-            df_sem_orden = df_sem.sort_values(["Trabajador","Fecha"]).copy()
-            df_detalle = df_sem_orden[["Fecha","Trabajador","Lote","Actividad","Días","Horas Extra"]].copy()
-            df_detalle.rename(columns={"Días":"Días trabajados"}, inplace=True)
-            df_detalle["Fecha"] = df_detalle["Fecha"].dt.strftime("%Y-%m-%d")
-            df_detalle["Días a pagar"] = df_detalle["Días trabajados"]
-            st.dataframe(df_detalle, use_container_width=True)
-
-            st.markdown("### 👥 Resumen por trabajador")
-            cols = ["Trabajador","Días trabajados","Días a pagar","Horas Extra","Pago por Días","Pago Horas Extra","Total a Pagar"]
+        resumen = rep.resumen_por_trabajador(datos["resumen"], pago_dia, pago_hex, "Total a Pagar")
+
+        st.markdown("### 📋 Jornadas de la semana (detalle)")
+        df_detalle = rep.detalle_semana(df_sem)
+        st.dataframe(df_detalle, use_container_width=True)
+
+        st.markdown("### 👥 Resumen por trabajador")
+        cols = ["Trabajador","Días trabajados","Días a pagar","Horas Extra","Pago por Días","Pago Horas Extra","Total a Pagar"]
+        with prof.seccion("styler semana"):
             st.dataframe(resumen[cols].style.format({
                 "Días trabajados":"{:,.0f}","Días a pagar":"{:,.0f}","Horas Extra":"{:,.1f}",
                 "Pago por Días":"₡{:,.0f}","Pago Horas Extra":"₡{:,.0f}","Total a Pagar":"₡{:,.0f}"
             }), use_container_width=True)
 
-            total_dias = resumen["Pago por Días"].sum()
-            total_extras = resumen["Pago Horas Extra"].sum()
-            total_semana = resumen["Total a Pagar"].sum()
-            st.markdown("### 🧮 Totales de la semana")
-            st.write(f"- **Pago por días (₡):** {total_dias:,.0f}")
-            st.write(f"- **Pago por horas extra (₡):** {total_extras:,.0f}")
-            st.write(f"- **Total a pagar (₡):** {total_semana:,.0f}")
-
-            # Descargas
-            csv_res = resumen[cols].to_csv(index=False).encode("utf-8-sig")
-            st.download_button("⬇️ Descargar resumen semanal (CSV)", data=csv_res,
-                               file_name=f"reporte_semanal_{inicio_sem}_a_{fin_sem}.csv", mime="text/csv")
-
-            df_detalle["Pago por Días (₡)"] = (df_detalle["Días a pagar"] * pago_dia).round(2)
-            df_detalle["Pago Horas Extra (₡)"] = (df_detalle["Horas Extra"] * pago_hex).round(2)
-            df_detalle["Total Fila (₡)"] = df_detalle["Pago por Días (₡)"] + df_detalle["Pago Horas Extra (₡)"]
-            csv_det = df_detalle.to_csv(index=False).encode("utf-8-sig")
-            st.download_button("⬇️ Descargar detalle semanal (CSV)", data=csv_det,
-                               file_name=f"reporte_semanal_detalle_{inicio_sem}_a_{fin_sem}.csv", mime="text/csv")
-
-            # PDF
-            resumen_min = resumen[["Trabajador","Días a pagar","Horas Extra","Total a Pagar"]].copy()
-            def pdf_resumen(res_df, ini, fin):
-                buffer = BytesIO(); c = canvas.Canvas(buffer, pagesize=letter)
-                width, height = letter
-                c.setFont("Helvetica-Bold", 14); c.drawString(50, height-50, "Resumen por trabajador")
-                c.setFont("Helvetica", 11); c.drawString(50, height-70, f"Semana: {ini} a {fin} (Dom–Sáb)")
-                y = height-110; c.setFont("Helvetica-Bold", 11)
-                c.drawString(50,y,"Trabajador"); c.drawString(250,y,"Días a pagar"); c.drawString(360,y,"Horas Extra"); c.drawString(460,y,"Total (₡)")
-                c.line(50,y-3,560,y-3); y -= 20; c.setFont("Helvetica",10)
-                for _, row in res_df.iterrows():
-                    nombre = str(row["Trabajador"]); nombre = (nombre[:34]+"…") if len(nombre)>35 else nombre
-                    c.drawString(50,y,nombre)
-                    c.drawRightString(330,y,f"{row['Días a pagar']:.0f}")
-                    c.drawRightString(430,y,f"{row['Horas Extra']:.1f}")
-                    c.drawRightString(560,y,f"{row['Total a Pagar']:,.0f}")
-                    y -= 18
-                    if y < 60:
-                        c.showPage(); y = height-50; c.setFont("Helvetica-Bold", 11)
-                        c.drawString(50,y,"Trabajador"); c.drawString(250,y,"Días a pagar"); c.drawString(360,y,"Horas Extra"); c.drawString(460,y,"Total (₡)")
-                        c.line(50,y-3,560,y-3); y -= 20; c.setFont("Helvetica",10)
-                c.save(); pdf = buffer.getvalue(); buffer.close(); return pdf
-            pdf_bytes = pdf_resumen(resumen_min, inicio_sem, fin_sem)
-            st.download_button("⬇️ Descargar resumen por trabajador (PDF)", data=pdf_bytes,
-                               file_name=f"resumen_trabajador_{inicio_sem}_a_{fin_sem}.pdf", mime="application/pdf")
-
-            
-    
-
-
-
-                 
-        
-    
-        
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        total_dias = resumen["Pago por Días"].sum()
+        total_extras = resumen["Pago Horas Extra"].sum()
+        total_semana = resumen["Total a Pagar"].sum()
+        st.markdown("### 🧮 Totales de la semana")
+        st.write(f"- **Pago por días (₡):** {total_dias:,.0f}")
+        st.write(f"- **Pago por horas extra (₡):** {total_extras:,.0f}")
+        st.write(f"- **Total a pagar (₡):** {total_semana:,.0f}")
+
+        # Descargas
+        csv_res = resumen[cols].to_csv(index=False).encode("utf-8-sig")
+        st.download_button("⬇️ Descargar resumen semanal (CSV)", data=csv_res,
+                           file_name=f"reporte_semanal_{inicio_sem}_a_{fin_sem}.csv", mime="text/csv")
+
+        csv_det = rep.detalle_semana_con_pagos(df_detalle, pago_dia, pago_hex).to_csv(index=False).encode("utf-8-sig")
+        st.download_button("⬇️ Descargar detalle semanal (CSV)", data=csv_det,
+                           file_name=f"reporte_semanal_detalle_{inicio_sem}_a_{fin_sem}.csv", mime="text/csv")
+
+        # PDF
+        resumen_min = resumen[["Trabajador","Días a pagar","Horas Extra","Total a Pagar"]].copy()
+        with prof.seccion("pdf semana"):
+            pdf_bytes = rep.pdf_resumen(resumen_min, inicio_sem, fin_sem)
+        st.download_button("⬇️ Descargar resumen por trabajador (PDF)", data=pdf_bytes,
+                           file_name=f"resumen_trabajador_{inicio_sem}_a_{fin_sem}.pdf", mime="application/pdf")
+
+# ===== Costos por Lote =====
+if menu == "Costos por Lote":
+    st.subheader("📈 Costos por Lote")
+    hoy = datetime.date.today()
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        desde = st.date_input("Desde (mes)", (hoy.replace(day=1) - datetime.timedelta(days=150)).replace(day=1), key="costos_desde")
+    with c2:
+        hasta = st.date_input("Hasta (mes)", hoy, key="costos_hasta")
+    with c3:
+        por = st.radio("Mostrar", ["Total", "Por hectárea", "Por planta"], key="costos_por")
+    por = {"Por hectárea": "Hectáreas", "Por planta": "Plantas"}.get(por)
+
+    # por qué: la página sólo lee la vista materializada; el REFRESH (todos los tenants) lo hace costos.py en cron
+    datos = cargar_en_paralelo(
+        tarifas=(get_tarifas, OWNER),
+        costos=(get_costos_lote_df, OWNER, desde.replace(day=1), hasta),
+        refrescada=(get_costos_refresco,),
+    )
+    pago_dia, pago_hex = datos["tarifas"]
+    costos = datos["costos"]
+    refrescada = datos["refrescada"]
+    if refrescada:
+        edad = datetime.datetime.now(refrescada.tzinfo) - refrescada
+        st.caption(f"Costos calculados el {refrescada.astimezone():%Y-%m-%d %H:%M}.")
+        if edad.total_seconds() > DB_COSTOS_MAX_SEG:
+            st.warning(f"Los costos tienen {edad.total_seconds() / 3600:.1f} h sin recalcularse: "
+                       "revisa que `python costos.py` esté corriendo en cron.")
+    if costos.empty:
+        st.info("No hay jornadas ni insumos en ese rango.")
+    else:
+        tabla = rep.costos_por_lote(costos, pago_dia, pago_hex, por)
+        if tabla.empty:
+            st.info("Ningún lote tiene cargada esa área. Agrégala en **Añadir Finca**.")
+        else:
+            if por and tabla["Lote"].nunique() < costos["Lote"].nunique():
+                st.caption("Los lotes sin área cargada no se muestran.")
+            montos = [c for c in tabla.columns if c not in ("Mes", "Lote")]
+            st.markdown("### 🧮 Por lote y mes")
+            st.dataframe(tabla.style.format({c: "₡{:,.0f}" for c in montos}), use_container_width=True, hide_index=True)
+            st.markdown("### 🌱 Total del período por lote")
+            st.bar_chart(tabla.groupby("Lote")[[c for c in montos if c != "Total"]].sum())
+            st.caption("Mano de obra de los meses cerrados con las tarifas de su cierre; la de los abiertos con las "
+                       f"tarifas actuales: Día ₡{pago_dia:,.0f} • Hora extra ₡{pago_hex:,.0f}")
+
+# ===== Diagnóstico (solo admin) =====
+if menu == "Diagnóstico":
+    if not IS_ADMIN:
+        st.error("Esta sección es solo para administradores.")
+        st.stop()
+    st.subheader("🩺 Diagnóstico de base de datos")
+    st.caption("Métricas en memoria de este proceso (todas las sesiones). Se reinician al reiniciar la app.")
+    metricas = get_db_metrics()
+
+    st.markdown("### ⏱️ Latencia por función")
+    if metricas["funciones"]:
+        dfm = pd.DataFrame(metricas["funciones"]).drop(columns=["histograma"])
+        dfm = dfm.sort_values("p95_ms", ascending=False)
+        st.dataframe(dfm.style.format({
+            "p50_ms":"{:,.1f}","p95_ms":"{:,.1f}","p99_ms":"{:,.1f}","filas":"{:,.0f}","bytes":"{:,.0f}"
+        }), use_container_width=True)
+
+        limites = metricas["histograma_limites_ms"]
+        etiquetas = [f"≤{b} ms" for b in limites] + [f">{limites[-1]} ms"]
+        dfh = pd.DataFrame({f["funcion"]: f["histograma"] for f in metricas["funciones"]}, index=etiquetas)
+        with st.expander("📊 Histograma (todas las llamadas desde el arranque)"):
+            st.dataframe(dfh.T, use_container_width=True)
+    else:
+        st.info("Aún no hay llamadas registradas.")
 
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("### 🔌 Pool de conexiones")
+        st.write(f"Cupos libres: **{metricas['pool_cupos_libres']}**")
+        if metricas["pool"]:
+            st.dataframe(pd.DataFrame(metricas["pool"]), use_container_width=True)
+    with c2:
+        st.markdown("### 🧠 Caché")
+        cache = metricas["cache"]
+        tasa = cache["prepared_hit_rate"]
+        st.write(f"Sentencias preparadas: **{cache['prepared_hit']:,}** aciertos / **{cache['prepared_miss']:,}** PREPARE")
+        st.write(f"Tasa de acierto: **{tasa:.1%}**" if tasa is not None else "Tasa de acierto: —")
+
+    with st.expander("🕒 Últimas llamadas"):
+        if metricas["recientes"]:
+            dfr = pd.DataFrame(metricas["recientes"][::-1])
+            dfr["ts"] = pd.to_datetime(dfr["ts"], unit="s")
+            st.dataframe(dfr, use_container_width=True)
+
+    st.markdown("### 🐢 Consultas lentas")
+    lentas = get_slow_queries()
+    st.caption(f"Sentencias de más de {DB_SLOW_MS:,.0f} ms (DB_SLOW_MS). Parámetros de texto redactados; "
+               "las lecturas incluyen EXPLAIN (ANALYZE, BUFFERS).")
+    if lentas:
+        dfs = pd.DataFrame(lentas)[["id","ts","fn","tenant","ms","error","sql"]]
+        dfs["ts"] = pd.to_datetime(dfs["ts"], unit="s")
+        st.dataframe(dfs.style.format({"ms":"{:,.0f}"}), use_container_width=True)
+        elegida = st.selectbox("Ver detalle", range(len(lentas)),
+                               format_func=lambda i: f"{lentas[i]['fn']} — {lentas[i]['ms']:,.0f} ms — "
+                                                     f"{datetime.datetime.fromtimestamp(lentas[i]['ts']):%Y-%m-%d %H:%M:%S}")
+        q = lentas[elegida]
+        st.code(q["sql"], language="sql")
+        st.write(f"Tenant: **{q['tenant'] or '—'}** · Parámetros: `{q['params']}`")
+        st.code(q["plan"] or "(sin plan: escritura, error o plan reciente de la misma sentencia)", language="text")
+    else:
+        st.info("No hay consultas lentas registradas.")
+
+# ===== Perfil de este rerun (APP_PROFILE=1) =====
+prof.marca(f"página: {menu or 'Inicio'}")
+_perfil = prof.cerrar_rerun(menu or "Inicio")
+if _perfil:
+    with st.expander(f"⏱️ Perfil de este rerun: {_perfil['total_ms']:,.0f} ms"):
+        st.dataframe(pd.DataFrame(_perfil["secciones"]), use_container_width=True)
+        if _perfil["captura"]:
+            st.caption(f"Captura guardada en `{_perfil['captura']}`")
+        if st.button("📸 Capturar perfil completo del siguiente rerun", key="btn_perfil_capturar"):
+            st.session_state["__perfil_capturar__"] = True
+            st.rerun()
@@ -0,0 +1,130 @@
+# outbox.py — cola local y durable de escrituras hechas sin conexión (un archivo SQLite junto a la app)
+#
+# database.py encola aquí las escrituras que no pudieron salir (sin red / circuito abierto) y las
+# reenvía con database.sincronizar_outbox(). Cada entrada lleva una clave de idempotencia generada
+# en el cliente: el servidor la anota en outbox_aplicadas en la misma transacción que la escritura,
+# así que repetir un envío nunca duplica.
+# También guarda la última lectura con red de los catálogos (trabajadores, fincas, tarifas) para que
+# los formularios sigan llenándose sin conexión.
+import os
+import json
+import time
+import uuid
+import sqlite3
+import datetime
+import threading
+from decimal import Decimal
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+
+_LOCAL = threading.local()
+_INIT_LOCK = threading.Lock()
+_INICIADO = False
+_LECTURAS: dict = {}  # clave -> JSON guardado, para no reescribir lo que no cambió
+
+
+def _db():
+    global _INICIADO
+    db = getattr(_LOCAL, "db", None)
+    if db is None:
+        db = _LOCAL.db = sqlite3.connect(OUTBOX_PATH, timeout=5.0, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL;")
+        db.execute("PRAGMA synchronous=FULL;")  # una jornada encolada debe sobrevivir a un apagón
+        with _INIT_LOCK:
+            if not _INICIADO:
+                db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS pendientes (
+                      seq INTEGER PRIMARY KEY,
+                      clave TEXT NOT NULL UNIQUE,
+                      creado REAL NOT NULL,
+                      owner TEXT,
+                      funcion TEXT NOT NULL,
+                      payload TEXT NOT NULL,
+                      intentos INTEGER NOT NULL DEFAULT 0,
+                      ultimo_error TEXT
+                    );
+                    """
+                )
+                db.execute("CREATE TABLE IF NOT EXISTS lecturas (clave TEXT PRIMARY KEY, valor TEXT NOT NULL);")
+                db.commit()
+                _INICIADO = True
+    return db
+
+
+def _json_default(v):
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError(f"No se puede encolar un valor {type(v).__name__}")
+
+
+def encolar(funcion: str, owner: str | None, args: tuple, kwargs: dict) -> str:
+    """Guarda la llamada y devuelve su clave de idempotencia."""
+    clave = str(uuid.uuid4())
+    payload = json.dumps({"args": list(args), "kwargs": kwargs}, default=_json_default)
+    db = _db()
+    db.execute("INSERT INTO pendientes (clave, creado, owner, funcion, payload) VALUES (?,?,?,?,?);",
+               (clave, time.time(), owner, funcion, payload))
+    db.commit()
+    return clave
+
+
+def pendientes(owner: str | None = None, limite: int | None = None):
+    """Entradas en orden de llegada: [{clave, creado, owner, funcion, args, kwargs, intentos, ultimo_error}]."""
+    sql = "SELECT clave, creado, owner, funcion, payload, intentos, ultimo_error FROM pendientes"
+    params = ()
+    if owner is not None:
+        sql += " WHERE owner=?"
+        params = (owner,)
+    sql += " ORDER BY seq"
+    if limite:
+        sql += f" LIMIT {int(limite)}"
+    out = []
+    for clave, creado, own, funcion, payload, intentos, error in _db().execute(sql, params):
+        p = json.loads(payload)
+        out.append({"clave": clave, "creado": creado, "owner": own, "funcion": funcion,
+                    "args": p["args"], "kwargs": p["kwargs"], "intentos": intentos, "ultimo_error": error})
+    return out
+
+
+def contar(owner: str | None = None, max_intentos: int | None = None) -> int:
+    """Pendientes (de un owner, y si se pide solo las que aún se reintentan: intentos < max_intentos)."""
+    sql, params = "SELECT count(*) FROM pendientes WHERE 1=1", []
+    if owner is not None:
+        sql += " AND owner=?"
+        params.append(owner)
+    if max_intentos is not None:
+        sql += " AND intentos < ?"
+        params.append(max_intentos)
+    return _db().execute(sql, params).fetchone()[0]
+
+
+def borrar(claves):
+    db = _db()
+    db.executemany("DELETE FROM pendientes WHERE clave=?;", [(c,) for c in claves])
+    db.commit()
+
+
+def registrar_fallo(clave: str, error: str):
+    db = _db()
+    db.execute("UPDATE pendientes SET intentos = intentos + 1, ultimo_error=? WHERE clave=?;", (error[:500], clave))
+    db.commit()
+
+
+def guardar_lectura(clave: str, valor):
+    texto = json.dumps(valor, default=_json_default)
+    if _LECTURAS.get(clave) == texto:
+        return
+    db = _db()
+    db.execute("INSERT INTO lecturas (clave, valor) VALUES (?,?) ON CONFLICT (clave) DO UPDATE SET valor=excluded.valor;",
+               (clave, texto))
+    db.commit()
+    _LECTURAS[clave] = texto
+
+
+def leer_lectura(clave: str):
+    """(True, valor) si hay una copia guardada; (False, None) si no."""
+    row = _db().execute("SELECT valor FROM lecturas WHERE clave=?;", (clave,)).fetchone()
+    return (True, json.loads(row[0])) if row else (False, None)
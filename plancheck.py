@@ -0,0 +1,207 @@
+# plancheck.py — revisión de planes de consulta (EXPLAIN) de cada sentencia de database.py
+#
+# Siembra datos sintéticos con muchos owners (como bench.py), ejecuta cada helper capturando sus
+# sentencias (database.capturar_sentencias) y corre EXPLAIN (FORMAT JSON) sobre cada una con sus
+# parámetros reales. Falla (código 1) si:
+#   - hay un Seq Scan sobre jornadas / insumos / plan_labores en una sentencia filtrada por tenant_id,
+#   - el costo total estimado supera el presupuesto (--budget, o --budget-fn nombre=costo),
+#   - algún helper con @db_policy (salvo DDL) no emitió ninguna sentencia (quedó sin revisar).
+#
+# Uso:
+#   BENCH_DATABASE_URL=postgresql://... python plancheck.py
+#   python plancheck.py --dsn postgresql://... --skip-seed --budget 2000 --budget-fn crear_cierre_mensual=20000
+import os
+import re
+import sys
+import json
+import argparse
+import datetime
+
+TABLAS_VIGILADAS = ("jornadas", "insumos", "plan_labores")
+_PARTICION = re.compile(r"_(\d{4}|default)$")  # jornadas_2025, insumos_default -> su tabla madre
+
+
+def _args(argv=None):
+    p = argparse.ArgumentParser(description="Chequeo de planes EXPLAIN de database.py.")
+    p.add_argument("--dsn", default=os.getenv("BENCH_DATABASE_URL"),
+                   help="Postgres de pruebas (o BENCH_DATABASE_URL). Nunca se lee DATABASE_URL.")
+    p.add_argument("--skip-seed", action="store_true", help="reusar los datos bench_* ya sembrados")
+    p.add_argument("--owners", type=int, default=40,
+                   help="owners sintéticos: con pocos, recorrer la tabla entera es legítimamente más barato")
+    p.add_argument("--years", type=float, default=1.0)
+    p.add_argument("--budget", type=float, default=5000.0, help="costo estimado máximo por sentencia")
+    p.add_argument("--budget-fn", action="append", default=[], metavar="FUNCION=COSTO",
+                   help="presupuesto propio de una función (repetible)")
+    p.add_argument("--verbose", action="store_true", help="imprime el plan de cada sentencia")
+    p.add_argument("--out", default=None, help="JSON con los planes y hallazgos")
+    return p.parse_args(argv)
+
+
+def _sentencias(sql: str, params: tuple):
+    """Separa un envío multi-sentencia (p. ej. DELETE + WITH de crear_cierre_mensual) repartiendo los %s."""
+    partes = [s.strip() for s in sql.split(";") if s.strip()]
+    i = 0
+    for parte in partes:
+        n = parte.count("%s")
+        yield parte, params[i:i + n]
+        i += n
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _particiones_chicas(cur):
+    """Particiones de a lo sumo una página (vacías o casi): recorrerlas enteras es lo más barato."""
+    cur.execute(
+        r"""
+        SELECT c.relname FROM pg_class c JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.relname ~ '_(\d{4}|default)$' AND c.relpages <= 1;
+        """
+    )
+    return {r[0] for r in cur.fetchall()}
+
+
+def _casos_extra(db, owner):
+    """Helpers que bench.casos no ejercita."""
+    hoy = datetime.date.today()
+    fecha = hoy.isoformat()
+    lote = db.get_all_fincas(owner)[0]
+    usuario = f"{owner}_plan"
+
+    def update_insumos():
+        for tipo, ultimo in (("Fumigación", db.get_last_fumigacion_by_date), ("Cal", db.get_last_cal_by_date),
+                             ("Herbicida", db.get_last_herbicida_by_date)):
+            db.add_insumo(fecha, lote, tipo, "Etapa 1", "Plancheck", "", 1, 100, owner)
+            db.update_insumo(ultimo(fecha, owner)[0], tipo, fecha, lote, "Etapa 1", "Plancheck", "", 2, 100, owner)
+
+    def add_user():
+        try:
+            db.add_user(usuario, "plancheck")
+        except db.IntegrityError:
+            pass  # ya existe de una corrida con --skip-seed
+
+    return [
+        ("add_user", add_user),
+        ("verify_user", lambda: db.verify_user(usuario, "plancheck")),
+        ("add_trabajador", lambda: db.add_trabajador("Plan", "Check", owner)),
+        ("delete_trabajador", lambda: db.delete_trabajador(
+            owner, next(i for i, n in db.get_trabajadores(owner) if n == "Plan Check"))),
+        ("add_finca", lambda: db.add_finca("Plancheck", owner)),
+        ("set_finca_area", lambda: db.set_finca_area(owner, lote, 2.5, 1000)),
+        ("get_fincas_area", lambda: db.get_fincas_area(owner)),
+        ("delete_finca", lambda: db.delete_finca("Plancheck", owner)),
+        ("list_plans_estado", lambda: db.list_plans(owner, hoy, hoy + datetime.timedelta(days=30), estado="pendiente")),
+        ("update_insumos", update_insumos),
+        ("desarchivar_mes", lambda: db.desarchivar_mes(owner, hoy.replace(day=1), hoy)),
+        # re-guardar sin cambios las filas del mes: mismo plan que un guardado real del editor
+        ("guardar_jornadas_editadas", lambda: db.guardar_jornadas_editadas(
+            owner, db.get_jornadas_between(hoy.replace(day=1), hoy, owner)[:50], (), hoy.replace(day=1), hoy)),
+        ("guardar_insumos_editados", lambda: db.guardar_insumos_editados(
+            owner, db.get_insumos_between(hoy.replace(day=1), hoy, owner)[:50], (), hoy.replace(day=1), hoy)),
+        ("repreciar_insumos", lambda: [db.repreciar_insumos(owner, "Plancheck", 100, hoy.replace(day=1), hoy, dry_run=d)
+                                       for d in (True, False)]),
+        ("mover_insumos_de_lote", lambda: [db.mover_insumos_de_lote(owner, lote, lote, hoy.replace(day=1), hoy,
+                                                                    producto="Plancheck", dry_run=d)
+                                           for d in (True, False)]),
+        ("reasignar_etapa_insumos", lambda: [db.reasignar_etapa_insumos(owner, "Etapa 1", hoy.replace(day=1), hoy,
+                                                                        etapa="Etapa 1", dry_run=d)
+                                             for d in (True, False)]),
+    ]
+
+
+def main(argv=None):
+    a = _args(argv)
+    if not a.dsn:
+        sys.exit("Falta --dsn o BENCH_DATABASE_URL (no se usa DATABASE_URL a propósito).")
+    os.environ["DATABASE_URL"] = a.dsn
+    import database as db
+    import reportes as rep
+    import bench
+
+    for crear in (db.ensure_tenant_ids, db.create_users_table, db.create_trabajadores_table, db.create_fincas_table, db.create_jornadas_table,
+                  db.create_insumos_table, db.create_tarifas_table, db.create_cierres_tables,
+                  db.ensure_cierres_schema, db.create_plan_table,
+                  db.ensure_trabajador_fk, db.ensure_finca_fk, db.ensure_particiones,
+                  db.ensure_integridad_numerica, db.create_archivo_tables, db.create_resumenes_diarios,
+                  db.create_costos_views):
+        crear()
+    if not a.skip_seed:
+        siembra = bench._args(["--owners", str(a.owners), "--years", str(a.years),
+                               "--jornadas-por-dia", "4", "--insumos-por-semana", "3", "--plans", "60"])
+        bench.limpiar(db)
+        _, conteo = bench.sembrar(db, siembra)
+        print(f"Sembrado: {conteo}")
+    owner = f"{bench.OWNER_PREFIX}0"
+
+    # 1) Ejecuta cada helper y junta sus sentencias (la primera aparición de cada texto por función)
+    capturadas = {}
+    with db.capturar_sentencias() as captura:
+        for _, fn in bench.casos(db, rep, owner) + _casos_extra(db, owner):
+            fn()
+    for c in captura:
+        capturadas.setdefault((c["fn"], c["sql"]), c)
+
+    presupuestos = {}
+    for b in a.budget_fn:
+        nombre, _, costo = b.partition("=")
+        presupuestos[nombre.strip()] = float(costo)
+
+    # 2) EXPLAIN de cada una, con app.tenant_id fijado igual que en _run
+    hallazgos, reporte = [], []
+    conn = db.connect_db(); cur = conn.cursor()
+    try:
+        chicas = _particiones_chicas(cur)
+        for (fn_name, _), c in sorted(capturadas.items(), key=lambda kv: kv[0][0]):
+            for stmt, params in _sentencias(c["sql"], c["params"]):
+                if c["tenant"]:
+                    cur.execute("SET LOCAL app.tenant_id = %s;", (c["tenant"],))
+                cur.execute("EXPLAIN (FORMAT JSON) " + stmt, params or None)
+                plan = cur.fetchone()[0]
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+                costo = plan["Total Cost"]
+                primera = " ".join(stmt.split())[:70]
+                reporte.append({"funcion": fn_name, "sentencia": primera, "costo": costo, "plan": plan})
+                if a.verbose:
+                    print(f"\n{fn_name}: {primera}\n{json.dumps(plan, indent=1)[:3000]}")
+                por_tenant = "tenant_id" in stmt.lower()
+                for nodo in _nodos(plan):
+                    rel = nodo.get("Relation Name")
+                    if por_tenant and nodo["Node Type"] == "Seq Scan" \
+                            and rel not in chicas and _PARTICION.sub("", rel or "") in TABLAS_VIGILADAS:
+                        hallazgos.append(f"{fn_name}: Seq Scan sobre {rel} ({primera}…)")
+                limite = presupuestos.get(fn_name, a.budget)
+                if costo > limite:
+                    hallazgos.append(f"{fn_name}: costo estimado {costo:,.0f} > presupuesto {limite:,.0f} ({primera}…)")
+            conn.rollback()
+    finally:
+        conn.rollback()
+        conn.close()
+
+    # 3) Cobertura: todo helper de datos debe haber pasado por aquí
+    vistas = {fn_name for fn_name, _ in capturadas}
+    helpers = sorted(n for n, f in vars(db).items()
+                     if callable(f) and getattr(f, "db_kind", None) in ("read", "write"))
+    for n in helpers:
+        if n not in vistas:
+            hallazgos.append(f"{n}: sin sentencias capturadas (agrega un caso en bench.casos o plancheck)")
+
+    print(f"\n{'función':<32} {'costo':>10}  sentencia")
+    for r in reporte:
+        print(f"{r['funcion']:<32} {r['costo']:>10,.1f}  {r['sentencia']}")
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as fh:
+            json.dump({"planes": reporte, "hallazgos": hallazgos}, fh, indent=2, ensure_ascii=False, default=str)
+    if hallazgos:
+        print("\nFALLAS:")
+        for h in hallazgos:
+            print("  -", h)
+        return 1
+    print(f"\nOK: {len(reporte)} sentencias de {len(vistas)} funciones revisadas.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
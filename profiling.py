@@ -0,0 +1,132 @@
+# profiling.py — tiempos por sección de cada rerun de Streamlit (opt-in con APP_PROFILE=1)
+import os
+import json
+import time
+import threading
+import contextlib
+
+APP_PROFILE = os.getenv("APP_PROFILE", "0") == "1"
+APP_PROFILE_LOG = os.getenv("APP_PROFILE_LOG")                 # JSONL opcional, una línea por rerun
+APP_PROFILE_DIR = os.getenv("APP_PROFILE_DIR", "profiles")     # destino de las capturas completas
+APP_PROFILE_ENGINE = os.getenv("APP_PROFILE_ENGINE", "cprofile")  # "cprofile" o "pyinstrument"
+
+_KEY = "__perfil__"
+_NULL = contextlib.nullcontext()
+_LOCAL = threading.local()  # cada sesión corre su script en su propio hilo
+_LOG_LOCK = threading.Lock()
+
+
+def _rec():
+    return getattr(_LOCAL, "rec", None)
+
+
+def _start_capture():
+    if APP_PROFILE_ENGINE == "pyinstrument":
+        try:
+            from pyinstrument import Profiler  # opcional
+            prof = Profiler()
+            prof.start()
+            return ("pyinstrument", prof)
+        except ImportError:
+            pass
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    return ("cprofile", prof)
+
+
+def _stop_capture(captura, rec) -> str:
+    engine, prof = captura
+    os.makedirs(APP_PROFILE_DIR, exist_ok=True)
+    base = os.path.join(APP_PROFILE_DIR, f"rerun_{time.strftime('%Y%m%d_%H%M%S')}_{int(rec['t0'] * 1000) % 1000:03d}")
+    if engine == "pyinstrument":
+        prof.stop()
+        path = base + ".html"
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(prof.output_html())
+    else:
+        prof.disable()
+        path = base + ".prof"  # ábrelo con snakeviz o `python -m pstats`
+        prof.dump_stats(path)
+    return path
+
+
+def _flush(rec, terminado: bool):
+    rec["total_ms"] = round(((rec.get("t_fin") or time.perf_counter()) - rec["t0_perf"]) * 1000, 3)
+    rec["terminado"] = terminado
+    if APP_PROFILE_LOG:
+        linea = {k: v for k, v in rec.items() if k not in ("t0_perf", "t_marca", "t_fin")}
+        with _LOG_LOCK:
+            try:
+                with open(APP_PROFILE_LOG, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(linea, default=str) + "\n")
+            except OSError:
+                pass  # el perfilado nunca debe tumbar la app
+
+
+def iniciar_rerun(estado, capturar: bool = False):
+    """
+    Arranca la medición de este rerun. `estado` es st.session_state: ahí queda el registro
+    para que, si el rerun anterior terminó con st.stop(), se registre ahora como no terminado.
+    Con capturar=True se graba un perfil completo (cProfile/pyinstrument) de este rerun.
+    """
+    if not APP_PROFILE:
+        return
+    previo = estado.get(_KEY)
+    if previo and previo.get("terminado") is None:
+        vieja = getattr(_LOCAL, "captura", None)
+        if vieja is not None:  # mismo hilo: se guarda lo capturado hasta el st.stop()
+            previo["captura"] = _stop_capture(vieja, previo)
+        _flush(previo, terminado=False)
+    ahora = time.perf_counter()
+    rec = {"t0": time.time(), "t0_perf": ahora, "t_marca": ahora, "pagina": None, "secciones": [],
+           "terminado": None, "captura": None}
+    _LOCAL.rec = rec
+    _LOCAL.captura = _start_capture() if capturar else None
+    estado[_KEY] = rec
+
+
+def marca(nombre: str):
+    """Cierra el tramo desde la marca anterior (o el inicio) con este nombre."""
+    rec = _rec()
+    if rec is None:
+        return
+    ahora = time.perf_counter()
+    rec["secciones"].append({"seccion": nombre, "ms": round((ahora - rec["t_marca"]) * 1000, 3)})
+    rec["t_marca"] = ahora
+    rec["t_fin"] = ahora
+
+
+def seccion(nombre: str):
+    """Context manager para medir un bloque concreto (DataFrame, Styler, PDF...)."""
+    if _rec() is None:
+        return _NULL
+    return _seccion(nombre)
+
+
+@contextlib.contextmanager
+def _seccion(nombre: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec = _rec()
+        if rec is not None:
+            ahora = time.perf_counter()
+            rec["secciones"].append({"seccion": nombre, "ms": round((ahora - t) * 1000, 3)})
+            rec["t_fin"] = ahora
+
+
+def cerrar_rerun(pagina: str | None = None):
+    """Termina la medición y devuelve el registro (o None si el perfilado está apagado)."""
+    rec = _rec()
+    if rec is None:
+        return None
+    rec["pagina"] = pagina
+    rec["t_fin"] = time.perf_counter()
+    captura = getattr(_LOCAL, "captura", None)
+    if captura is not None:
+        rec["captura"] = _stop_capture(captura, rec)
+    _flush(rec, terminado=True)
+    _LOCAL.rec = _LOCAL.captura = None
+    return rec
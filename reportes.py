@@ -0,0 +1,157 @@
+# reportes.py — transformaciones pandas de los reportes (sin Streamlit, para poder medirlas)
+from io import BytesIO
+from datetime import date
+import pandas as pd
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+COLS_JORNADAS = ["ID","Trabajador","Fecha","Lote","Actividad","Días","Horas Normales","Horas Extra"]
+COLS_INSUMOS = ["ID","Fecha","Lote","Tipo","Etapa","Producto","Dosis","Cantidad","Precio Unitario","Costo Total"]
+
+
+def df_jornadas(rows) -> pd.DataFrame:
+    """Filas de get_all_jornadas / get_jornadas_between -> DataFrame tipado."""
+    if isinstance(rows, pd.DataFrame):
+        return rows  # ya tipado por database.get_jornadas_df
+    df = pd.DataFrame(rows, columns=COLS_JORNADAS)
+    df["Fecha"] = pd.to_datetime(df["Fecha"])
+    # días/horas son INTEGER/NUMERIC NOT NULL con CHECK en la base: basta con el tipo, no hay basura que limpiar
+    return df.astype({"Días": int, "Horas Normales": float, "Horas Extra": float})
+
+
+def resumen_nomina_mes(df: pd.DataFrame, pago_dia: float, pago_hex: float) -> pd.DataFrame:
+    """Preview de nómina del cierre mensual: Días, Horas Extra, pagos y Total por trabajador."""
+    resumen = df.groupby("Trabajador", as_index=False, observed=True)[["Días","Horas Extra"]].sum()
+    resumen["Pago por Días"]    = resumen["Días"] * pago_dia
+    resumen["Pago Horas Extra"] = resumen["Horas Extra"] * pago_hex
+    resumen["Total"]            = resumen["Pago por Días"] + resumen["Pago Horas Extra"]
+    return resumen
+
+
+def resumen_por_trabajador(df: pd.DataFrame, pago_dia: float, pago_hex: float, col_total: str) -> pd.DataFrame:
+    """Resumen de Ver Registros / Reporte Semanal; `col_total` es el nombre de la columna de total."""
+    # observed=True: con Trabajador category (get_jornadas_df) no salen filas de trabajadores sin jornadas
+    resumen = df.groupby("Trabajador", as_index=False, observed=True).agg({"Días":"sum","Horas Extra":"sum"})
+    resumen = resumen.rename(columns={"Días":"Días trabajados"})
+    resumen["Días a pagar"] = resumen["Días trabajados"]
+    resumen["Pago por Días"] = resumen["Días a pagar"] * pago_dia
+    resumen["Pago Horas Extra"] = resumen["Horas Extra"] * pago_hex
+    resumen[col_total] = resumen["Pago por Días"] + resumen["Pago Horas Extra"]
+    return resumen
+
+
+def filtrar_semana(df: pd.DataFrame, ini, fin) -> pd.DataFrame:
+    mask = (df["Fecha"].dt.date >= ini) & (df["Fecha"].dt.date <= fin)
+    return df.loc[mask].copy()
+
+
+def detalle_semana(df_sem: pd.DataFrame) -> pd.DataFrame:
+    df_sem_orden = df_sem.sort_values(["Trabajador","Fecha"]).copy()
+    df_detalle = df_sem_orden[["Fecha","Trabajador","Lote","Actividad","Días","Horas Extra"]].copy()
+    df_detalle.rename(columns={"Días":"Días trabajados"}, inplace=True)
+    df_detalle["Fecha"] = df_detalle["Fecha"].dt.strftime("%Y-%m-%d")
+    df_detalle["Días a pagar"] = df_detalle["Días trabajados"]
+    return df_detalle
+
+
+def detalle_semana_con_pagos(df_detalle: pd.DataFrame, pago_dia: float, pago_hex: float) -> pd.DataFrame:
+    """Detalle semanal + columnas de pago por fila (para el CSV)."""
+    df = df_detalle.copy()
+    df["Pago por Días (₡)"] = (df["Días a pagar"] * pago_dia).round(2)
+    df["Pago Horas Extra (₡)"] = (df["Horas Extra"] * pago_hex).round(2)
+    df["Total Fila (₡)"] = df["Pago por Días (₡)"] + df["Pago Horas Extra (₡)"]
+    return df
+
+
+def df_insumos_tipo(rows, tipo: str):
+    """Filas de get_insumos_by_tipo (o DataFrame de get_insumos_df) -> (DataFrame con nombres por tipo, formato para Styler)."""
+    df_i = pd.DataFrame(rows, columns=COLS_INSUMOS)
+    df_i["Fecha"] = pd.to_datetime(df_i["Fecha"]).dt.strftime("%Y-%m-%d")
+    # cantidad/precio son NUMERIC y costo_total generado: sólo Dosis es texto libre y se interpreta aquí
+    df_i = df_i.astype({"Cantidad": float, "Precio Unitario": float, "Costo Total": float})
+    df_i["Dosis"] = pd.to_numeric(df_i["Dosis"], errors="coerce")
+    if tipo == "Fumigación":
+        df_i = df_i.rename(columns={"Etapa":"Plaga/Control","Cantidad":"Litros","Precio Unitario":"Precio por litro (₡)"})
+    elif tipo == "Herbicida":
+        df_i = df_i.rename(columns={"Etapa":"Tipo de herbicida","Cantidad":"Litros","Precio Unitario":"Precio por litro (₡)"})
+    elif tipo == "Cal":
+        df_i = df_i.rename(columns={"Etapa":"Tipo de cal","Producto":"Presentación","Cantidad":"Sacos (45 kg)","Precio Unitario":"Precio por saco (₡)"})
+    elif tipo == "Abono":
+        df_i = df_i.rename(columns={"Etapa":"Etapa de abonado","Dosis":"Dosis (g/planta)","Cantidad":"Sacos","Precio Unitario":"Precio por saco (₡)"})
+    money = [c for c in ["Precio por litro (₡)","Precio por saco (₡)","Precio Unitario","Costo Total"] if c in df_i.columns]
+    qty   = [c for c in ["Litros","Sacos (45 kg)","Sacos","Cantidad"] if c in df_i.columns]
+    dose  = [c for c in ["Dosis","Dosis (g/planta)"] if c in df_i.columns]
+    fmt = {}; fmt.update({c:"₡{:,.0f}" for c in money}); fmt.update({c:"{:,.1f}" for c in qty}); fmt.update({c:"{:,.0f}" for c in dose})
+    return df_i, fmt
+
+
+def costos_por_lote(df: pd.DataFrame, pago_dia: float, pago_hex: float, por: str | None = None) -> pd.DataFrame:
+    """
+    Filas de database.get_costos_lote_df -> una fila por Mes y Lote con Mano de obra, una columna por tipo de
+    insumo y Total. La mano de obra de los meses cerrados va con las tarifas de su cierre; `pago_dia` y
+    `pago_hex` (las vigentes) sólo se usan en los abiertos. `por`: "Hectáreas" o "Plantas" divide por el área
+    del lote; los lotes sin ese dato quedan fuera.
+    """
+    dia = df["Tarifa Día"].fillna(pago_dia)
+    extra = df["Tarifa Hora Extra"].fillna(pago_hex)
+    costo = df["Costo Insumos"] + df["Días"] * dia + df["Horas Extra"] * extra
+    tabla = df.assign(Costo=costo).pivot_table(index=["Mes", "Lote"], columns="Tipo", values="Costo",
+                                               aggfunc="sum", fill_value=0.0, observed=True)
+    tipos = sorted(tabla.columns, key=lambda t: (t != "Mano de obra", t))
+    tabla = tabla[tipos]
+    tabla["Total"] = tabla.sum(axis=1)
+    if por:
+        area = df.groupby("Lote", observed=True)[por].first()
+        tabla = tabla.div(area.reindex(tabla.index.get_level_values("Lote")).to_numpy(), axis=0).dropna()
+    tabla = tabla.reset_index()
+    tabla.columns.name = None
+    tabla["Mes"] = tabla["Mes"].dt.strftime("%Y-%m")
+    return tabla
+
+
+def cambios_editor(original: pd.DataFrame, editado: pd.DataFrame, clave: str = "ID"):
+    """
+    Diferencia entre la grilla cargada y la que devuelve st.data_editor: (filas cambiadas, ids borrados).
+    Las filas agregadas en la grilla (sin clave) se ignoran: los registros nuevos van por los formularios.
+    """
+    base = original.set_index(clave)
+    nuevo = editado.dropna(subset=[clave]).astype({clave: int}).set_index(clave)
+    borrados = [int(i) for i in base.index.difference(nuevo.index)]
+    comunes = nuevo.index.intersection(base.index)
+    antes, despues = base.loc[comunes, nuevo.columns].astype(object), nuevo.loc[comunes].astype(object)
+    iguales = (antes == despues) | (antes.isna() & despues.isna())
+    return nuevo.loc[comunes[~iguales.all(axis=1).to_numpy()]].reset_index(), borrados
+
+
+def filas_para_guardar(df: pd.DataFrame) -> list:
+    """Filas del editor -> tuplas con tipos de Python (fechas ISO), listas para la cola offline."""
+    def valor(v):
+        if v is None or (not isinstance(v, str) and pd.isna(v)):
+            return None
+        if isinstance(v, (pd.Timestamp, date)):
+            return v.strftime("%Y-%m-%d")
+        return v.item() if hasattr(v, "item") else v
+    return [tuple(valor(v) for v in fila) for fila in df.itertuples(index=False, name=None)]
+
+
+def pdf_resumen(res_df: pd.DataFrame, ini, fin) -> bytes:
+    """PDF del resumen semanal por trabajador (Trabajador, Días a pagar, Horas Extra, Total a Pagar)."""
+    buffer = BytesIO(); c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    c.setFont("Helvetica-Bold", 14); c.drawString(50, height-50, "Resumen por trabajador")
+    c.setFont("Helvetica", 11); c.drawString(50, height-70, f"Semana: {ini} a {fin} (Dom–Sáb)")
+    y = height-110; c.setFont("Helvetica-Bold", 11)
+    c.drawString(50,y,"Trabajador"); c.drawString(250,y,"Días a pagar"); c.drawString(360,y,"Horas Extra"); c.drawString(460,y,"Total (₡)")
+    c.line(50,y-3,560,y-3); y -= 20; c.setFont("Helvetica",10)
+    for _, row in res_df.iterrows():
+        nombre = str(row["Trabajador"]); nombre = (nombre[:34]+"…") if len(nombre)>35 else nombre
+        c.drawString(50,y,nombre)
+        c.drawRightString(330,y,f"{row['Días a pagar']:.0f}")
+        c.drawRightString(430,y,f"{row['Horas Extra']:.1f}")
+        c.drawRightString(560,y,f"{row['Total a Pagar']:,.0f}")
+        y -= 18
+        if y < 60:
+            c.showPage(); y = height-50; c.setFont("Helvetica-Bold", 11)
+            c.drawString(50,y,"Trabajador"); c.drawString(250,y,"Días a pagar"); c.drawString(360,y,"Horas Extra"); c.drawString(460,y,"Total (₡)")
+            c.line(50,y-3,560,y-3); y -= 20; c.setFont("Helvetica",10)
+    c.save(); pdf = buffer.getvalue(); buffer.close(); return pdf